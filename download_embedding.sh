@@ -23,6 +23,11 @@
 #   5) Uses curl (with –L and –b <cookie_jar>) to fetch the actual file bytes.
 #   6) Verifies that the downloaded file is not an HTML page.
 #   7) Creates “data/” if it doesn’t exist, then moves the file there.
+#   8) (Optional) With EMBED_FORMAT=npy, converts the JSON into the binary,
+#      memory-mapped store used by the recommendation service:
+#        EMBED_FORMAT=npy EMBED_DTYPE=float16 ./download_embedding.sh
+#      → data/embeddings/output_embeddings.{npy,norms.npy,texts,offsets.npy,meta.json}
+#      Add EMBED_INDEX=hnsw (or ivf) to also build the ANN index next to it.
 #
 # Adjust FILEID and OUTPUT_NAME below to match your use case.
 # ------------------------------------------------------------------------------
@@ -92,4 +97,24 @@ fi
 mv "${OUTPUT_NAME}" data/
 echo "📦 Moved '${OUTPUT_NAME}' ➔ data/${OUTPUT_NAME}"
 
+# 14) (Optional) Convert JSON → binary memmap store for the recommendation service
+if [ "${EMBED_FORMAT:-json}" = "npy" ]; then
+  SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+  DATA_DIR="$(pwd)/data"
+  mkdir -p "${DATA_DIR}/embeddings"
+  (cd "${SCRIPT_DIR}/services/recommendation" && \
+    python3 embedding_store.py convert \
+      "${DATA_DIR}/${OUTPUT_NAME}" \
+      "${DATA_DIR}/embeddings/output_embeddings" \
+      --dtype "${EMBED_DTYPE:-float32}") || { echo "⚠️  Conversion to binary store failed."; exit 1; }
+  echo "🗜️  Binary store written to data/embeddings/output_embeddings.*"
+
+  # Optional ANN index next to the store: EMBED_INDEX=hnsw|ivf (needs faiss-cpu)
+  if [ -n "${EMBED_INDEX:-}" ]; then
+    (cd "${SCRIPT_DIR}/services/recommendation" && \
+      python3 ann_index.py build "${DATA_DIR}/embeddings/output_embeddings" --kind "${EMBED_INDEX}") \
+      || { echo "⚠️  Building ${EMBED_INDEX} index failed."; exit 1; }
+  fi
+fi
+
 # Done
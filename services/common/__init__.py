@@ -0,0 +1 @@
+# services/common: module dùng chung giữa các service (COPY vào /app/common trong image)
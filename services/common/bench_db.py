@@ -0,0 +1,136 @@
+# services/common/bench_db.py
+"""
+Benchmark đọc/ghi đồng thời trên SQLite: cấu hình cũ vs lớp db.py.
+
+  baseline : sqlite3.connect mới cho mỗi thao tác, rollback journal, pragma mặc định
+             (giống product service cũ và engine SQLModel mặc định).
+  tuned    : WAL + pragma của db.py, pool kết nối, reader dùng pool read-only.
+
+Mỗi kịch bản dùng 1 file DB riêng có bảng review giả lập (index theo product_id);
+reader tra review theo ASIN ngẫu nhiên, writer INSERT + commit từng dòng.
+
+    python -m common.bench_db --rows 200000 --readers 8 --writers 2 --duration 10
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common.db import SQLitePool, connect
+
+
+def _seed(path: str, rows: int, products: int):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE review (id INTEGER PRIMARY KEY, product_id TEXT, rating REAL, text TEXT)")
+    conn.executemany(
+        "INSERT INTO review (product_id, rating, text) VALUES (?, ?, ?)",
+        ((f"B{i % products:07d}", float(i % 5 + 1), "lorem ipsum " * 20) for i in range(rows)),
+    )
+    conn.execute("CREATE INDEX ix_review_product_id ON review (product_id)")
+    conn.commit()
+    conn.close()
+
+
+READ_SQL = "SELECT id, rating, text FROM review WHERE product_id = ? LIMIT 10"
+WRITE_SQL = "INSERT INTO review (product_id, rating, text) VALUES (?, ?, ?)"
+
+
+def _run(path: str, mode: str, readers: int, writers: int, duration: float, products: int) -> dict:
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.time() + duration
+    read_pool = SQLitePool(path, size=readers, readonly=True) if mode == "tuned" else None
+    write_pool = SQLitePool(path, size=max(1, writers)) if mode == "tuned" else None
+
+    def read_once(asin):
+        if mode == "tuned":
+            with read_pool.connection() as conn:
+                conn.execute(READ_SQL, (asin,)).fetchall()
+        else:
+            conn = sqlite3.connect(path)
+            try:
+                conn.execute(READ_SQL, (asin,)).fetchall()
+            finally:
+                conn.close()
+
+    def write_once(asin):
+        if mode == "tuned":
+            with write_pool.connection() as conn:
+                conn.execute(WRITE_SQL, (asin, 5.0, "bench"))
+                conn.commit()
+        else:
+            conn = sqlite3.connect(path)
+            try:
+                conn.execute(WRITE_SQL, (asin, 5.0, "bench"))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def worker(kind):
+        rng = random.Random()
+        op = read_once if kind == "reads" else write_once
+        done = errors = 0
+        while time.time() < stop:
+            try:
+                op(f"B{rng.randrange(products):07d}")
+                done += 1
+            except sqlite3.OperationalError:
+                # "database is locked" khi hết timeout mặc định
+                errors += 1
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=("reads",)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("writes",)) for _ in range(writers)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    for pool in (read_pool, write_pool):
+        if pool:
+            pool.close()
+    return {
+        "mode": mode,
+        "reads_per_s": counts["reads"] / elapsed,
+        "writes_per_s": counts["writes"] / elapsed,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite concurrency benchmark (baseline vs WAL + pool)")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for mode in ("baseline", "tuned"):
+            path = os.path.join(tmp, f"{mode}.db")
+            _seed(path, args.rows, args.products)
+            if mode == "tuned":
+                # chuyển file sang WAL trước khi reader read-only mở
+                connect(path).close()
+            results.append(_run(path, mode, args.readers, args.writers, args.duration, args.products))
+
+    print(f"{'mode':<10}{'reads/s':>12}{'writes/s':>12}{'errors':>8}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['reads_per_s']:>12.0f}{r['writes_per_s']:>12.0f}{r['errors']:>8}")
+    base, tuned = results
+    if base["reads_per_s"] and base["writes_per_s"]:
+        print(f"→ reads x{tuned['reads_per_s'] / base['reads_per_s']:.1f}, "
+              f"writes x{tuned['writes_per_s'] / base['writes_per_s']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
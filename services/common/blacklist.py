@@ -0,0 +1,104 @@
+# services/common/blacklist.py
+"""
+Bộ lọc blacklist theo title, dùng chung cho Product Service và Rec Service.
+
+Danh sách term được compile 1 lần thành automaton Aho-Corasick (nếu có pyahocorasick)
+hoặc 1 regex gộp, nên mỗi title chỉ quét 1 lượt thay vì `for term in blacklist`.
+Ngữ nghĩa giữ như cũ: title bị lọc nếu chứa (chuỗi con, không phân biệt hoa/thường)
+bất kỳ term nào.
+
+Term đọc từ file (mỗi dòng 1 term, `#` là comment):
+  • blacklist.txt          : dùng chung (catalog embedding + /products)
+  • blacklist_products.txt : term chỉ áp dụng thêm cho /products
+BLACKLIST_FILES (phân tách bằng os.pathsep) ghi đè danh sách file mặc định của service.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+try:
+    import ahocorasick  # pyahocorasick, tuỳ chọn
+except ImportError:
+    ahocorasick = None
+
+BLACKLIST_DIR = Path(__file__).resolve().parent
+DEFAULT_FILES = [BLACKLIST_DIR / "blacklist.txt"]
+PRODUCT_FILES = DEFAULT_FILES + [BLACKLIST_DIR / "blacklist_products.txt"]
+
+
+def load_terms(paths: Iterable) -> List[str]:
+    """Đọc term từ các file, bỏ dòng trống / comment, loại trùng (giữ thứ tự)."""
+    terms, seen = [], set()
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                term = line.strip()
+                if not term or term.startswith("#"):
+                    continue
+                key = term.lower()
+                if key not in seen:
+                    seen.add(key)
+                    terms.append(term)
+    return terms
+
+
+class BlacklistMatcher:
+    def __init__(self, terms: Iterable[str]):
+        self.terms = sorted({t.lower() for t in terms if t})
+        self._automaton = None
+        self._regex = None
+        if not self.terms:
+            self.backend = "empty"
+        elif ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for i, term in enumerate(self.terms):
+                automaton.add_word(term, (i, term))
+            automaton.make_automaton()
+            self._automaton = automaton
+            self.backend = "aho-corasick"
+        else:
+            # Term dài đứng trước để alternation không dừng sớm ở term ngắn hơn
+            pattern = "|".join(re.escape(t) for t in sorted(self.terms, key=len, reverse=True))
+            self._regex = re.compile(pattern)
+            self.backend = "regex"
+
+    def first_match(self, text: str) -> Optional[str]:
+        """Term đầu tiên tìm thấy trong text (None nếu không có)."""
+        if not text or self.backend == "empty":
+            return None
+        lowered = text.lower()
+        if self._automaton is not None:
+            for _, (_, term) in self._automaton.iter(lowered):
+                return term
+            return None
+        m = self._regex.search(lowered)
+        return m.group(0) if m else None
+
+    def matches(self, text: str) -> bool:
+        return self.first_match(text) is not None
+
+    def mask(self, texts: Iterable[str]) -> bytearray:
+        """Bitmask 1 byte/title (1 = bị lọc), tính 1 lần lúc load để request không phải quét lại."""
+        return bytearray(1 if self.matches(t) else 0 for t in texts)
+
+    def info(self) -> dict:
+        return {"backend": self.backend, "terms": len(self.terms)}
+
+
+def _env_files(default: List[Path]) -> List[str]:
+    value = os.getenv("BLACKLIST_FILES")
+    if not value:
+        return [str(p) for p in default]
+    return [p for p in value.split(os.pathsep) if p]
+
+
+def load_matcher(files: Optional[Iterable] = None) -> BlacklistMatcher:
+    """Matcher cho catalog embedding (blacklist.txt); files=None → BLACKLIST_FILES hoặc mặc định."""
+    return BlacklistMatcher(load_terms(files if files is not None else _env_files(DEFAULT_FILES)))
+
+
+def load_product_matcher() -> BlacklistMatcher:
+    """Matcher cho /products (blacklist.txt + blacklist_products.txt)."""
+    return BlacklistMatcher(load_terms(_env_files(PRODUCT_FILES)))
@@ -0,0 +1,27 @@
+# services/common/chunks.py
+"""Chia file văn bản lớn (JSONL, metadata) thành các đoạn byte để parse song song."""
+
+import os
+from typing import List, Tuple
+
+
+def line_ranges(path, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Các đoạn [start, end) dài ~chunk_bytes, mỗi đoạn kết thúc đúng sau ký tự xuống dòng."""
+    size = os.path.getsize(path)
+    ranges, start = [], 0
+    with open(path, "rb") as f:
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_lines(path, start: int, end: int) -> List[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).splitlines()
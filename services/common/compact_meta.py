@@ -0,0 +1,175 @@
+# services/common/compact_meta.py
+"""
+Metadata sản phẩm dạng cột, nhỏ gọn, giữ trong RAM của Product Service.
+
+Thay cho list/dict các dict Python (mỗi record vài chục object str/list/dict):
+
+  • Chỉ giữ các field cần (PRODUCT_META_FIELDS), mỗi field là 1 cột:
+      text   : chuỗi nhiều giá trị khác nhau (title, description, imUrl) → 1 blob UTF-8
+               + mảng offset (array 'Q'), giải mã khi đọc
+      dict   : giá trị lặp lại nhiều (brand, categories, ...) → bảng giá trị duy nhất
+               (chuỗi sys.intern) + mảng mã (array 'I'), 0 = thiếu. Giá trị không phải
+               chuỗi (list/dict) lưu dạng JSON, mỗi lần đọc giải mã ra object mới → các dòng
+               và các request không dùng chung 1 object có thể bị sửa.
+      number : số (price) → array 'd' + 1 byte loại/dòng (thiếu / float / int), int đọc ra
+               vẫn là int như dữ liệu gốc
+    Loại cột được chọn tự động khi build theo kiểu và tỉ lệ giá trị trùng.
+  • ASIN → row id qua 1 dict; ASIN cũng nằm trong 1 cột text.
+
+Đọc: get()/get_many() dựng lại dict chỉ với các field được hỏi (vd asin,title,imUrl).
+"""
+
+import json
+import math
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+DEFAULT_FIELDS = ("title", "imUrl", "price", "brand", "categories", "description")
+# Field chuỗi có tỉ lệ giá trị khác nhau / số dòng dưới ngưỡng này → mã hoá từ điển
+DICT_RATIO = 0.5
+
+
+class TextColumn:
+    kind = "text"
+
+    def __init__(self, values: Sequence[Optional[str]]):
+        parts, offsets, present = [], array("Q", [0]), bytearray(len(values))
+        size = 0
+        for i, v in enumerate(values):
+            if v is not None:
+                b = v.encode("utf-8")
+                parts.append(b)
+                size += len(b)
+                present[i] = 1
+            offsets.append(size)
+        self.blob = b"".join(parts)
+        self.offsets = offsets
+        self.present = present
+
+    def get(self, row: int) -> Optional[str]:
+        if not self.present[row]:
+            return None
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def nbytes(self) -> int:
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets) + len(self.present)
+
+
+class DictColumn:
+    kind = "dict"
+
+    def __init__(self, values: Sequence[Any]):
+        # mã 0 = thiếu; giá trị là chuỗi gốc (intern) hoặc JSON của list/dict
+        self.values: List[Optional[str]] = [None]
+        self.is_json = bytearray(1)
+        index: Dict[tuple, int] = {}
+        codes = array("I")
+        for v in values:
+            if v is None:
+                codes.append(0)
+                continue
+            text = v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+            key = (text, not isinstance(v, str))
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(self.values)
+                self.values.append(sys.intern(text))
+                self.is_json.append(key[1])
+            codes.append(code)
+        self.codes = codes
+
+    def get(self, row: int) -> Any:
+        code = self.codes[row]
+        value = self.values[code]
+        return json.loads(value) if self.is_json[code] else value
+
+    def nbytes(self) -> int:
+        uniq = sum(len(v) for v in self.values[1:])
+        return self.codes.itemsize * len(self.codes) + uniq + len(self.is_json)
+
+
+class NumberColumn:
+    kind = "number"
+    MISSING, FLOAT, INT = 0, 1, 2
+
+    def __init__(self, values: Sequence[Optional[float]]):
+        self.data = array("d", (math.nan if v is None else float(v) for v in values))
+        self.types = bytearray(
+            self.MISSING if v is None else self.INT if isinstance(v, int) else self.FLOAT for v in values
+        )
+
+    def get(self, row: int):
+        t = self.types[row]
+        if t == self.MISSING:
+            return None
+        v = self.data[row]
+        return int(v) if t == self.INT else v
+
+    def nbytes(self) -> int:
+        return self.data.itemsize * len(self.data) + len(self.types)
+
+
+def _make_column(values: List[Any]):
+    present = [v for v in values if v is not None]
+    # int lớn hơn 2^53 không giữ chính xác trong double → để DictColumn
+    if present and all(isinstance(v, float) or (type(v) is int and abs(v) <= 2 ** 53) for v in present):
+        return NumberColumn(values)
+    if present and all(isinstance(v, str) for v in present):
+        distinct = len(set(present))
+        if distinct > DICT_RATIO * len(present):
+            return TextColumn(values)
+    return DictColumn(values)
+
+
+class CompactMetadata:
+    def __init__(self, records: Iterable[dict], fields: Sequence[str] = DEFAULT_FIELDS):
+        """records: các dict metadata có "asin" (thứ tự giữ nguyên → row id)."""
+        self.fields = tuple(f for f in fields if f != "asin")
+        asins: List[str] = []
+        columns: Dict[str, List[Any]] = {f: [] for f in self.fields}
+        for rec in records:
+            asins.append(rec["asin"])
+            for f in self.fields:
+                columns[f].append(rec.get(f))
+        self._asins = TextColumn(asins)
+        self.rows: Dict[str, int] = {asin: i for i, asin in enumerate(asins)}
+        self.columns = {f: _make_column(values) for f, values in columns.items()}
+        self.size = len(asins)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, asin: str) -> bool:
+        return asin in self.rows
+
+    def asin(self, row: int) -> str:
+        return self._asins.get(row)
+
+    def row(self, row: int, fields: Optional[Sequence[str]] = None) -> dict:
+        """Dict của 1 dòng; fields=None → asin + mọi field đã giữ. Field thiếu giá trị bị bỏ qua."""
+        out = {}
+        for f in (("asin",) + self.fields) if fields is None else fields:
+            v = self.asin(row) if f == "asin" else (self.columns[f].get(row) if f in self.columns else None)
+            if v is not None:
+                out[f] = v
+        return out
+
+    def get(self, asin: str, fields: Optional[Sequence[str]] = None) -> Optional[dict]:
+        row = self.rows.get(asin)
+        return None if row is None else self.row(row, fields)
+
+    def get_many(self, asins: Iterable[str], fields: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        out = {}
+        for asin in asins:
+            row = self.rows.get(asin)
+            if row is not None:
+                out[asin] = self.row(row, fields)
+        return out
+
+    def info(self) -> dict:
+        return {
+            "rows": self.size,
+            "columns": {f: {"kind": c.kind, "bytes": c.nbytes()} for f, c in self.columns.items()},
+            "bytes": self._asins.nbytes() + sum(c.nbytes() for c in self.columns.values()),
+        }
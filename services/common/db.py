@@ -0,0 +1,145 @@
+# services/common/db.py
+"""
+Lớp SQLite dùng chung cho product / review / user service.
+
+  • WAL: reader không chặn writer và ngược lại (mặc định rollback journal khoá cả file).
+  • Pragma: synchronous=NORMAL (an toàn với WAL), cache_size, mmap_size, temp_store, busy_timeout
+    — chỉnh qua env SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT_MS.
+  • Pool: SQLitePool cho code dùng sqlite3 trực tiếp, make_engine() cho SQLModel/SQLAlchemy
+    (QueuePool thay cho kết nối mới mỗi request).
+  • Read-only: đường đọc mở file với mode=ro, không giữ khoá ghi và không lỡ tay ghi.
+
+Lưu ý: đọc DB ở chế độ WAL cần quyền ghi thư mục chứa DB (file -shm), nên volume
+không được mount :ro.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Số âm = KiB (-65536 → 64 MB page cache mỗi kết nối)
+CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+
+def apply_pragmas(conn, readonly: bool = False):
+    """Pragma cho 1 kết nối mới (dùng được cho sqlite3.Connection lẫn DBAPI connection của SQLAlchemy)."""
+    cur = conn.cursor()
+    if not readonly:
+        # journal_mode được lưu trong file DB, chỉ cần set từ phía ghi
+        try:
+            cur.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            # vd file/volume chỉ đọc: vẫn chạy được với journal cũ
+            print(f"⚠️ Could not enable WAL: {e}")
+    cur.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    cur.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+    cur.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cur.close()
+
+
+def _ro_uri(path) -> str:
+    return f"file:{Path(path).resolve()}?mode=ro"
+
+
+def connect(path, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(_ro_uri(path), uri=True, check_same_thread=False,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+    else:
+        conn = sqlite3.connect(str(path), check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+    apply_pragmas(conn, readonly=readonly)
+    return conn
+
+
+class SQLitePool:
+    """Pool kết nối sqlite3 cố định kích thước; tạo lười, mượn/trả qua context manager."""
+
+    def __init__(self, path, size: int = POOL_SIZE, readonly: bool = False, timeout: float = 30.0):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return connect(self.path, readonly=self.readonly)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=self.timeout)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            if not self.readonly:
+                conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+    def info(self) -> dict:
+        return {"path": str(self.path), "readonly": self.readonly, "size": self.size,
+                "created": self._created, "idle": self._idle.qsize()}
+
+
+def make_engine(path, readonly: bool = False, pool_size: Optional[int] = None, echo: bool = False):
+    """SQLAlchemy engine (dùng với SQLModel) có QueuePool + pragma ở mỗi kết nối mới."""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import QueuePool
+
+    if readonly:
+        url = f"sqlite:///{_ro_uri(path)}&uri=true"
+    else:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        url = f"sqlite:///{path}"
+    engine = create_engine(
+        url,
+        echo=echo,
+        poolclass=QueuePool,
+        pool_size=pool_size or POOL_SIZE,
+        max_overflow=pool_size or POOL_SIZE,
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        apply_pragmas(dbapi_conn, readonly=readonly)
+
+    return engine
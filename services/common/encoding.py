@@ -0,0 +1,54 @@
+# services/common/encoding.py
+"""
+Encode body cho các endpoint batch (/reviews/batch, /products/batch).
+
+  • Mặc định JSON gọn (không khoảng trắng, giữ nguyên unicode) qua orjson / ujson nếu có.
+  • Client gửi `Accept: application/msgpack` (hoặc application/x-msgpack) và gói msgpack
+    có cài → MessagePack, nhỏ hơn JSON và parse nhanh hơn. Không có msgpack thì vẫn trả JSON.
+"""
+
+import json
+from typing import Any, Optional, Tuple
+
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError:  # msgpack là tuỳ chọn
+    msgpack = None
+
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    try:
+        import ujson
+
+        def _dumps(obj) -> bytes:
+            return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+    except ImportError:
+        def _dumps(obj) -> bytes:
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    if not accept or msgpack is None:
+        return False
+    return any(part.split(";")[0].strip() in MSGPACK_TYPES for part in accept.split(","))
+
+
+def encode(data: Any, accept: Optional[str] = None) -> Tuple[bytes, str]:
+    """(body, media_type) theo header Accept."""
+    if wants_msgpack(accept):
+        return msgpack.packb(data, use_bin_type=True), MSGPACK_TYPES[0]
+    return _dumps(data), "application/json"
+
+
+def packed_response(data: Any, accept: Optional[str] = None) -> Response:
+    body, media_type = encode(data, accept)
+    # Cùng URL, body khác nhau theo Accept → cache trung gian phải phân biệt
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
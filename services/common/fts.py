@@ -0,0 +1,24 @@
+# services/common/fts.py
+"""Tiện ích FTS5: chuyển chuỗi người dùng nhập thành biểu thức MATCH an toàn."""
+
+import re
+from typing import Optional
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: str, mode: str = "all", prefix: bool = True) -> Optional[str]:
+    """
+    "usb-c  Charger!" → '"usb" "c" "charger"*'
+      • mỗi từ được đặt trong "..." nên ký tự đặc biệt / từ khoá FTS5 (AND, NEAR, ...) không phá query
+      • mode="all": mọi từ phải có (AND) ; mode="any": OR
+      • prefix=True: từ cuối khớp tiền tố (gõ dở vẫn ra kết quả)
+    Trả về None nếu không có từ nào.
+    """
+    tokens = _TOKEN.findall((text or "").lower())
+    if not tokens:
+        return None
+    terms = [f'"{t}"' for t in tokens]
+    if prefix:
+        terms[-1] += "*"
+    return (" OR " if mode == "any" else " ").join(terms)
@@ -0,0 +1,292 @@
+# services/common/metadata.py
+"""
+Cache SQLite cho meta_Electronics.csv (mỗi dòng là 1 dict Python hoặc JSON).
+
+Parse file gốc (nhiều GB) bằng literal_eval/json.loads mất vài phút mỗi lần khởi động.
+Ở đây file chỉ được chuyển đổi 1 lần sang bảng SQLite có khoá chính ASIN:
+
+    meta(asin TEXT PRIMARY KEY, title TEXT, data TEXT)   -- data = JSON của cả record
+    meta_fts(asin UNINDEXED, title, description)          -- FTS5, tìm kiếm từ khoá (BM25)
+    meta_info(key, value)                                -- source, mtime_ns, size, ...
+
+  • Cache hết hạn khi mtime/size của file gốc đổi → build lại (ghi file tạm rồi os.replace).
+  • Build lạnh chia file thành các đoạn theo byte (căn theo dòng), parse song song trên
+    nhiều process, process chính ghi theo đúng thứ tự (dòng sau ghi đè dòng trước như dict cũ).
+  • Service đọc lười: MetadataStore chỉ mở kết nối read-only, tra theo ASIN khi cần.
+  • meta_fts được build cùng lúc với cache nên luôn đồng bộ với bảng meta;
+    MetadataStore.search() là bộ sinh ứng viên lexical (không cần gọi embedder).
+
+CLI:
+    python -m common.metadata build data/meta_Electronics.csv [--cache out.db] [--workers 8]
+    python -m common.metadata info data/meta_Electronics.csv
+"""
+
+import argparse
+import ast
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common.chunks import line_ranges, read_lines
+from common.fts import fts_query
+
+CACHE_VERSION = "2"
+# Kích thước 1 đoạn giao cho worker khi build
+CHUNK_BYTES = 32 * 1024 * 1024
+# Số ASIN mỗi câu SELECT ... IN (...) (SQLite giới hạn số tham số)
+LOOKUP_BATCH = 500
+
+
+def default_cache_path(source) -> Path:
+    return Path(os.getenv("META_CACHE_PATH") or Path(source).with_suffix(".db"))
+
+
+def parse_line(line: str) -> Optional[dict]:
+    """1 dòng metadata → dict (JSON trước vì nhanh, sau đó dict literal kiểu Python)."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        data = json.loads(line)
+    except Exception:
+        try:
+            data = ast.literal_eval(line)
+        except Exception:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+def _parse_chunk(args: Tuple[str, int, int]) -> List[Tuple[str, str, str]]:
+    path, start, end = args
+    rows = []
+    for raw in read_lines(path, start, end):
+        data = parse_line(raw.decode("utf-8", errors="replace"))
+        if not data:
+            continue
+        asin = data.get("asin")
+        if not asin:
+            continue
+        rows.append((asin, data.get("title", "") or "", json.dumps(data, ensure_ascii=False)))
+    return rows
+
+
+def _source_stamp(source) -> dict:
+    st = os.stat(source)
+    return {"source": os.path.abspath(source), "mtime_ns": str(st.st_mtime_ns), "size": str(st.st_size)}
+
+
+def read_cache_info(cache_path) -> dict:
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        conn = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta_info").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+
+def cache_is_fresh(source, cache_path) -> bool:
+    info = read_cache_info(cache_path)
+    stamp = _source_stamp(source)
+    return (info.get("version") == CACHE_VERSION
+            and info.get("mtime_ns") == stamp["mtime_ns"]
+            and info.get("size") == stamp["size"])
+
+
+def build_cache(source, cache_path=None, workers: Optional[int] = None,
+                chunk_bytes: int = CHUNK_BYTES) -> Path:
+    """Parse song song file metadata → SQLite (file tạm + os.replace, service đang đọc không bị lỗi)."""
+    source = str(source)
+    cache_path = Path(cache_path or default_cache_path(source))
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    workers = workers or int(os.getenv("META_WORKERS", "0")) or os.cpu_count() or 1
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp-{os.getpid()}")
+    stamp = _source_stamp(source)
+
+    t0 = time.time()
+    conn = sqlite3.connect(str(tmp_path))
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE meta (asin TEXT PRIMARY KEY, title TEXT, data TEXT) WITHOUT ROWID")
+        conn.execute("CREATE TABLE meta_info (key TEXT PRIMARY KEY, value TEXT)")
+        ranges = [(source, start, end) for start, end in line_ranges(source, chunk_bytes)]
+        count = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map giữ thứ tự đoạn → INSERT OR REPLACE cho kết quả giống dict cũ (dòng sau thắng)
+            for rows in pool.map(_parse_chunk, ranges):
+                conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?, ?)", rows)
+                count += len(rows)
+        # Chỉ mục FTS5 trên title + description, build 1 lượt sau khi đã có đủ dữ liệu
+        conn.execute(
+            "CREATE VIRTUAL TABLE meta_fts USING fts5(asin UNINDEXED, title, description, "
+            "tokenize='porter unicode61')"
+        )
+        conn.execute(
+            "INSERT INTO meta_fts (asin, title, description) "
+            "SELECT asin, title, COALESCE(json_extract(data, '$.description'), '') FROM meta"
+        )
+        info = {**stamp, "version": CACHE_VERSION, "records": str(count), "built_at": str(time.time())}
+        conn.executemany("INSERT INTO meta_info VALUES (?, ?)", list(info.items()))
+        conn.commit()
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+    os.replace(tmp_path, cache_path)
+    print(f"✅ Metadata cache built: {count} rows from {source} → {cache_path} "
+          f"({time.time() - t0:.1f}s, {workers} workers)")
+    return cache_path
+
+
+class MetadataStore:
+    """
+    Tra cứu metadata theo ASIN từ cache SQLite. Không đọc gì lúc khởi tạo;
+    lần truy cập đầu tiên kiểm tra cache (build nếu thiếu/cũ) rồi mở read-only.
+    Các lần sau open() chỉ stat file gốc: mtime/size đổi → build lại cache, kết nối mở lại.
+    API kiểu dict: get(asin, default), `asin in store`, len(store).
+    """
+
+    def __init__(self, source, cache_path=None, auto_build: bool = True):
+        self.source = Path(source)
+        self.cache_path = Path(cache_path or default_cache_path(source))
+        self.auto_build = auto_build
+        self._ready = False
+        self._source_stat: Optional[tuple] = None  # (mtime_ns, size) của file gốc lúc cache sẵn sàng
+        self._warned = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def open(self) -> bool:
+        """Đảm bảo cache sẵn sàng (và khớp file gốc); trả về False nếu không có file gốc lẫn cache."""
+        if self._ready and self._source_unchanged():
+            return True
+        with self._lock:
+            if self._ready and self._source_unchanged():
+                return True
+            self._ready = False
+            self._source_stat = self._stat_source()
+            if self.source.exists():
+                if not cache_is_fresh(self.source, self.cache_path):
+                    if not self.auto_build:
+                        print(f"⚠️ Metadata cache {self.cache_path} is stale")
+                    else:
+                        build_cache(self.source, self.cache_path)
+            elif not self.cache_path.exists():
+                if not self._warned:
+                    print(f"⚠️ Metadata file {self.source} not found. Using ASIN as fallback.")
+                    self._warned = True
+                return False
+            self._ready = self.cache_path.exists()
+            # kết nối cũ (nếu có) trỏ vào file trước khi rebuild
+            self._local = threading.local()
+            return self._ready
+
+    def _stat_source(self) -> Optional[tuple]:
+        try:
+            st = self.source.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _source_unchanged(self) -> bool:
+        # File gốc bị gỡ khi đang chạy → tiếp tục dùng cache đã có
+        stat = self._stat_source()
+        return stat is None or stat == self._source_stat
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self.open():
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Mỗi thread 1 kết nối read-only (endpoint sync của FastAPI chạy trong threadpool)
+            conn = sqlite3.connect(f"file:{self.cache_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, asin: str, default=None) -> Optional[dict]:
+        conn = self._conn()
+        if conn is None or not asin:
+            return default
+        row = conn.execute("SELECT data FROM meta WHERE asin = ?", (asin,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_many(self, asins: Iterable[str]) -> Dict[str, dict]:
+        """ASIN → metadata cho các ASIN có trong cache (bỏ qua ASIN không có)."""
+        return {asin: json.loads(data) for asin, data in self._select_many(asins, "data")}
+
+    def titles(self, asins: Iterable[str]) -> Dict[str, str]:
+        return dict(self._select_many(asins, "title"))
+
+    def _select_many(self, asins: Iterable[str], column: str) -> Iterator[tuple]:
+        conn = self._conn()
+        if conn is None:
+            return
+        asins = list(dict.fromkeys(a for a in asins if a))
+        for i in range(0, len(asins), LOOKUP_BATCH):
+            chunk = asins[i:i + LOOKUP_BATCH]
+            marks = ",".join("?" * len(chunk))
+            yield from conn.execute(f"SELECT asin, {column} FROM meta WHERE asin IN ({marks})", chunk)
+
+    def search(self, query: str, limit: int = 50, mode: str = "all") -> List[Tuple[str, float]]:
+        """
+        Ứng viên lexical: [(asin, score)] theo BM25 (title nặng hơn description),
+        score = -bm25 nên càng lớn càng liên quan.
+        """
+        conn = self._conn()
+        match = fts_query(query, mode)
+        if conn is None or match is None:
+            return []
+        rows = conn.execute(
+            "SELECT asin, bm25(meta_fts, 0.0, 3.0, 1.0) AS rank FROM meta_fts "
+            "WHERE meta_fts MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit),
+        ).fetchall()
+        return [(asin, -rank) for asin, rank in rows]
+
+    def __contains__(self, asin: str) -> bool:
+        conn = self._conn()
+        return bool(conn and conn.execute("SELECT 1 FROM meta WHERE asin = ?", (asin,)).fetchone())
+
+    def __len__(self) -> int:
+        conn = self._conn()
+        return conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0] if conn else 0
+
+    def info(self) -> dict:
+        return {"source": str(self.source), "cache": str(self.cache_path), **read_cache_info(self.cache_path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="meta_Electronics.csv → SQLite cache")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="Build (or rebuild) the cache")
+    build.add_argument("source")
+    build.add_argument("--cache", default=None, help="Cache path (default: META_CACHE_PATH or <source>.db)")
+    build.add_argument("--workers", type=int, default=None)
+    build.add_argument("--force", action="store_true", help="Rebuild even if the cache is fresh")
+    info = sub.add_parser("info", help="Show cache metadata")
+    info.add_argument("source")
+    info.add_argument("--cache", default=None)
+    args = parser.parse_args()
+
+    cache = args.cache or default_cache_path(args.source)
+    if args.cmd == "build":
+        if not args.force and cache_is_fresh(args.source, cache):
+            print(f"✅ {cache} is up to date")
+            return
+        build_cache(args.source, cache, workers=args.workers)
+    else:
+        print(json.dumps({"fresh": cache_is_fresh(args.source, cache), **read_cache_info(cache)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
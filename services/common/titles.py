@@ -0,0 +1,41 @@
+# services/common/titles.py
+"""
+TitleIndex: map text recommend (chứa title sản phẩm) → ASIN.
+
+Title được chia từ, đánh index theo KEY_WORDS từ đầu; resolve() tìm title dài nhất xuất hiện
+trong text theo ranh giới từ. Product Service build 1 lần trên danh sách /products và phục vụ
+qua POST /products/resolve, các service khác không phải tự tải danh sách title.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def _words(text: str) -> List[str]:
+    return text.lower().split()
+
+
+class TitleIndex:
+    """Tìm title sản phẩm (dài nhất) xuất hiện trong 1 đoạn text, theo ranh giới từ."""
+
+    KEY_WORDS = 3
+
+    def __init__(self, pairs: Iterable[Tuple[str, Optional[str]]]):
+        """pairs: (asin, title); title rỗng/None bị bỏ qua."""
+        self._by_prefix: Dict[tuple, List[Tuple[tuple, str]]] = {}
+        for asin, title in pairs:
+            words = tuple(_words(title or ""))
+            if words:
+                self._by_prefix.setdefault(words[:self.KEY_WORDS], []).append((words, asin))
+
+    def resolve(self, text: str) -> Optional[str]:
+        words = _words(text)
+        best: Optional[Tuple[int, str]] = None
+        for i in range(len(words)):
+            for n in range(min(self.KEY_WORDS, len(words) - i), 0, -1):
+                for title, asin in self._by_prefix.get(tuple(words[i:i + n]), ()):
+                    if tuple(words[i:i + len(title)]) == title and (best is None or len(title) > best[0]):
+                        best = (len(title), asin)
+        return best[1] if best else None
+
+    def resolve_many(self, texts: List[str]) -> List[Optional[str]]:
+        return [self.resolve(t) for t in texts]
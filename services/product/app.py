@@ -1,19 +1,36 @@
 import sqlite3
-import ast
-import json
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
 
-from typing import Dict, List, Any
+import bisect
+import hashlib
+import os
+import sys
+import threading
+import time
+import ujson as json
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Literal, Optional
 from pathlib import Path
 
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.blacklist import load_product_matcher
+from common.compact_meta import DEFAULT_FIELDS, CompactMetadata
+from common.db import SQLitePool
+from common.encoding import packed_response
+from common.metadata import MetadataStore, read_cache_info
+from common.titles import TitleIndex
+
 app = FastAPI(title="Product Service with Metadata")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_methods=["*"],
     allow_headers=["*"],
-    allow_credentials=True
+    allow_credentials=True,
+    expose_headers=["ETag", "X-Next-Cursor", "X-Total-Count"],
 )
 
 
@@ -21,102 +38,283 @@ app.add_middleware(
 db_path = Path("db/reviews.db")
 meta_path = Path("meta_Electronics.csv")  # Each line is a Python dict or JSON string
 
-# ASIN -> metadata mapping (including title)
-metadata_map: Dict[str, Dict[str, Any]] = {}
-
-# Define a blacklist of terms: nếu title chứa bất kỳ từ nào trong list này (case-insensitive),
-# sẽ không xuất sản phẩm đó trong response.
-blacklist =  ["lumiquest", "Compatible", "14&quot;", "ColorMunki", "Cleaning", "Timer", 
-              "Shoe", "slim case", "Livescribe", "COVER", "Android 4.0", "Purple", "Cinema", 
-              "Earphone", "computer lock", "Decals", "Projector", "VGA", "530T", "AAA", "Lithium", 
-              "Remote Control", "batter", "Antec One", "Picture", "case","Pctv" ,"noble", "arm", 
-              "nook", "olympus", "bushnell", "california", "external", "truck","sawyer", "3g", "kindle",
-              "db9", "yamakasi", "mygica", "bargain", "moleskine", "grade", "maxell", "ge", "palmone", 
-              "rca", "outdoor", "streambot", "aaa", "streambot", "lizone", "wpa4220kit", "allreli", 
-              "iclever", "34w", "inateck&reg;", "saicoo&trade;", "sharkk&reg;", "yens&reg;", 
-              "taotronics&reg;", "bolse&reg;", "jetech&reg;", "amp", "flash&trade;",
-                 "aerb&reg;", "supernight&reg;", "hypario&reg;", "mnxo&reg;", "digiyes&reg;", 
-                 "bearextender", "dbpower", "avatar", "cable", "microphone", "radio", "ipod", 
-                 "82mm", "dvd", "cd", "targus", "apc", "memorex", "diamond", "palm", "Strip", 
-                 "Mp3", "EM60", "phone","Strip", "Mp3", "EM60", "phone", "Speaker", "StarTech.com", "Kensington",
-            "Headset", "OtterBox", "Speaker", "Cleaner", "eReader", "DVI", 
-            "Slinglink", "Pogoplug","Patchbay","Protection","Bag", "NETWORK", "Keyspan", 
-            "Multimedia", "Mountable", "150m", 
-            "Crumpler", "OmniMount", "MartinLogan", "pack", "clik", "rouge", "Vanguard","tumi", "tv",
-            "hde", "ibuy", "sound","quis","++","wacom","dock","11g","plug","brunton", "tiny", "s75c",
-            "mercury", "contour", "cobra", "jiggler", "HDMI", "menotek", "riteav", "sumd", "rogue","att","savvy","lacie","escort","golf",
-            "wifi","duo","tomtom","silicon","mirro","rf","labeler","cooler",
-            "jump","mount","ematic","fidelity","skin",
-            ]
-
-  # Thêm các từ/cụm từ bạn muốn lọc ở đây
-blacklist_lower = [term.lower() for term in blacklist]
+# Product Service chỉ đọc reviews.db (Review Service ghi) → pool kết nối read-only, WAL
+reviews_db = SQLitePool(db_path, size=int(os.getenv("PRODUCT_DB_POOL_SIZE", "4")), readonly=True)
+
+# ASIN -> metadata (including title), đọc lười từ cache SQLite của meta_Electronics.csv
+metadata_map = MetadataStore(meta_path)
+
+# Blacklist: nếu title chứa bất kỳ term nào (case-insensitive) thì không xuất sản phẩm đó.
+# Term nằm trong common/blacklist*.txt, compile 1 lần thành matcher (Aho-Corasick / regex gộp).
+blacklist = load_product_matcher()
+# ASIN → title có bị blacklist không, tính 1 lần cho mỗi ASIN (không quét lại mỗi request)
+blocked_asins: Dict[str, bool] = {}
 
 
 @app.on_event("startup")
 def load_metadata():
-    if not meta_path.exists():
-        print(f"⚠️ Metadata file {meta_path} not found. Using ASIN as fallback.")
-        return
-    count = 0
-    with meta_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                data = ast.literal_eval(line)
-            except Exception:
-                try:
-                    data = json.loads(line)
-                except Exception:
-                    continue
-            asin = data.get("asin")
-            if not asin:
-                continue
-            metadata_map[asin] = data
-            count += 1
-    print(f"✅ Loaded metadata for {count} products from {meta_path}")
+    # Chỉ kiểm tra cache SQLite (build 1 lần nếu thiếu / file gốc đổi mtime), không parse lại CSV
+    if metadata_map.open():
+        print(f"✅ Metadata cache ready: {metadata_map.cache_path}")
 
 
-@app.get("/products", response_model=List[Dict[str, Any]])
-def list_products():
+def is_blocked(pid: str, title: str) -> bool:
+    # Mỗi ASIN chỉ match blacklist 1 lần, các request sau tra dict
+    blocked = blocked_asins.get(pid)
+    if blocked is None:
+        blocked = blocked_asins[pid] = blacklist.matches(title)
+    return blocked
+
+
+# ================================================================
+# /products: danh sách sản phẩm tính sẵn (materialized view trong RAM)
+# ================================================================
+# Quét Review + lọc blacklist 1 lần, sắp theo ASIN để phân trang keyset (?after=<asin>).
+# View được build lại khi reviews.db hoặc metadata đổi (kiểm tra mtime tối đa mỗi PRODUCTS_REFRESH_INTERVAL giây).
+PRODUCTS_REFRESH_INTERVAL = float(os.getenv("PRODUCTS_REFRESH_INTERVAL", "30"))
+PRODUCTS_MAX_LIMIT = int(os.getenv("PRODUCTS_MAX_LIMIT", "1000"))
+# Số ASIN tối đa mỗi request POST /products/batch (và số text mỗi POST /products/resolve)
+PRODUCTS_BATCH_MAX = int(os.getenv("PRODUCTS_BATCH_MAX", "1000"))
+# Field metadata giữ trong view (bản gọn dạng cột, common/compact_meta.py); field khác
+# (related, salesRank, ...) không còn trả về từ /products, /products/search, /products/batch
+META_FIELDS = tuple(
+    f.strip() for f in os.getenv("PRODUCT_META_FIELDS", ",".join(DEFAULT_FIELDS)).split(",") if f.strip()
+)
+# Số ASIN đọc từ cache metadata mỗi lượt khi build view (không giữ cả bảng dict trong RAM)
+VIEW_BUILD_CHUNK = 5000
+
+
+@dataclass
+class ProductsView:
+    asins: List[str]                 # đã sắp xếp, dùng bisect cho cursor
+    meta: CompactMetadata            # metadata dạng cột, row id = vị trí trong asins
+    removed: int                     # số sản phẩm bị blacklist
+    version: str                     # đổi khi dữ liệu đổi → ETag
+    db_stamp: tuple
+    checked_at: float
+    titles: TitleIndex               # text (chứa title) → ASIN, cho POST /products/resolve
+    # body JSON của toàn bộ danh sách theo từng bộ fields (tính lười, dùng lại)
+    full_bodies: Dict[Optional[tuple], bytes] = field(default_factory=dict)
+
+
+products_view: Optional[ProductsView] = None
+products_view_lock = threading.Lock()
+
+
+def _db_stamp() -> tuple:
+    st = db_path.stat()
+    # WAL: commit chưa checkpoint chỉ nằm trong reviews.db-wal, file chính không đổi mtime/size
+    try:
+        wal = db_path.with_name(db_path.name + "-wal").stat()
+    except FileNotFoundError:
+        wal = None
+    # open() build lại cache metadata nếu meta_Electronics.csv đổi → file cache đổi mtime
+    metadata_map.open()
+    meta_mtime = metadata_map.cache_path.stat().st_mtime_ns if metadata_map.cache_path.exists() else None
+    wal_stamp = (wal.st_mtime_ns, wal.st_size) if wal else None
+    return st.st_mtime_ns, st.st_size, meta_mtime, wal_stamp
+
+
+def build_products_view() -> ProductsView:
+    stamp = _db_stamp()
+    if products_view is not None and products_view.db_stamp[2] != stamp[2]:
+        blocked_asins.clear()  # metadata đổi → title đổi → match blacklist lại
+    with reviews_db.connection() as conn:
+        rows = sorted(r[0] for r in conn.execute("SELECT DISTINCT product_id FROM Review"))
+
+    asins: List[str] = []
+    removed = 0
+
+    def records():
+        # Đọc cache metadata theo từng lô, mỗi record chỉ sống tới khi được chép vào cột
+        nonlocal removed
+        for i in range(0, len(rows), VIEW_BUILD_CHUNK):
+            chunk = rows[i:i + VIEW_BUILD_CHUNK]
+            metas = metadata_map.get_many(chunk)
+            for pid in chunk:
+                prod_meta = metas.get(pid)
+                if prod_meta:
+                    if is_blocked(pid, prod_meta.get("title", "")):
+                        removed += 1
+                        continue  # Bỏ qua sản phẩm này nếu title chứa từ cấm
+                    yield prod_meta
+                else:
+                    # Nếu không có metadata, fallback chỉ chứa ASIN (không có title để kiểm tra)
+                    yield {"asin": pid}
+                asins.append(pid)
+
+    meta = CompactMetadata(records(), META_FIELDS)
+    titles = TitleIndex((asin, meta.columns["title"].get(i)) for i, asin in enumerate(asins)) \
+        if "title" in meta.columns else TitleIndex(())
+
+    meta_info = read_cache_info(metadata_map.cache_path)
+    version = hashlib.sha1(
+        f"{stamp}|{meta_info.get('mtime_ns')}|{','.join(blacklist.terms)}|{META_FIELDS}|{len(asins)}".encode()
+    ).hexdigest()[:16]
+    print(f"✅ Products view built: {len(asins)} products ({removed} filtered by blacklist), "
+          f"metadata {meta.info()['bytes'] / 2**20:.1f} MiB")
+    return ProductsView(asins, meta, removed, version, stamp, time.time(), titles)
+
+
+def get_products_view() -> ProductsView:
+    global products_view
     if not db_path.exists():
         raise HTTPException(status_code=500, detail="Database not initialized.")
-    try:
-        conn = sqlite3.connect(str(db_path), check_same_thread=False)
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT product_id FROM Review")
-        rows = [r[0] for r in cur.fetchall()]
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"DB error: {e}")
-    finally:
-        conn.close()
-
-    if not rows:
+    view = products_view
+    if view is not None and time.time() - view.checked_at < PRODUCTS_REFRESH_INTERVAL:
+        return view
+    with products_view_lock:
+        view = products_view
+        try:
+            if view is None or _db_stamp() != view.db_stamp:
+                products_view = view = build_products_view()
+            else:
+                view.checked_at = time.time()
+        except sqlite3.Error as e:
+            raise HTTPException(status_code=500, detail=f"DB error: {e}")
+    return view
+
+
+@app.on_event("startup")
+def warm_products_view():
+    # Build view ngay lúc startup để request đầu tiên không phải chờ
+    if db_path.exists():
+        try:
+            get_products_view()
+        except HTTPException as e:
+            print(f"⚠️ Could not build products view: {e.detail}")
+
+
+def _project(item: Dict[str, Any], fields: Optional[tuple]) -> Dict[str, Any]:
+    # fields=None → cùng bộ field với view (asin + META_FIELDS)
+    return {k: item[k] for k in (fields or ("asin",) + META_FIELDS) if k in item}
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or any(t.removeprefix("W/") == etag for t in candidates)
+
+
+@app.get("/products", response_model=List[Dict[str, Any]])
+def list_products(
+    after: Optional[str] = Query(None, description="Cursor: trả về các ASIN sau giá trị này"),
+    limit: Optional[int] = Query(None, ge=1, le=PRODUCTS_MAX_LIMIT,
+                                 description="Số sản phẩm mỗi trang (bỏ trống = toàn bộ danh sách)"),
+    fields: Optional[str] = Query(None, description="Danh sách field cần trả về, vd asin,title,imUrl"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Danh sách sản phẩm (đã lọc blacklist), sắp theo ASIN.
+    Phân trang keyset: ?limit=100, trang sau dùng ?after=<X-Next-Cursor>&limit=100.
+    Header trả về: ETag (gửi lại qua If-None-Match → 304), X-Next-Cursor, X-Total-Count.
+    """
+    view = get_products_view()
+    if not view.asins:
+        if view.removed:
+            raise HTTPException(status_code=404, detail="No products found after applying blacklist filter.")
         raise HTTPException(status_code=404, detail="No products found.")
 
-    products = []
-    for pid in rows:
-        prod_meta = metadata_map.get(pid)
-        if prod_meta:
-            title = prod_meta.get("title", "")
-            title_lower = title.lower()
-            # Kiểm tra xem title có chứa term nào thuộc blacklist không
-            skip = False
-            for term in blacklist_lower:
-                if term in title_lower:
-                    skip = True
-                    break
-            if skip:
-                continue  # Bỏ qua sản phẩm này nếu title chứa từ cấm
-            
-            products.append(prod_meta)
+    field_list = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else None
+    etag = '"' + hashlib.sha1(f"{view.version}|{after}|{limit}|{field_list}".encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "X-Total-Count": str(len(view.asins))}
+
+    start = bisect.bisect_right(view.asins, after) if after else 0
+    end = len(view.asins) if limit is None else min(start + limit, len(view.asins))
+    if end < len(view.asins):
+        headers["X-Next-Cursor"] = view.asins[end - 1]
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if start == 0 and end == len(view.asins):
+        body = view.full_bodies.get(field_list)
+        if body is None:
+            body = view.full_bodies[field_list] = json.dumps(
+                [view.meta.row(i, field_list) for i in range(len(view.asins))], ensure_ascii=False
+            ).encode("utf-8")
+    else:
+        body = json.dumps([view.meta.row(i, field_list) for i in range(start, end)],
+                          ensure_ascii=False).encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/products/search", response_model=List[Dict[str, Any]])
+def search_products(
+    q: str = Query(..., min_length=1, description="Từ khoá, tìm trong title + description (FTS5/BM25)"),
+    limit: int = Query(20, ge=1, le=PRODUCTS_MAX_LIMIT),
+    mode: Literal["all", "any"] = Query("all", description="all = mọi từ, any = bất kỳ từ nào"),
+    fields: Optional[str] = Query(None, description="Danh sách field cần trả về, vd asin,title,imUrl"),
+):
+    """
+    Bộ sinh ứng viên lexical: sản phẩm khớp từ khoá theo BM25, chỉ trong danh sách /products
+    (có review, không bị blacklist). Mỗi phần tử có thêm "score" (càng lớn càng liên quan).
+    """
+    view = get_products_view()
+    field_list = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else None
+    # Lấy dư ứng viên vì một phần sẽ bị loại (không có review / bị blacklist)
+    hits = metadata_map.search(q, limit=limit * 4, mode=mode)
+    results = []
+    for asin, score in hits:
+        pos = view.meta.rows.get(asin)
+        if pos is None:
+            continue
+        results.append({**view.meta.row(pos, field_list), "score": score})
+        if len(results) >= limit:
+            break
+    return results
+
+
+class ProductsBatchRequest(BaseModel):
+    asins: List[str]
+    fields: Optional[List[str]] = None   # vd ["asin", "title", "imUrl"]; None = asin + PRODUCT_META_FIELDS
+
+
+@app.post("/products/batch")
+def products_batch(req: ProductsBatchRequest, accept: Optional[str] = Header(None)):
+    """
+    Nhận JSON: { "asins": [...], "fields": [...] } → { asin: metadata } trong 1 request
+    (thay cho N lần tra từng sản phẩm). Tra view trong RAM trước, ASIN không có review thì
+    đọc cache metadata bằng 1 truy vấn; ASIN bị blacklist hoặc không có metadata thì bỏ qua.
+    Accept: application/msgpack → body MessagePack.
+    """
+    if len(req.asins) > PRODUCTS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({len(req.asins)} > {PRODUCTS_BATCH_MAX})")
+    view = get_products_view()
+    field_list = tuple(req.fields) if req.fields else None
+
+    found: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for asin in dict.fromkeys(req.asins):
+        pos = view.meta.rows.get(asin)
+        if pos is None:
+            missing.append(asin)
         else:
-            # Nếu không có metadata, fallback chỉ chứa ASIN (không có title để kiểm tra)
-            products.append({"asin": pid})
+            found[asin] = view.meta.row(pos, field_list)
+    if missing:
+        for asin, meta in metadata_map.get_many(missing).items():
+            if not is_blocked(asin, meta.get("title", "")):
+                found[asin] = _project(meta, field_list)
+    return packed_response(found, accept)
+
+
+class ResolveRequest(BaseModel):
+    texts: List[str]
+
+
+@app.post("/products/resolve", response_model=List[Optional[str]])
+def resolve_products(req: ResolveRequest):
+    """
+    Nhận JSON: { "texts": [...] } → [asin | null, ...] cùng thứ tự: ASIN của sản phẩm có title
+    dài nhất xuất hiện trong mỗi text (vd text catalog của Rec Service). Chỉ xét sản phẩm trong /products.
+    """
+    if len(req.texts) > PRODUCTS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({len(req.texts)} > {PRODUCTS_BATCH_MAX})")
+    return get_products_view().titles.resolve_many(req.texts)
 
-    if not products:
-        raise HTTPException(status_code=404, detail="No products found after applying blacklist filter.")
 
-    return products
+@app.get("/products/meta")
+def products_meta_info():
+    """Kích thước bản metadata gọn trong RAM (số dòng, loại + số byte mỗi cột)."""
+    view = get_products_view()
+    return {"fields": list(META_FIELDS), "removed": view.removed, **view.meta.info()}
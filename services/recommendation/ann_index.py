@@ -0,0 +1,228 @@
+# services/recommendation/ann_index.py
+"""
+Lớp index cho top-k, đặt phía sau find_top_k_texts.
+
+Backend:
+  • flat  : exact, numpy GEMV trên ma trận đã chuẩn hóa (không cần faiss)
+  • ivf   : faiss IndexIVFFlat (inner product trên unit vector = cosine), tham số nprobe
+  • hnsw  : faiss IndexHNSWFlat (inner product), tham số efSearch
+
+Index được build offline và lưu cạnh store nhị phân:
+    <prefix>.<kind>.faiss        file index faiss
+    <prefix>.<kind>.faiss.json   meta (kind, tham số build, sha1 của store)
+
+CLI:
+    python ann_index.py build embeddings/output_embeddings --kind hnsw --m 32
+    python ann_index.py build embeddings/output_embeddings --kind ivf --nlist 4096
+"""
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from topk import batch_top_k, cosine_scores, top_k_indices
+
+try:
+    import faiss
+except ImportError:  # faiss là tuỳ chọn; không có thì chỉ dùng flat
+    faiss = None
+
+INDEX_KINDS = ("flat", "ivf", "hnsw")
+ADD_BLOCK_ROWS = 65536
+
+
+@dataclass(frozen=True)
+class SearchParams:
+    """Tham số theo từng request. exact=True bỏ qua ANN (recall = 1)."""
+    exact: bool = False
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+class FlatIndex:
+    """Exact search trên ma trận unit (N, D), có thể là memmap."""
+    kind = "flat"
+
+    def __init__(self, unit_embeds: np.ndarray):
+        self.unit_embeds = unit_embeds
+
+    def __len__(self) -> int:
+        return self.unit_embeds.shape[0]
+
+    def search(self, q: np.ndarray, k: int, params: Optional[SearchParams] = None) -> Tuple[np.ndarray, np.ndarray]:
+        scores = cosine_scores(self.unit_embeds, q)
+        idx = top_k_indices(scores, k)
+        return idx, scores[idx]
+
+    def search_batch(self, Q: np.ndarray, k: int, params: Optional[SearchParams] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Q query unit (Q, D) → (idx (Q, k), scores (Q, k)) qua GEMM theo tile."""
+        return batch_top_k(Q, self.unit_embeds, k)
+
+
+class FaissIndex:
+    """Bọc 1 index faiss (IVF/HNSW); tham số search truyền theo từng lời gọi nên thread-safe."""
+
+    def __init__(self, index, kind: str, meta: dict):
+        self.index = index
+        self.kind = kind
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def _search_params(self, k: int, params: Optional[SearchParams]):
+        if params is None:
+            return None
+        if self.kind == "ivf" and params.nprobe:
+            return faiss.SearchParametersIVF(nprobe=int(params.nprobe))
+        if self.kind == "hnsw" and params.ef_search:
+            # efSearch < k thì HNSW không trả đủ k kết quả
+            return faiss.SearchParametersHNSW(efSearch=max(int(params.ef_search), k))
+        return None
+
+    def search(self, q: np.ndarray, k: int, params: Optional[SearchParams] = None) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty((0,), dtype=np.int64), np.empty((0,), dtype=np.float32)
+        x = np.ascontiguousarray(q.reshape(1, -1), dtype=np.float32)
+        sp = self._search_params(k, params)
+        if sp is not None:
+            scores, idx = self.index.search(x, k, params=sp)
+        else:
+            scores, idx = self.index.search(x, k)
+        keep = idx[0] >= 0
+        return idx[0][keep], scores[0][keep]
+
+    def search_batch(self, Q: np.ndarray, k: int, params: Optional[SearchParams] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """faiss tự xử lý batch; ô không đủ kết quả có idx = -1 (caller tự bỏ qua)."""
+        k = min(k, len(self))
+        x = np.ascontiguousarray(Q, dtype=np.float32)
+        if k <= 0 or x.shape[0] == 0:
+            return np.empty((x.shape[0], 0), dtype=np.int64), np.empty((x.shape[0], 0), dtype=np.float32)
+        sp = self._search_params(k, params)
+        if sp is not None:
+            scores, idx = self.index.search(x, k, params=sp)
+        else:
+            scores, idx = self.index.search(x, k)
+        return idx, scores
+
+
+def index_paths(prefix: str, kind: str) -> Tuple[str, str]:
+    path = f"{prefix}.{kind}.faiss"
+    return path, f"{path}.json"
+
+
+def _require_faiss():
+    if faiss is None:
+        raise RuntimeError("faiss is not installed (pip install faiss-cpu)")
+
+
+def _add_in_blocks(index, unit_embeds: np.ndarray):
+    for start in range(0, unit_embeds.shape[0], ADD_BLOCK_ROWS):
+        block = np.ascontiguousarray(unit_embeds[start:start + ADD_BLOCK_ROWS], dtype=np.float32)
+        index.add(block)
+
+
+def build_index(unit_embeds: np.ndarray, kind: str = "hnsw", nlist: Optional[int] = None,
+                m: int = 32, ef_construction: int = 200, train_size: int = 200_000, seed: int = 0):
+    """Build index faiss inner-product trên ma trận unit (N, D)."""
+    _require_faiss()
+    n, d = unit_embeds.shape
+    if kind == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif kind == "ivf":
+        # Quy tắc quen thuộc: nlist ≈ 4·sqrt(N)
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        quantizer = faiss.IndexFlatIP(d)
+        index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+        index.train(np.ascontiguousarray(unit_embeds[sample], dtype=np.float32))
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        raise ValueError(f"kind phải là một trong {INDEX_KINDS}")
+    _add_in_blocks(index, unit_embeds)
+    return index
+
+
+def save_index(index, prefix: str, kind: str, meta: dict):
+    path, meta_path = index_paths(prefix, kind)
+    faiss.write_index(index, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def load_index(prefix: str, kind: str, store_sha1: Optional[str] = None, count: Optional[int] = None):
+    """
+    Load index đã build cho prefix. Trả về None nếu không có file, thiếu faiss,
+    hoặc index không khớp với store hiện tại (sha1/count khác → index cũ).
+    """
+    path, meta_path = index_paths(prefix, kind)
+    if not os.path.exists(path) or not os.path.exists(meta_path):
+        return None
+    if faiss is None:
+        print(f"⚠️ Found {path} but faiss is not installed; using exact search.")
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if store_sha1 is not None and meta.get("store_sha1") != store_sha1:
+        print(f"⚠️ Index {path} was built for another store version; using exact search.")
+        return None
+    index = faiss.read_index(path)
+    if count is not None and index.ntotal != count:
+        print(f"⚠️ Index {path} has {index.ntotal} vectors, store has {count}; using exact search.")
+        return None
+    if kind == "ivf" and meta.get("nprobe"):
+        faiss.extract_index_ivf(index).nprobe = int(meta["nprobe"])
+    if kind == "hnsw" and meta.get("ef_search"):
+        index.hnsw.efSearch = int(meta["ef_search"])
+    print(f"✅ Loaded {kind} index {path} ({index.ntotal} vectors)")
+    return FaissIndex(index, kind, meta)
+
+
+def main(argv=None):
+    from embedding_store import open_store
+
+    parser = argparse.ArgumentParser(description="Build an ANN index next to an embedding store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("prefix", help="Store prefix, e.g. embeddings/output_embeddings")
+    b.add_argument("--kind", choices=INDEX_KINDS, default="hnsw")
+    b.add_argument("--nlist", type=int, default=None, help="IVF: number of lists (default 4*sqrt(N))")
+    b.add_argument("--nprobe", type=int, default=16, help="IVF: default nprobe stored in meta")
+    b.add_argument("--m", type=int, default=32, help="HNSW: neighbours per node")
+    b.add_argument("--ef-construction", type=int, default=200)
+    b.add_argument("--ef-search", type=int, default=64, help="HNSW: default efSearch stored in meta")
+    args = parser.parse_args(argv)
+
+    _, embeds, _, store_meta = open_store(args.prefix)
+    if not store_meta.get("normalized", False):
+        raise SystemExit("Store is not normalized; re-run embedding_store.py convert without --raw.")
+    t0 = time.time()
+    index = build_index(embeds, kind=args.kind, nlist=args.nlist, m=args.m,
+                        ef_construction=args.ef_construction)
+    meta = {
+        "kind": args.kind,
+        "store_sha1": store_meta.get("sha1"),
+        "count": int(index.ntotal),
+        "nlist": getattr(index, "nlist", None),
+        "nprobe": args.nprobe if args.kind == "ivf" else None,
+        "m": args.m if args.kind == "hnsw" else None,
+        "ef_search": args.ef_search if args.kind == "hnsw" else None,
+        "built_at": time.time(),
+    }
+    save_index(index, args.prefix, args.kind, meta)
+    print(f"✅ Built {args.kind} index for {index.ntotal} vectors in {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,20 @@
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
-from typing import Dict, Any, List
+from pydantic import BaseModel, Field
+import os
+import asyncio
+import math
+
+from ann_index import SearchParams
+from clients import CircuitBreaker, ServiceClient
+from embed_cache import CachedEmbeddingProvider, make_cached_provider
+from embedder import EmbeddingQueueFull, make_batcher, make_provider
+from lexical import looks_like_identifier, rrf_fuse
+from product_links import ProductLinker
+from user_profile import ProfileEngine
+from rec_cache import RecommendationCache
+from typing import Dict, List, Literal, Optional
 
 
 app = FastAPI(title="Recommendation Service")
@@ -18,39 +29,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class RecRequest(BaseModel):
+class IndexParams(BaseModel):
+    # Tham số index theo từng request (xem ann_index.py)
+    exact: bool = False              # True → bỏ qua ANN, quét toàn bộ (recall = 1)
+    nprobe: Optional[int] = None     # IVF: số list được quét
+    ef_search: Optional[int] = None  # HNSW: kích thước hàng đợi khi search
+
+    def search_params(self) -> SearchParams:
+        return SearchParams(exact=self.exact, nprobe=self.nprobe, ef_search=self.ef_search)
+
+class RecRequest(IndexParams):
     user_profile: str
 
-class SearchRequest(BaseModel):
+class SearchRequest(IndexParams):
     query: str
+    # None → SEARCH_MODE; "vector" = hành vi cũ (chỉ embedding)
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+class BatchRecRequest(IndexParams):
+    user_profiles: List[str]
+    k: int = Field(20, ge=1, le=1000)
+
+class BatchSearchRequest(IndexParams):
+    queries: List[str]
+    k: int = Field(20, ge=1, le=1000)
 
 
 # === CẤU HÌNH ===
-# Thay YOUR_NGROK_URL bằng URL ngrok bạn vừa in ra ở Kaggle, ví dụ:
-#   https://abcd1234-fgh.ngrok.io
-# (Không có dấu "/" ở cuối)
-NGROK_URL = "https://7378-34-91-110-183.ngrok-free.app"  # <-- sửa lại cho đúng
+# Backend embedding chọn qua EMBED_BACKEND (xem embedder.py):
+#   local  (mặc định) all-MiniLM-L6-v2 chạy ONNX ngay trong process
+#   remote gọi {EMBED_URL}/embed, ví dụ URL ngrok in ra ở Kaggle (không có "/" ở cuối)
+#   stub   vector tất định, dùng khi test
+# Thứ tự: cache (embed_cache.py) → micro-batcher (gom request đồng thời) → backend
+batcher = make_batcher(make_provider())
+embedder = make_cached_provider(batcher)
 
 # === HÀM GỌI API ===
 
 def embed_text(text: str) -> list:
     """
-    Gửi 1 chuỗi text lên endpoint /embed, trả về embedding (list of floats).
-    Nếu lỗi (status != 200), hàm sẽ in ra lỗi và return [].
+    Tạo embedding (list of floats) cho 1 chuỗi text bằng backend đã cấu hình.
+    Nếu lỗi, backend sẽ in ra lỗi và return [].
     """
-    endpoint = f"{NGROK_URL}/embed"
-    payload = {"text": text}
+    return embedder.embed(text)
+
+
+@app.on_event("startup")
+async def start_embedder():
+    await batcher.start()
+    # Load model trước khi nhận request đầu tiên; lỗi thì để request sau thử lại
     try:
-        resp = requests.post(endpoint, json=payload, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("embedding", [])
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Gọi /embed thất bại: {e}")
-        return []
-    except ValueError:
-        print("[ERROR] Phản hồi không phải JSON hợp lệ")
-        return []
+        await asyncio.to_thread(embedder.warmup)
+    except Exception as e:
+        print(f"⚠️ Embedding backend '{embedder.name}' warmup failed: {e}")
+
+
+@app.on_event("shutdown")
+async def stop_embedder():
+    await batcher.stop()
 
 t1 = [
     {
@@ -90,200 +126,249 @@ def export_text(t1,t2,use_t2= False):
             res += t*max(0,10-id*2) + "\n"
     return res
 
-import json
 import numpy as np
-import requests
+
+from catalog import CatalogManager
+from embedding_store import store_exists
+from topk import batch_top_k, cosine_scores, top_k_indices, unit_queries, unit_query
 
 # ================================================================
-# 1. Định nghĩa hàm để load JSON và trả về all_texts, all_embeds, all_norms
+# 1. Catalog embedding: load 1 lần lúc startup, dùng chung cho mọi request
 # ================================================================
+# Ưu tiên store nhị phân (memmap) nếu có, ngược lại dùng file JSON cũ
+# (data/output_embeddings.json được mount vào /app). EMBED_PATH ghi đè cả hai.
+EMBED_STORE = os.getenv("EMBED_STORE", "embeddings/output_embeddings")
+EMBED_PATH = os.getenv("EMBED_PATH") or (
+    EMBED_STORE if store_exists(EMBED_STORE) else "output_embeddings.json"
+)
+# Số giây giữa 2 lần kiểm tra file thay đổi (<= 0 để tắt hot reload)
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "30"))
+# Backend top-k: auto (hnsw → ivf → flat, tuỳ index đã build), hnsw, ivf, flat
+ANN_INDEX = os.getenv("ANN_INDEX", "auto")
 
-def load_embeddings_from_json(
-    json_path: str,
-    blacklist: list[str] = None,
-    normalize: bool = False,
-    overwrite: bool = False
-):
-    """
-    Đọc file JSON (ví dụ: output_embeddings.json) có cấu trúc:
-    {
-        "text2embed": {
-            "Some text A": [0.12, -0.53, ...],
-            "Some text B": [0.45,  0.22, ...],
-            ...
-        }
-    }
-    Thêm 2 tham số:
-      • normalize (bool): 
-          - Nếu False (mặc định), giữ embedding gốc.
-          - Nếu True, tính vector chuẩn hóa (unit vector = v / ||v||).
-      • overwrite (bool):
-          - Nếu False (mặc định), KHÔNG ghi đè file JSON.
-          - Nếu True, ghi đè file JSON với các vector (gốc hoặc chuẩn hóa tuỳ normalize).
-    
-    Ngoài ra cho phép truyền thêm `blacklist` gồm các từ (hoặc cụm từ).
-    Nếu text chứa bất kỳ từ nào trong blacklist (so sánh case-insensitive), sẽ bỏ qua text đó.
-
-    Trả về:
-      - filtered_texts: list[str] (các văn bản đã lọc)
-      - all_embeds: np.ndarray shape (N, D) chứa embedding gốc tương ứng
-      - all_norms:  np.ndarray shape (N,) là norm (||v||) của mỗi embedding gốc
-    """
-    # 1) Thiết lập blacklist mặc định nếu không truyền vào
-    if blacklist is None:
-        blacklist = [
-            "lumiquest", "Compatible", "14&quot;", "ColorMunki",
-            "Cleaning", "Timer", "Shoe", "slim case", "Livescribe",
-            "COVER", "Android 4.0", "Purple", "Cinema", "Earphone",
-            "computer lock", "Decals", "Projector", "VGA", "530T",
-            "AAA", "Lithium", "Remote Control", "batter", "Antec One",
-            "Picture", "case", "Pctv", "Strip", "Mp3", "EM60", "phone", 
-            "Speaker", "StarTech.com", "Kensington",
-            "Headset", "OtterBox", "Speaker", "Cleaner", "eReader", "DVI", 
-            "Slinglink", "Pogoplug","Patchbay","Protection","Bag", "NETWORK", 
-            "Keyspan", "Multimedia", "Mountable", "150m",
-            "Crumpler", "OmniMount", "MartinLogan", "pack", "clik", "rouge", 
-            "Vanguard","tumi", "tv",
-            "hde", "ibuy", "sound","quis","++","wacom","dock","11g","plug","brunton", "tiny", "s75c",
-            "mercury", "contour", "cobra", "jiggler", "HDMI", "menotek", "riteav", "sumd", "rogue","att","savvy","lacie","escort","golf",
-            "wifi","duo","tomtom","silicon","mirro","rf","labeler","cooler",
-            "jump","mount","ematic","fidelity","skin",
-        ]
-    # Chuẩn hóa blacklist về lowercase để so sánh không phân biệt hoa/thường
-    blacklist_lower = [term.lower() for term in blacklist]
-
-    # 2) Đọc toàn bộ JSON
-    with open(json_path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-
-    text2embed = raw.get("text2embed", {})
-    print(f"Loaded {len(text2embed)} texts from {json_path}.")
-
-    filtered_texts = []
-    filtered_embeds = []
-    # Dùng để lưu các vector (gốc hoặc chuẩn hóa) nếu cần overwrite
-    new_map: dict[str, list[float]] = {}
-
-    # 3) Lọc theo blacklist và tính norm + (tuỳ chọn normalize)
-    for text, embed_list in text2embed.items():
-        text_lower = text.lower()
-        # Nếu text chứa bất kỳ term nào trong blacklist_lower, skip
-        skip = False
-        for term in blacklist_lower:
-            if term in text_lower:
-                skip = True
-                break
-        if skip:
-            continue
-
-        # Chuyển embed_list thành numpy array
-        raw_vec = np.array(embed_list, dtype=np.float32)
-        norm = np.linalg.norm(raw_vec)
-        if norm == 0:
-            # Nếu vector gốc có độ dài 0, ta skip luôn (không thể normalize)
-            continue
-
-        # Lưu embedding gốc
-        filtered_texts.append(text)
-        filtered_embeds.append(raw_vec)
-
-        # Tính vector để ghi nếu overwrite=True
-        if normalize:
-            norm_vec = (raw_vec / norm).tolist()
-            new_map[text] = norm_vec
-        else:
-            # Không normalize, giữ nguyên gốc
-            new_map[text] = raw_vec.tolist()
-
-    # 4) Chuyển danh sách embedding gốc thành numpy array shape (N, D)
-    if filtered_embeds:
-        all_embeds = np.stack(filtered_embeds, axis=0)  # shape (N, D)
-        all_norms = np.linalg.norm(all_embeds, axis=1)  # shape (N,)
-    else:
-        # Trường hợp không còn embedding nào sau lọc
-        all_embeds = np.empty((0, 0), dtype=np.float32)
-        all_norms = np.empty((0,), dtype=np.float32)
+# Chỉ mục FTS5 in-memory trên texts của catalog, build cùng snapshot (CATALOG_LEXICAL=0 để tắt)
+CATALOG_LEXICAL = os.getenv("CATALOG_LEXICAL", "1") == "1"
 
-    print(f"Filtered down to {len(filtered_texts)} texts after applying blacklist.")
-    print(f"Shape of all_embeds: {all_embeds.shape}")
-    print(f"Shape of all_norms: {all_norms.shape}")
+catalog_manager = CatalogManager(EMBED_PATH, reload_interval=CATALOG_RELOAD_INTERVAL,
+                                 index_kind=ANN_INDEX, lexical=CATALOG_LEXICAL)
 
-    # 5) Nếu overwrite=True, ghi đè file JSON với các vector đã chọn
-    if overwrite:
-        updated_content = {"text2embed": new_map}
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(updated_content, f, ensure_ascii=False, indent=2)
-        print(f"✅ Overwrote JSON file '{json_path}' with {'normalized' if normalize else 'original'} vectors.")
+# /search: vector | lexical | hybrid (BM25 + vector trộn bằng reciprocal-rank fusion)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+# Query kiểu mã model ("EM60", "wpa4220kit") khớp chính xác được lexical → trả luôn, không embed
+SEARCH_SHORTCUT = os.getenv("SEARCH_SHORTCUT", "1") == "1"
+# Số ứng viên mỗi nhánh đưa vào fusion
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "100"))
+search_counts = {"vector": 0, "lexical": 0, "hybrid": 0, "shortcut": 0}
 
-    # 6) Trả về danh sách đã lọc cùng embedding gốc và norms
-    return filtered_texts, all_embeds, all_norms
 
+@app.on_event("startup")
+def load_catalog():
+    try:
+        catalog_manager.reload(force=True)
+    except FileNotFoundError:
+        print(f"⚠️ Embedding file {EMBED_PATH} not found. Catalog will be loaded on first request.")
+    catalog_manager.start_watcher()
 
 
+@app.on_event("shutdown")
+def stop_catalog_watcher():
+    catalog_manager.stop_watcher()
 
 
 # ================================================================
 # 2. Hàm phụ: tìm top-k văn bản dựa trên cosine similarity
 # ================================================================
+def find_top_k_indices(user_embedding: np.ndarray,
+                       all_embeds: np.ndarray,
+                       k: int = 20,
+                       index=None,
+                       params: Optional[SearchParams] = None) -> list:
+    """Chỉ số hàng của top-k embedding gần user_embedding nhất (cosine, giảm dần)."""
+    q = unit_query(user_embedding)
+    if q is None:
+        return []
+
+    if index is not None and not (params and params.exact):
+        topk_idx, _ = index.search(q, k, params)
+    else:
+        # 1 GEMV trên ma trận đã chuẩn hóa = cosine similarity, shape (N,)
+        sims = cosine_scores(all_embeds, q)
+        topk_idx = top_k_indices(sims, k)
+    return [int(i) for i in topk_idx]
+
+
 def find_top_k_texts(user_embedding: np.ndarray,
                      all_texts: list,
                      all_embeds: np.ndarray,
-                     all_norms: np.ndarray,
-                     k: int = 20) -> list:
+                     k: int = 20,
+                     index=None,
+                     params: Optional[SearchParams] = None) -> list:
     """
     Input:
       - user_embedding: np.ndarray shape (D,)
       - all_texts: list các chuỗi tương ứng với each row of all_embeds
-      - all_embeds: np.ndarray shape (N, D)
-      - all_norms:  np.ndarray shape (N,) là ||embedding_i||
+      - all_embeds: np.ndarray shape (N, D), mỗi hàng đã chuẩn hóa (||e_i|| = 1)
       - k: số lượng kết quả cần trả về
+      - index: backend top-k (FlatIndex / FaissIndex); None → exact trên all_embeds
+      - params: SearchParams theo request (exact, nprobe, ef_search)
     Output:
       - list[str]: top-k text có cosine similarity cao nhất với user_embedding
     """
-    user_vec = np.array(user_embedding, dtype=np.float32).reshape(-1)
-    user_norm = np.linalg.norm(user_vec)
-    if user_norm == 0:
-        return []
+    topk_idx = find_top_k_indices(user_embedding, all_embeds, k=k, index=index, params=params)
+    return [all_texts[i] for i in topk_idx]
 
-    dots = all_embeds.dot(user_vec)  # shape (N,)
-    eps = 1e-8
-    sims = dots / (all_norms * user_norm + eps)  # shape (N,)
 
-    # Lấy top-k indices
-    N = sims.shape[0]
-    if k >= N:
-        topk_idx = np.argsort(-sims)
+
+def find_top_k_texts_batch(embeddings: list,
+                           all_texts: list,
+                           all_embeds: np.ndarray,
+                           k: int = 20,
+                           index=None,
+                           params: Optional[SearchParams] = None) -> List[List[str]]:
+    """
+    Giống find_top_k_texts nhưng cho Q vector cùng lúc (1 GEMM theo tile thay vì Q GEMV).
+    Vector rỗng / bằng 0 (ví dụ embed lỗi) → danh sách rỗng ở vị trí tương ứng.
+    """
+    results: List[List[str]] = [[] for _ in embeddings]
+    valid_pos = [i for i, e in enumerate(embeddings) if len(e) > 0]
+    if not valid_pos:
+        return results
+    Q, valid = unit_queries(np.stack([np.asarray(embeddings[i], dtype=np.float32) for i in valid_pos]))
+
+    if index is not None and not (params and params.exact):
+        idx, _ = index.search_batch(Q, k, params)
     else:
-        topk_idx = np.argpartition(-sims, k)[:k]
-        topk_idx = topk_idx[np.argsort(-sims[topk_idx])]
+        idx, _ = batch_top_k(Q, all_embeds, k)
+
+    for row, pos in enumerate(valid_pos):
+        if valid[row]:
+            results[pos] = [all_texts[i] for i in idx[row] if i >= 0]
+    return results
+
+
+def search_text(query: str) -> str:
+    # Query ngắn được lặp lại 10 lần trước khi embed (giống profile trong export_text)
+    return (query.strip() + " ") * 10
+
+
+# User Service: pool kết nối riêng, timeout ngắn, circuit breaker
+# → user-service chậm/chết thì /recommend vẫn trả về (history rỗng) thay vì treo worker
+user_service = ServiceClient(
+    "user-service",
+    os.getenv("USER_SERVICE_URL", "http://user-service:8003"),
+    timeout=float(os.getenv("USER_SERVICE_TIMEOUT", "2")),
+    max_connections=int(os.getenv("USER_SERVICE_MAX_CONNECTIONS", "100")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("USER_SERVICE_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("USER_SERVICE_BREAKER_RESET", "10")),
+    ),
+)
+# Số user được fetch history song song trong /recommend/batch
+HISTORY_FETCH_CONCURRENCY = int(os.getenv("HISTORY_FETCH_CONCURRENCY", "32"))
+
+
+# Product Service: map text catalog → ASIN (POST /products/resolve), thay cho load metadata local
+product_service = ServiceClient(
+    "product-service",
+    os.getenv("PRODUCT_SERVICE_URL", "http://product-service:8001"),
+    timeout=float(os.getenv("PRODUCT_SERVICE_TIMEOUT", "10")),
+    max_connections=int(os.getenv("PRODUCT_SERVICE_MAX_CONNECTIONS", "10")),
+)
+product_linker = ProductLinker(product_service, chunk=int(os.getenv("PRODUCT_RESOLVE_CHUNK", "1000")))
+
+
+@app.on_event("startup")
+async def link_catalog_products():
+    # Catalog đã load ở startup → map text → ASIN trong nền
+    if catalog_manager.info()["loaded"]:
+        product_linker.ensure(catalog_manager.get())
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await user_service.aclose()
+    await product_service.aclose()
+
+
+# Profile user: "rank" (10/8/6/4/2 như export_text) | "time" (half-life theo created_at)
+# → cập nhật tăng dần trong user_profile.py; "text" = cách cũ, embed lại cả chuỗi export_text
+PROFILE_WEIGHTING = os.getenv("PROFILE_WEIGHTING", "rank")
+PROFILE_RANK_BASE = float(os.getenv("PROFILE_RANK_BASE", "10"))
+PROFILE_RANK_STEP = float(os.getenv("PROFILE_RANK_STEP", "2"))
+
+
+def history_limit() -> int:
+    """Số item history mỗi loại cần lấy = số item profile thực sự dùng (HISTORY_LIMIT ghi đè)."""
+    override = int(os.getenv("HISTORY_LIMIT", "0"))
+    if override > 0:
+        return override
+    if PROFILE_WEIGHTING == "time":
+        # trọng số theo tuổi không về 0 → lấy 1 cửa sổ đủ dài
+        return int(os.getenv("PROFILE_TIME_HISTORY_LIMIT", "100"))
+    if PROFILE_WEIGHTING == "text":
+        return 5  # export_text: max(0, 10 - 2r) > 0 với r < 5
+    # rank: item thứ r có trọng số base - step*r → chỉ ceil(base/step) item đầu khác 0
+    if PROFILE_RANK_STEP <= 0:
+        return 1000
+    return max(1, math.ceil(PROFILE_RANK_BASE / PROFILE_RANK_STEP))
+
+
+HISTORY_LIMIT = history_limit()
 
-    return [all_texts[i] for i in topk_idx]
+
+async def fetch_user_history(user_profile: str) -> tuple:
+    """
+    Lấy (search_history, view_history) từ User Service trong 1 request
+    (/users/{username}/history, chỉ HISTORY_LIMIT item mới nhất mỗi loại); lỗi → ([], []).
+    """
+    data = await user_service.get_json(
+        f"/users/{user_profile}/history", default=None, params={"limit": HISTORY_LIMIT}
+    )
+    if not isinstance(data, dict):
+        return [], []
+    return data.get("search_history") or [], data.get("view_history") or []
+
+
+profile_engine = None if PROFILE_WEIGHTING == "text" else ProfileEngine(
+    embedder.aembed_many,
+    weighting=PROFILE_WEIGHTING,
+    rank_base=PROFILE_RANK_BASE,
+    rank_step=PROFILE_RANK_STEP,
+    half_life=float(os.getenv("PROFILE_HALF_LIFE_HOURS", "72")) * 3600,
+    use_view=os.getenv("PROFILE_USE_VIEW", "0") == "1",  # export_text mặc định use_t2=False
+    item_text=search_text,  # mỗi item embed giống 1 query /search → dùng chung cache
+    max_users=int(os.getenv("PROFILE_MAX_USERS", "10000")),
+)
+
+
+async def user_profile_vector(user_profile: str, sh: list, vh: list):
+    """Vector profile của user; history rỗng (hoặc PROFILE_WEIGHTING=text) → embed export_text như cũ."""
+    if profile_engine is not None:
+        vec = await profile_engine.profile_vector(user_profile, sh, vh)
+        if vec is not None:
+            return vec
+    user_text = export_text(sh, vh)
+    print(f"User text: {user_text}")
+    return await embedder.aembed(user_text)
 
 
 
 # ================================================================
-# 3. Hàm get_recommendations_real, tích hợp phần load file JSON bên trong
+# 3. Hàm get_recommendations_real, dùng catalog đã load sẵn
 # ================================================================
-def get_recommendations(user_profile: str, testing=False) -> dict:
+async def get_recommendations(user_profile: str, testing=False, params: Optional[SearchParams] = None) -> dict:
     """
     Core logic:
       1) Fetch search_history (sh) và view_history (vh) từ User Service.
          Nếu lỗi thì sh, vh = [].
       2) Nếu testing=True, bạn có thể override sh, vh bằng dữ liệu mẫu.
-      3) Dùng export_text(sh, vh) để tạo user_text, rồi embed_text(user_text) để được user_embedding.
-      4) Load file output_embeddings.json (data/output_embeddings.json) để có all_texts, all_embeds, all_norms.
+      3) user_profile_vector: profile tăng dần (user_profile.py), chỉ embed các item history mới.
+      4) Lấy snapshot catalog hiện tại (all_texts, all_embeds đã chuẩn hóa) từ catalog_manager.
       5) Gọi find_top_k_texts để lấy 20 text gợi ý gần nhất.
       6) Trả về dict gồm: recommendations, search_history, view_history.
     """
     # 1) Lấy history từ User Service
-    # 1) Lấy history từ User Service
-    try:
-        sh_resp = requests.get(f"http://user-service:8003/users/{user_profile}/history/search")
-        vh_resp = requests.get(f"http://user-service:8003/users/{user_profile}/history/view")
-        sh = sh_resp.ok and sh_resp.json() or []
-        vh = vh_resp.ok and vh_resp.json() or []
-    except Exception:
-        sh, vh = [], []
+    sh, vh = await fetch_user_history(user_profile)
 
     # 2) Nếu đang test, override bằng t1, t2 (nếu bạn đã định nghĩa t1, t2 ở đâu đó)
     if testing:
@@ -293,21 +378,19 @@ def get_recommendations(user_profile: str, testing=False) -> dict:
         vh = t2
         # pass
 
-    # 3) Đưa lịch sử thành 1 chuỗi văn bản, rồi embed
-    user_text = export_text(sh, vh)
-    print(f"User text: {user_text}")
-    user_embedding = embed_text(user_text)  # numpy array shape (D,)
-    print(f"User embedding: {user_embedding}")
+    # 3) Vector profile từ history (item cũ không phải embed lại)
+    user_embedding = await user_profile_vector(user_profile, sh, vh)  # shape (D,)
+    print(f"User embedding: {user_embedding[:5]}...")
 
-    # 4) Load toàn bộ embeddings từ file JSON
-    #    Giả sử file đã được download trước và nằm ở data/output_embeddings.json
-    EMBED_PATH = "output_embeddings.json"
-    all_texts, all_embeds, all_norms = load_embeddings_from_json(EMBED_PATH)
+    # 4) Lấy snapshot catalog (không đọc lại file JSON)
+    catalog = catalog_manager.get()
 
-    # 5) Tìm 20 text gợi ý gần nhất
+    # 5) Tìm 20 text gợi ý gần nhất (tính toán CPU → chạy trong thread)
     topk = 20
-    recommendations = find_top_k_texts(
-        user_embedding, all_texts, all_embeds, all_norms, k=topk
+    recommendations = await asyncio.to_thread(
+        find_top_k_texts,
+        user_embedding, catalog.texts, catalog.embeds, k=topk,
+        index=catalog.index, params=params
     )
 
     # 6) Trả về kết quả
@@ -319,44 +402,281 @@ def get_recommendations(user_profile: str, testing=False) -> dict:
 
 
 
+# ================================================================
+# 4. Cache kết quả theo (user, history version) — xem rec_cache.py
+# ================================================================
+# version (mặc định) | event (chỉ tin sự kiện invalidate) | off
+REC_CACHE_MODE = os.getenv("REC_CACHE_MODE", "version")
+# Khi nhận sự kiện invalidate thì tính lại ngay trong nền (tham số search mặc định)
+REC_BACKGROUND_REFRESH = os.getenv("REC_BACKGROUND_REFRESH", "0") == "1"
+rec_cache = RecommendationCache(
+    max_users=int(os.getenv("REC_CACHE_USERS", "10000")),
+    ttl=float(os.getenv("REC_CACHE_TTL", "0")),
+)
+_refresh_tasks: set = set()
+
+
+class InvalidateRequest(BaseModel):
+    username: str
+    version: Optional[int] = None
+
+
+async def fetch_history_version(user_profile: str) -> Optional[int]:
+    data = await user_service.get_json(f"/users/{user_profile}/history/version")
+    return data.get("version") if isinstance(data, dict) else None
+
+
+async def get_recommendations_cached(user_profile: str, params: Optional[SearchParams] = None) -> dict:
+    """get_recommendations có cache; không biết version (user-service lỗi) → tính trực tiếp, không cache."""
+    if REC_CACHE_MODE == "off":
+        return await get_recommendations(user_profile, params=params)
+    params = params or SearchParams()
+    # Catalog đổi (hot reload) thì kết quả cũ cũng không còn đúng
+    key = (catalog_manager.get().checksum, params)
+
+    version = rec_cache.known_version(user_profile) if REC_CACHE_MODE == "event" else None
+    if version is None:
+        version = await fetch_history_version(user_profile)
+    if version is None:
+        return await get_recommendations(user_profile, params=params)
+
+    cached = rec_cache.get(user_profile, version, key)
+    if cached is not None:
+        return cached
+    result = await get_recommendations(user_profile, params=params)
+    rec_cache.put(user_profile, version, key, result)
+    return result
+
+
+@app.post("/cache/invalidate")
+async def invalidate_recommendations(req: InvalidateRequest):
+    # User Service gọi endpoint này sau khi ghi search/view history
+    rec_cache.invalidate(req.username, req.version)
+    if REC_BACKGROUND_REFRESH:
+        task = asyncio.create_task(get_recommendations_cached(req.username))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+    return {"ok": True}
+
+
 @app.post("/recommend")
-def recommend_endpoint(req: RecRequest):
+async def recommend_endpoint(req: RecRequest):
     # endpoint lấy đúng dict do get_recommendations trả về
-    resp = get_recommendations("user")
+    try:
+        resp = await get_recommendations_cached("user", params=req.search_params())
+    except EmbeddingQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     print(f"Recommendations for {req.user_profile}: completed")
-    return resp
+    # "asins" song song với "recommendations" (None nếu chưa map được), không ghi vào dict đã cache
+    return {**resp, "asins": product_linker.lookup(catalog_manager.get(), resp["recommendations"])}
 
 # =================== PHẦN MỚI: /search endpoint ====================
+def lexical_shortcut(catalog, query: str, k: int) -> List[int]:
+    """Query giống mã sản phẩm và mọi token đều khớp lexical → dùng luôn kết quả đó."""
+    if not (SEARCH_SHORTCUT and catalog.lexical is not None and looks_like_identifier(query)):
+        return []
+    idx, _ = catalog.lexical.search(query, k, mode="all")
+    return idx
+
+
+def search_response(catalog, idx: List[int]) -> Dict[str, list]:
+    texts = [catalog.texts[i] for i in idx]
+    return {"search_results": texts, "asins": product_linker.lookup(catalog, texts)}
+
+
 @app.post("/search")
-def search_endpoint(req: SearchRequest) -> Dict[str, List[str]]:
+async def search_endpoint(req: SearchRequest) -> Dict[str, List[Optional[str]]]:
     """
-    Nhận JSON: { "query": "<chuỗi search>" }
-    1) Tính embedding cho req.query bằng embed_text
-    2) Load embeddings từ file (cũng dùng load_embeddings_from_json)
-    3) Dùng find_top_k_texts(query_embedding, ...) để lấy 20 'texts' gần nhất
-    4) Trả về JSON: { "search_results": [ list of text ] }
+    Nhận JSON: { "query": "<chuỗi search>", "mode": "vector" | "lexical" | "hybrid" (tuỳ chọn) }
+    1) Lấy snapshot catalog đã load sẵn từ catalog_manager
+    2) hybrid: query kiểu mã model khớp lexical → trả luôn (không embed);
+       còn lại chạy BM25 song song với embed + top-k vector rồi trộn bằng RRF
+    3) vector: embedding + find_top_k_indices như trước; lexical: chỉ BM25
+    4) Trả về JSON: { "search_results": [ list of text ], "asins": [asin | null, ...] } (20 text)
     """
 
-    query_text = req.query
-    if not query_text or not query_text.strip():
-        return {"search_results": []}
-    query_text = (query_text.strip()+" ")*10
-    # 1) Tính embedding cho query
+    query = req.query
+    if not query or not query.strip():
+        return {"search_results": [], "asins": []}
+
+    # 1) Lấy snapshot catalog (giữ nguyên trong suốt request dù có reload)
+    catalog = catalog_manager.get()
+    if catalog.embeds.size == 0:
+        return {"search_results": [], "asins": []}
+
+    topk = 20
+    mode = req.mode or SEARCH_MODE
+    if catalog.lexical is None:
+        mode = "vector"
+
+    # 2) + 3) Nhánh lexical
+    if mode == "lexical":
+        idx, _ = await asyncio.to_thread(catalog.lexical.search, query, topk)
+        search_counts["lexical"] += 1
+        return search_response(catalog, idx)
+
+    lexical_task = None
+    if mode == "hybrid":
+        idx = await asyncio.to_thread(lexical_shortcut, catalog, query, topk)
+        if idx:
+            search_counts["shortcut"] += 1
+            return search_response(catalog, idx)
+        lexical_task = asyncio.ensure_future(
+            asyncio.to_thread(catalog.lexical.search, query, SEARCH_CANDIDATES)
+        )
+
+    # Nhánh vector: embedding query (qua micro-batcher, không chặn event loop)
     try:
-        query_embedding = embed_text(query_text)  # numpy array shape (D,)
+        query_embedding = await embedder.aembed(search_text(query))  # list[float] shape (D,)
+        vector_idx = await asyncio.to_thread(
+            find_top_k_indices,
+            query_embedding, catalog.embeds,
+            k=SEARCH_CANDIDATES if lexical_task else topk,
+            index=catalog.index, params=req.search_params()
+        )
+    except EmbeddingQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Cannot embed query: {e}")
+    finally:
+        if lexical_task is not None:
+            # nhánh vector lỗi thì không ai await lexical_task → tự lấy exception, tránh log "never retrieved"
+            lexical_task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
-    # 2) Load embeddings
-    EMBED_PATH = "output_embeddings.json"
-    all_texts, all_embeds, all_norms = load_embeddings_from_json(EMBED_PATH)
+    if lexical_task is None:
+        search_counts["vector"] += 1
+        return search_response(catalog, vector_idx)
 
-    if all_embeds.size == 0:
-        return {"search_results": []}
+    lexical_idx, _ = await lexical_task
+    search_counts["hybrid"] += 1
+    fused = rrf_fuse([lexical_idx, vector_idx], topk)
+    return search_response(catalog, fused)
 
-    # 3) Tìm top-20 closest texts
-    topk = 20
-    search_results = find_top_k_texts(query_embedding, all_texts, all_embeds, all_norms, k=topk)
 
-    # 4) Trả về array of strings
-    return {"search_results": search_results}
+# =================== Batch endpoints (job offline, đánh giá) ====================
+# Giới hạn số query mỗi request để bộ nhớ/latency của 1 request có chặn trên
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+
+
+def _check_batch_size(n: int):
+    if n > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({n} > {BATCH_MAX_QUERIES})")
+
+
+@app.post("/recommend/batch")
+async def recommend_batch_endpoint(req: BatchRecRequest):
+    """
+    Nhận JSON: { "user_profiles": ["alice", "bob", ...], "k": 20 }
+    Trả về: { "results": [ {"user_profile": ..., "recommendations": [...]}, ... ] }
+    """
+    _check_batch_size(len(req.user_profiles))
+    sem = asyncio.Semaphore(HISTORY_FETCH_CONCURRENCY)
+
+    async def vector_for(user_profile: str):
+        async with sem:
+            sh, vh = await fetch_user_history(user_profile)
+        return await user_profile_vector(user_profile, sh, vh)
+
+    # Item mới của các user đi qua queue của micro-batcher → gộp thành ít forward pass;
+    # queue đầy → 503 như /recommend
+    try:
+        embeddings = await asyncio.gather(*(vector_for(u) for u in req.user_profiles))
+    except EmbeddingQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    catalog = catalog_manager.get()
+    recs = await asyncio.to_thread(
+        find_top_k_texts_batch,
+        embeddings, catalog.texts, catalog.embeds, k=req.k,
+        index=catalog.index, params=req.search_params()
+    )
+    return {
+        "results": [
+            {"user_profile": u, "recommendations": r}
+            for u, r in zip(req.user_profiles, recs)
+        ]
+    }
+
+
+@app.post("/search/batch")
+async def search_batch_endpoint(req: BatchSearchRequest) -> Dict[str, List[List[str]]]:
+    """
+    Nhận JSON: { "queries": ["keyboard", "mouse", ...], "k": 20 }
+    Trả về: { "search_results": [ [texts cho query 0], [texts cho query 1], ... ] }
+    """
+    _check_batch_size(len(req.queries))
+    valid_pos = [i for i, q in enumerate(req.queries) if q and q.strip()]
+    embeddings = [[] for _ in req.queries]
+    # Query đi qua queue của micro-batcher như /search (chia theo EMBED_MAX_BATCH, xen kẽ với
+    # request đơn lẻ thay vì chiếm worker embed cho cả lô); queue không đủ chỗ → 503
+    try:
+        vectors = await embedder.aembed_many([search_text(req.queries[i]) for i in valid_pos]) if valid_pos else []
+    except EmbeddingQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    for i, vec in zip(valid_pos, vectors):
+        embeddings[i] = vec
+
+    catalog = catalog_manager.get()
+    if catalog.embeds.size == 0:
+        return {"search_results": [[] for _ in req.queries]}
+    results = await asyncio.to_thread(
+        find_top_k_texts_batch,
+        embeddings, catalog.texts, catalog.embeds, k=req.k,
+        index=catalog.index, params=req.search_params()
+    )
+    return {"search_results": results}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    # Hit/miss của cache embedding (enabled = False nếu EMBED_CACHE_SIZE=0) và cache kết quả /recommend
+    if isinstance(embedder, CachedEmbeddingProvider):
+        embedding = {"enabled": True, "backend": embedder.name, **embedder.cache.stats()}
+    else:
+        embedding = {"enabled": False}
+    return {
+        "embedding": embedding,
+        "recommendations": {"mode": REC_CACHE_MODE, **rec_cache.stats()},
+        "profiles": profile_engine.stats() if profile_engine else {"weighting": "text"},
+    }
+
+
+@app.get("/search/stats")
+def search_stats():
+    # Số request /search theo nhánh đã chạy (shortcut = trả kết quả lexical, bỏ qua embedding)
+    return {"mode": SEARCH_MODE, "shortcut": SEARCH_SHORTCUT, "candidates": SEARCH_CANDIDATES,
+            "lexical_index": catalog_manager.get().lexical is not None, "counts": dict(search_counts)}
+
+
+@app.get("/health")
+def health():
+    # Trạng thái circuit breaker của các dependency + catalog
+    deps = {"user-service": user_service.info()}
+    remote = getattr(batcher.provider, "client", None)
+    if isinstance(remote, ServiceClient):
+        deps["embedder"] = remote.info()
+    deps["product-service"] = product_service.info()
+    return {"catalog_loaded": catalog_manager.info()["loaded"], "dependencies": deps}
+
+
+@app.get("/embed/stats")
+def embed_stats():
+    # Trạng thái micro-batcher: độ sâu queue, số batch, kích thước batch trung bình, số request bị từ chối
+    return {"backend": batcher.name, **batcher.stats()}
+
+
+@app.get("/catalog")
+def catalog_info():
+    # Thông tin catalog đang phục vụ (số text, checksum, thời điểm load) + trạng thái map ASIN
+    return {**catalog_manager.info(), "product_links": product_linker.stats()}
+
+
+@app.post("/catalog/reload")
+def catalog_reload():
+    # Ép reload ngay (không chờ watcher), kể cả khi chỉ index ANN được build lại;
+    # lỗi khi build thì vẫn giữ catalog cũ
+    try:
+        catalog_manager.reload(force=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return catalog_manager.info()
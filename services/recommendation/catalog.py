@@ -0,0 +1,310 @@
+# services/recommendation/catalog.py
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.blacklist import BlacklistMatcher, load_matcher
+
+from ann_index import FlatIndex, load_index
+from embedding_store import open_store, store_paths
+from lexical import LexicalIndex
+from topk import normalize_rows
+
+
+_default_blacklist: Optional[BlacklistMatcher] = None
+
+
+def default_blacklist() -> BlacklistMatcher:
+    """Matcher mặc định, compile lần đầu cần dùng rồi dùng lại (reload catalog không compile lại)."""
+    global _default_blacklist
+    if _default_blacklist is None:
+        _default_blacklist = load_matcher()
+        print(f"✅ Blacklist: {_default_blacklist.info()}")
+    return _default_blacklist
+
+
+# ================================================================
+# 1. Định nghĩa hàm để load JSON và trả về all_texts, all_embeds, all_norms
+# ================================================================
+
+def load_embeddings_from_json(
+    json_path: str,
+    blacklist: Union[list[str], BlacklistMatcher] = None,
+    normalize: bool = False,
+    overwrite: bool = False
+):
+    """
+    Đọc file JSON (ví dụ: output_embeddings.json) có cấu trúc:
+    {
+        "text2embed": {
+            "Some text A": [0.12, -0.53, ...],
+            "Some text B": [0.45,  0.22, ...],
+            ...
+        }
+    }
+    Thêm 2 tham số:
+      • normalize (bool): 
+          - Nếu False (mặc định), giữ embedding gốc.
+          - Nếu True, tính vector chuẩn hóa (unit vector = v / ||v||).
+      • overwrite (bool):
+          - Nếu False (mặc định), KHÔNG ghi đè file JSON.
+          - Nếu True, ghi đè file JSON với các vector (gốc hoặc chuẩn hóa tuỳ normalize).
+    
+    Ngoài ra cho phép truyền thêm `blacklist` gồm các từ (hoặc cụm từ), hoặc 1 BlacklistMatcher.
+    Nếu text chứa bất kỳ từ nào trong blacklist (so sánh case-insensitive), sẽ bỏ qua text đó.
+
+    Trả về:
+      - filtered_texts: list[str] (các văn bản đã lọc)
+      - all_embeds: np.ndarray shape (N, D) chứa embedding gốc tương ứng
+      - all_norms:  np.ndarray shape (N,) là norm (||v||) của mỗi embedding gốc
+    """
+    # 1) Blacklist mặc định đọc từ common/blacklist.txt, compile 1 lần (Aho-Corasick / regex gộp)
+    if blacklist is None:
+        matcher = default_blacklist()
+    elif isinstance(blacklist, BlacklistMatcher):
+        matcher = blacklist
+    else:
+        matcher = BlacklistMatcher(blacklist)
+
+    # 2) Đọc toàn bộ JSON
+    with open(json_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    text2embed = raw.get("text2embed", {})
+    print(f"Loaded {len(text2embed)} texts from {json_path}.")
+
+    # Bitmask các text bị lọc, tính 1 lượt cho cả catalog
+    blocked = matcher.mask(text2embed.keys())
+
+    filtered_texts = []
+    filtered_embeds = []
+    # Dùng để lưu các vector (gốc hoặc chuẩn hóa) nếu cần overwrite
+    new_map: dict[str, list[float]] = {}
+
+    # 3) Lọc theo blacklist và tính norm + (tuỳ chọn normalize)
+    for (text, embed_list), skip in zip(text2embed.items(), blocked):
+        # Nếu text chứa bất kỳ term nào trong blacklist, skip
+        if skip:
+            continue
+
+        # Chuyển embed_list thành numpy array
+        raw_vec = np.array(embed_list, dtype=np.float32)
+        norm = np.linalg.norm(raw_vec)
+        if norm == 0:
+            # Nếu vector gốc có độ dài 0, ta skip luôn (không thể normalize)
+            continue
+
+        # Lưu embedding gốc
+        filtered_texts.append(text)
+        filtered_embeds.append(raw_vec)
+
+        # Tính vector để ghi nếu overwrite=True
+        if normalize:
+            norm_vec = (raw_vec / norm).tolist()
+            new_map[text] = norm_vec
+        else:
+            # Không normalize, giữ nguyên gốc
+            new_map[text] = raw_vec.tolist()
+
+    # 4) Chuyển danh sách embedding gốc thành numpy array shape (N, D)
+    if filtered_embeds:
+        all_embeds = np.stack(filtered_embeds, axis=0)  # shape (N, D)
+        all_norms = np.linalg.norm(all_embeds, axis=1)  # shape (N,)
+    else:
+        # Trường hợp không còn embedding nào sau lọc
+        all_embeds = np.empty((0, 0), dtype=np.float32)
+        all_norms = np.empty((0,), dtype=np.float32)
+
+    print(f"Filtered down to {len(filtered_texts)} texts after applying blacklist.")
+    print(f"Shape of all_embeds: {all_embeds.shape}")
+    print(f"Shape of all_norms: {all_norms.shape}")
+
+    # 5) Nếu overwrite=True, ghi đè file JSON với các vector đã chọn
+    if overwrite:
+        updated_content = {"text2embed": new_map}
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(updated_content, f, ensure_ascii=False, indent=2)
+        print(f"✅ Overwrote JSON file '{json_path}' with {'normalized' if normalize else 'original'} vectors.")
+
+    # 6) Trả về danh sách đã lọc cùng embedding gốc và norms
+    return filtered_texts, all_embeds, all_norms
+
+# ================================================================
+# 2. Catalog dùng chung cho cả process (load 1 lần, hot reload)
+# ================================================================
+
+def file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """Tính sha1 của file theo từng chunk (không đọc cả file vào RAM)."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass(frozen=True)
+class EmbeddingCatalog:
+    """
+    Snapshot bất biến của catalog embedding.
+      • embeds: (N, D) các hàng đã chuẩn hóa (||e_i|| = 1) → cosine = 1 GEMV
+      • norms:  (N,) norm của vector gốc (giữ lại để tham khảo)
+      • index:  backend top-k (FlatIndex exact, hoặc index faiss IVF/HNSW đã build offline)
+      • lexical: chỉ mục FTS5 trên texts (None nếu tắt), dùng cho /search hybrid
+    Mỗi request chỉ lấy 1 tham chiếu tới snapshot và dùng nó đến hết request,
+    nên texts/embeds/norms luôn nhất quán với nhau kể cả khi đang reload.
+    """
+    texts: list
+    embeds: np.ndarray
+    norms: np.ndarray
+    index: object
+    path: str
+    mtime_ns: int
+    size: int
+    checksum: str
+    loaded_at: float
+    lexical: Optional[LexicalIndex] = None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+class CatalogManager:
+    """
+    Giữ catalog hiện tại cho toàn bộ process.
+    `path` là file JSON cũ (*.json) hoặc prefix của store nhị phân (xem embedding_store.py).
+    `index_kind`: "auto" (hnsw → ivf → flat), "hnsw", "ivf" hoặc "flat"; index ANN chỉ có với store nhị phân.
+      • reload(): build catalog mới ở bên cạnh rồi mới gán vào self._catalog
+        (phép gán thuộc tính là atomic) → reader không bao giờ thấy catalog build dở.
+      • start_watcher(): thread nền kiểm tra mtime/size mỗi `reload_interval` giây,
+        chỉ tính checksum khi mtime đổi, và chỉ rebuild khi checksum thực sự khác.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 30.0, index_kind: str = "auto",
+                 lexical: bool = True):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index_kind = index_kind
+        self.lexical = lexical
+        self._catalog: Optional[EmbeddingCatalog] = None
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_store(self) -> bool:
+        return not self.path.endswith(".json")
+
+    def _source_file(self) -> str:
+        # Với store nhị phân, meta.json được ghi sau cùng nên dùng nó làm "dấu vân tay"
+        return store_paths(self.path)["meta"] if self.is_store else self.path
+
+    def _load_index(self, embeds, meta: dict):
+        kinds = ("hnsw", "ivf") if self.index_kind == "auto" else (self.index_kind,)
+        for kind in kinds:
+            if kind == "flat":
+                break
+            index = load_index(self.path, kind, store_sha1=meta.get("sha1"), count=meta.get("count"))
+            if index is not None:
+                return index
+        return FlatIndex(embeds)
+
+    def _load(self):
+        if self.is_store:
+            texts, embeds, norms, meta = open_store(self.path)
+            print(f"Opened binary store {self.path}: {embeds.shape} {embeds.dtype} (memmap)")
+            if not meta.get("normalized", False):
+                # Store cũ lưu vector gốc → chuẩn hóa trong RAM (mất lợi ích memmap)
+                print("⚠️ Store is not normalized; normalizing in memory. Re-run convert to fix.")
+                embeds = normalize_rows(embeds, norms)
+                return texts, embeds, norms, FlatIndex(embeds)
+            return texts, embeds, norms, self._load_index(embeds, meta)
+        texts, embeds, norms = load_embeddings_from_json(self.path)
+        # Chuẩn hóa 1 lần lúc build catalog thay vì chia cho norm ở mỗi query
+        embeds = normalize_rows(embeds, norms)
+        return texts, embeds, norms, FlatIndex(embeds)
+
+    def get(self) -> EmbeddingCatalog:
+        catalog = self._catalog
+        if catalog is None:
+            catalog = self.reload()
+        return catalog
+
+    def reload(self, force: bool = False) -> EmbeddingCatalog:
+        # Chỉ 1 thread được build tại 1 thời điểm; reader vẫn đọc snapshot cũ
+        with self._build_lock:
+            current = self._catalog
+            source = self._source_file()
+            st = os.stat(source)
+            if (not force and current is not None
+                    and current.mtime_ns == st.st_mtime_ns and current.size == st.st_size):
+                return current
+
+            checksum = file_checksum(source)
+            if not force and current is not None and current.checksum == checksum:
+                # File chỉ bị "touch", nội dung không đổi → giữ nguyên dữ liệu
+                self._catalog = replace(current, mtime_ns=st.st_mtime_ns, size=st.st_size)
+                return self._catalog
+
+            texts, embeds, norms, index = self._load()
+            lexical = LexicalIndex(texts) if self.lexical else None
+            catalog = EmbeddingCatalog(
+                texts=texts,
+                embeds=embeds,
+                norms=norms,
+                index=index,
+                path=self.path,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
+                checksum=checksum,
+                loaded_at=time.time(),
+                lexical=lexical,
+            )
+            self._catalog = catalog
+            print(f"✅ Catalog ready: {len(catalog)} texts, {index.kind} index (sha1={checksum[:12]})")
+            return catalog
+
+    def start_watcher(self):
+        if self.reload_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # Lỗi khi reload (file đang ghi dở, JSON hỏng...) → giữ catalog cũ
+                print(f"[ERROR] Reload catalog thất bại, giữ bản cũ: {e}")
+
+    def info(self) -> dict:
+        catalog = self._catalog
+        if catalog is None:
+            return {"loaded": False, "path": self.path}
+        return {
+            "loaded": True,
+            "path": catalog.path,
+            "size": len(catalog),
+            "index": catalog.index.kind,
+            "checksum": catalog.checksum,
+            "loaded_at": catalog.loaded_at,
+            "lexical": catalog.lexical.info() if catalog.lexical else None,
+        }
@@ -0,0 +1,123 @@
+# services/recommendation/clients.py
+"""
+HTTP client dùng chung cho các service phụ thuộc (user-service, embedder remote...).
+
+  • Mỗi dependency có 1 httpx.AsyncClient riêng (pool keep-alive, giới hạn số kết nối)
+    và timeout riêng, nên 1 service chậm không kéo theo các service khác.
+  • CircuitBreaker: sau `failure_threshold` lỗi liên tiếp (timeout, lỗi kết nối, 5xx)
+    thì "mở mạch" trong `reset_timeout` giây — các lời gọi trả về default ngay,
+    không chiếm worker chờ timeout. Hết thời gian thì cho 1 lời gọi thử (half-open).
+"""
+
+import asyncio
+import time
+from typing import Any, Optional
+
+import httpx
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Lời gọi thử kết thúc mà không có kết quả (bị huỷ, lỗi phía client) → cho thử lại."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ServiceClient:
+    """1 dependency = 1 pool kết nối + 1 timeout + 1 circuit breaker."""
+
+    def __init__(self, name: str, base_url: str, timeout: float = 2.0,
+                 max_connections: int = 100, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.breaker = breaker or CircuitBreaker()
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+        )
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Gửi request qua circuit breaker; raise CircuitOpen nếu mạch đang mở."""
+        if not self.breaker.allow():
+            raise CircuitOpen(f"{self.name} circuit is open")
+        try:
+            resp = await self._client.request(method, path, **kwargs)
+        except (httpx.TransportError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # CancelledError, DecodingError, TooManyRedirects...: không tính là dependency lỗi,
+            # nhưng không được giữ cờ probe (nếu không mạch half-open sẽ kẹt mãi)
+            self.breaker.release_probe()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    async def get_json(self, path: str, default: Any = None, **kwargs) -> Any:
+        """GET → JSON; mọi lỗi (mạch mở, timeout, status không 2xx, JSON hỏng) → default."""
+        try:
+            resp = await self.request("GET", path, **kwargs)
+            if not resp.is_success:
+                return default
+            return resp.json()
+        except (CircuitOpen, httpx.HTTPError, asyncio.TimeoutError, ValueError):
+            return default
+
+    async def post_json(self, path: str, body: Any, default: Any = None, **kwargs) -> Any:
+        """POST JSON → JSON; lỗi xử lý giống get_json."""
+        try:
+            resp = await self.request("POST", path, json=body, **kwargs)
+            if not resp.is_success:
+                return default
+            return resp.json()
+        except (CircuitOpen, httpx.HTTPError, asyncio.TimeoutError, ValueError):
+            return default
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def info(self) -> dict:
+        return {"base_url": self.base_url, "circuit": self.breaker.state, "failures": self.breaker.failures}
@@ -0,0 +1,292 @@
+# services/recommendation/embed_cache.py
+"""
+Cache text → embedding đặt trước bất kỳ backend embedding nào.
+
+  • Tầng RAM: LRU có giới hạn số entry + TTL.
+  • Tầng đĩa (tuỳ chọn): bảng SQLite (key, vector float32 dạng BLOB), sống qua restart
+    và dùng chung giữa các worker.
+Tầng đĩa là I/O đồng bộ → đường async (aembed/aembed_many) đọc/ghi nó qua asyncio.to_thread,
+chỉ tầng RAM được tra trực tiếp trên event loop.
+Key = sha1(namespace + text đã chuẩn hóa). Chuẩn hóa = NFKC, gộp khoảng trắng, lowercase
+(all-MiniLM-L6-v2 là model uncased nên lowercase không đổi embedding).
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedder import EmbeddingProvider
+
+
+def normalize_text(text: str, lowercase: bool = True) -> str:
+    text = " ".join(unicodedata.normalize("NFKC", text).split())
+    return text.lower() if lowercase else text
+
+
+class SqliteVectorStore:
+    """Tầng đĩa: 1 bảng SQLite, WAL để nhiều worker đọc/ghi song song."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embed_cache ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str, min_created_at: float) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vec, created_at FROM embed_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < min_created_at:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key: str, vec: np.ndarray, created_at: float):
+        self.put_many([(key, vec)], created_at)
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]], created_at: float):
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes(), created_at) for key, vec in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embed_cache (key, vec, created_at) VALUES (?, ?, ?)", rows
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embed_cache").fetchone()[0]
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0,
+                 disk: Optional[SqliteVectorStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        vec = self.get_mem(key)
+        if vec is not None:
+            return vec
+        return self.get_disk([key]).get(key)
+
+    def get_mem(self, key: str) -> Optional[np.ndarray]:
+        """Chỉ tầng RAM (không I/O); miss chưa được tính cho tới khi tra get_disk."""
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                created_at, vec = entry
+                if not self._expired(created_at, now):
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return vec
+                del self._mem[key]
+        return None
+
+    def get_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Tra tầng đĩa cho các key đã miss RAM (I/O đồng bộ); key tìm thấy được đưa lên RAM."""
+        now = time.time()
+        found = {}
+        if self.disk is not None:
+            min_created_at = now - self.ttl if self.ttl > 0 else 0.0
+            for key in keys:
+                vec = self.disk.get(key, min_created_at)
+                if vec is not None:
+                    self._put_mem(key, vec, now)
+                    found[key] = vec
+        with self._lock:
+            self.disk_hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def _put_mem(self, key: str, vec: np.ndarray, created_at: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._mem[key] = (created_at, vec)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def put(self, key: str, vec: np.ndarray):
+        vec = self.put_mem(key, vec)
+        self.put_disk([(key, vec)])
+
+    def put_mem(self, key: str, vec) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32)
+        self._put_mem(key, vec, time.time())
+        return vec
+
+    def put_disk(self, items: List[Tuple[str, np.ndarray]]):
+        """Ghi tầng đĩa (I/O đồng bộ, 1 transaction cho cả lô)."""
+        if self.disk is not None and items:
+            self.disk.put_many(items, time.time())
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk": self.disk is not None,
+            }
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """Bọc 1 provider: tra cache trước, chỉ embed các text bị miss; kết quả rỗng (lỗi) không được cache."""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache,
+                 namespace: str = "", lowercase: bool = True):
+        self.provider = provider
+        self.cache = cache
+        self.name = provider.name
+        self.namespace = namespace or provider.name
+        self.lowercase = lowercase
+
+    def key(self, text: str) -> str:
+        norm = normalize_text(text, self.lowercase)
+        return hashlib.sha1(f"{self.namespace}\x00{norm}".encode("utf-8")).hexdigest()
+
+    def warmup(self):
+        self.provider.warmup()
+
+    def embed(self, text: str) -> list:
+        key = self.key(text)
+        vec = self.cache.get(key)
+        if vec is not None:
+            return vec.tolist()
+        result = self.provider.embed(text)
+        if len(result) > 0:
+            self.cache.put(key, result)
+        return result
+
+    async def aembed(self, text: str) -> list:
+        key, results, missing = await self._alookup([text])
+        if not missing:
+            return results[0]
+        result = await self.provider.aembed(text)
+        await self._astore(key, results, missing, [result])
+        return result
+
+    def _lookup(self, texts: List[str]) -> tuple:
+        keys = [self.key(t) for t in texts]
+        results: List[list] = [[] for _ in texts]
+        missing = []
+        for i, key in enumerate(keys):
+            vec = self.cache.get(key)
+            if vec is not None:
+                results[i] = vec.tolist()
+            else:
+                missing.append(i)
+        return keys, results, missing
+
+    def _fill(self, keys: list, results: list, missing: list, vectors: List[list]) -> List[list]:
+        for i, vec in zip(missing, vectors):
+            results[i] = vec
+            if len(vec) > 0:
+                self.cache.put(keys[i], vec)
+        return results
+
+    def embed_many(self, texts: List[str]) -> List[list]:
+        keys, results, missing = self._lookup(texts)
+        if not missing:
+            return results
+        vectors = self.provider.embed_many([texts[i] for i in missing])
+        return self._fill(keys, results, missing, vectors)
+
+    async def _alookup(self, texts: List[str]) -> tuple:
+        """_lookup cho đường async: RAM tra trực tiếp, tầng đĩa (SQLite) chạy ngoài event loop."""
+        keys = [self.key(t) for t in texts]
+        results: List[list] = [[] for _ in texts]
+        missing = []
+        for i, key in enumerate(keys):
+            vec = self.cache.get_mem(key)
+            if vec is not None:
+                results[i] = vec.tolist()
+            else:
+                missing.append(i)
+        if missing:
+            miss_keys = [keys[i] for i in missing]
+            if self.cache.disk is not None:
+                found = await asyncio.to_thread(self.cache.get_disk, miss_keys)
+            else:
+                found = self.cache.get_disk(miss_keys)
+            for i in missing:
+                if keys[i] in found:
+                    results[i] = found[keys[i]].tolist()
+            missing = [i for i in missing if keys[i] not in found]
+        return keys, results, missing
+
+    async def _astore(self, keys: list, results: list, missing: list, vectors: List[list]) -> List[list]:
+        to_disk = []
+        for i, vec in zip(missing, vectors):
+            results[i] = vec
+            if len(vec) > 0:
+                to_disk.append((keys[i], self.cache.put_mem(keys[i], vec)))
+        if to_disk and self.cache.disk is not None:
+            await asyncio.to_thread(self.cache.put_disk, to_disk)
+        return results
+
+    async def aembed_many(self, texts: List[str]) -> List[list]:
+        keys, results, missing = await self._alookup(texts)
+        if not missing:
+            return results
+        vectors = await self.provider.aembed_many([texts[i] for i in missing])
+        return await self._astore(keys, results, missing, vectors)
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+
+def make_cached_provider(provider: EmbeddingProvider) -> EmbeddingProvider:
+    """
+    Bọc provider bằng cache theo cấu hình môi trường:
+      EMBED_CACHE_SIZE (số entry RAM, 0 = tắt cache), EMBED_CACHE_TTL (giây, 0 = không hết hạn),
+      EMBED_CACHE_PATH (file SQLite cho tầng đĩa, rỗng = không dùng),
+      EMBED_CACHE_NAMESPACE (mặc định tên backend; đổi khi đổi model).
+    """
+    size = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+    if size <= 0:
+        return provider
+    disk_path = os.getenv("EMBED_CACHE_PATH", "")
+    cache = EmbeddingCache(
+        max_entries=size,
+        ttl=float(os.getenv("EMBED_CACHE_TTL", "86400")),
+        disk=SqliteVectorStore(disk_path) if disk_path else None,
+    )
+    return CachedEmbeddingProvider(
+        provider, cache,
+        namespace=os.getenv("EMBED_CACHE_NAMESPACE", ""),
+    )
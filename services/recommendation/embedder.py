@@ -0,0 +1,425 @@
+# services/recommendation/embedder.py
+"""
+Các backend tạo embedding cho text, chọn bằng biến môi trường EMBED_BACKEND:
+  • local  : chạy all-MiniLM-L6-v2 ngay trong process (ONNX Runtime, mặc định bản quantized),
+             không cần torch.
+  • remote : gọi HTTP POST {EMBED_URL}/embed như trước (notebook Kaggle + ngrok).
+  • stub   : vector giả nhưng tất định (hash của text) — dùng cho test / chạy offline.
+
+Mọi backend trả về list[float]; lỗi → [] (giữ nguyên hợp đồng của embed_text cũ).
+Request đồng thời được gom thành batch bởi AsyncMicroBatcher (make_batcher).
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import httpx
+import numpy as np
+import requests
+
+from clients import CircuitOpen, ServiceClient
+
+EMBED_DIM = 384  # all-MiniLM-L6-v2
+
+
+class EmbeddingProvider(ABC):
+    name = "base"
+    # True → aembed_many là I/O async thật (không cần chạy trong thread)
+    native_async = False
+
+    @abstractmethod
+    def embed_many(self, texts: List[str]) -> List[list]:
+        """Batch text → list vector (lỗi → [] cho text đó). Backend bắt buộc cài đặt."""
+
+    def embed(self, text: str) -> list:
+        return self.embed_many([text])[0]
+
+    async def aembed(self, text: str) -> list:
+        # Mặc định chạy bản sync trong thread để không chặn event loop
+        return await asyncio.to_thread(self.embed, text)
+
+    async def aembed_many(self, texts: List[str]) -> List[list]:
+        return await asyncio.to_thread(self.embed_many, texts)
+
+    def warmup(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+# ================================================================
+# 1. Remote: endpoint /embed (notebook Kaggle qua ngrok)
+# ================================================================
+class RemoteEmbeddingProvider(EmbeddingProvider):
+    name = "remote"
+    native_async = True
+
+    def __init__(self, base_url: str, timeout: float = 30.0, batch_path: str = "",
+                 max_connections: int = 32):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # Nếu server hỗ trợ, POST {"texts": [...]} → {"embeddings": [[...], ...]} cho cả batch
+        self.batch_path = batch_path
+        # Đường async (request handler): pool httpx keep-alive + circuit breaker
+        self.client = ServiceClient("embedder", self.base_url, timeout=timeout,
+                                    max_connections=max_connections)
+        # Đường sync (warmup, script): Session để tái sử dụng kết nối
+        self._session = requests.Session()
+
+    def embed(self, text: str) -> list:
+        """
+        Gửi 1 chuỗi text lên endpoint /embed, trả về embedding (list of floats).
+        Nếu lỗi (status != 200), hàm sẽ in ra lỗi và return [].
+        """
+        endpoint = f"{self.base_url}/embed"
+        payload = {"text": text}
+        try:
+            resp = self._session.post(endpoint, json=payload, timeout=self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            return data.get("embedding", [])
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] Gọi /embed thất bại: {e}")
+            return []
+        except ValueError:
+            print("[ERROR] Phản hồi không phải JSON hợp lệ")
+            return []
+
+    def embed_many(self, texts: List[str]) -> List[list]:
+        if not self.batch_path or len(texts) == 1:
+            # Endpoint /embed chỉ nhận 1 text mỗi lần
+            return [self.embed(t) for t in texts]
+        endpoint = f"{self.base_url}/{self.batch_path.lstrip('/')}"
+        try:
+            resp = self._session.post(endpoint, json={"texts": texts}, timeout=self.timeout)
+            resp.raise_for_status()
+            vectors = resp.json().get("embeddings", [])
+            if len(vectors) != len(texts):
+                raise ValueError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+            return vectors
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"[ERROR] Gọi {self.batch_path} thất bại: {e}")
+            return [[] for _ in texts]
+
+    async def aembed(self, text: str) -> list:
+        try:
+            resp = await self.client.request("POST", "/embed", json={"text": text})
+            resp.raise_for_status()
+            return resp.json().get("embedding", [])
+        except (CircuitOpen, httpx.HTTPError, ValueError) as e:
+            print(f"[ERROR] Gọi /embed thất bại: {e}")
+            return []
+
+    async def aembed_many(self, texts: List[str]) -> List[list]:
+        if not self.batch_path or len(texts) == 1:
+            # Không có endpoint batch → gửi song song trên cùng 1 pool kết nối
+            return list(await asyncio.gather(*(self.aembed(t) for t in texts)))
+        try:
+            resp = await self.client.request("POST", "/" + self.batch_path.lstrip("/"), json={"texts": texts})
+            resp.raise_for_status()
+            vectors = resp.json().get("embeddings", [])
+            if len(vectors) != len(texts):
+                raise ValueError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+            return vectors
+        except (CircuitOpen, httpx.HTTPError, ValueError) as e:
+            print(f"[ERROR] Gọi {self.batch_path} thất bại: {e}")
+            return [[] for _ in texts]
+
+    async def aclose(self):
+        await self.client.aclose()
+        self._session.close()
+
+
+# ================================================================
+# 2. Local: all-MiniLM-L6-v2 bằng ONNX Runtime (mean pooling + L2 normalize,
+#    giống pipeline SentenceTransformer mà các notebook dùng để build catalog)
+# ================================================================
+class LocalOnnxEmbeddingProvider(EmbeddingProvider):
+    name = "local"
+
+    def __init__(self, model: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 onnx_file: str = "onnx/model_quint8_avx2.onnx",
+                 max_length: int = 256, num_threads: int = 0):
+        self.model = model
+        self.onnx_file = onnx_file
+        self.max_length = max_length
+        self.num_threads = num_threads
+        self._session = None
+        self._tokenizer = None
+        self._input_names = ()
+        self._lock = threading.Lock()
+
+    def _resolve(self, filename: str) -> str:
+        # EMBED_MODEL có thể là thư mục local (đã tải sẵn trong image) hoặc repo id trên HF Hub
+        if os.path.isdir(self.model):
+            return os.path.join(self.model, filename)
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(self.model, filename)
+
+    def _load(self):
+        with self._lock:
+            if self._session is not None:
+                return
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+
+            tokenizer = Tokenizer.from_file(self._resolve("tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+            opts = ort.SessionOptions()
+            if self.num_threads > 0:
+                opts.intra_op_num_threads = self.num_threads
+            session = ort.InferenceSession(
+                self._resolve(self.onnx_file), sess_options=opts, providers=["CPUExecutionProvider"]
+            )
+            self._input_names = tuple(i.name for i in session.get_inputs())
+            self._tokenizer = tokenizer
+            self._session = session
+            print(f"✅ Loaded local embedding model {self.model} ({self.onnx_file})")
+
+    def warmup(self):
+        self._load()
+        self.embed_many(["warmup"])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """(B, D) float32, mỗi hàng là unit vector."""
+        if self._session is None:
+            self._load()
+        if not texts:
+            return np.empty((0, EMBED_DIM), dtype=np.float32)
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeds = self._session.run(None, feeds)[0]            # (B, T, D)
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeds * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def embed_many(self, texts: List[str]) -> List[list]:
+        try:
+            return [row.tolist() for row in self.encode(texts)]
+        except Exception as e:
+            print(f"[ERROR] Local embedding thất bại: {e}")
+            return [[] for _ in texts]
+
+
+# ================================================================
+# 3. Stub: vector tất định theo sha256(text), không cần model hay mạng
+# ================================================================
+class StubEmbeddingProvider(EmbeddingProvider):
+    name = "stub"
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+
+    def embed_many(self, texts: List[str]) -> List[list]:
+        out = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            out.append((vec / np.linalg.norm(vec)).tolist())
+        return out
+
+
+# ================================================================
+# 4. Async micro-batcher: gom các request embed đồng thời thành 1 batch
+# ================================================================
+class EmbeddingQueueFull(Exception):
+    """Hàng đợi embed đã đầy (backpressure) → endpoint trả 503."""
+
+
+class AsyncMicroBatcher(EmbeddingProvider):
+    """
+    Bọc 1 provider. Mỗi lời gọi aembed() đẩy (text, future) vào asyncio.Queue
+    (aembed_many() đẩy 1 cặp cho mỗi text);
+    task nền gom tối đa `max_batch` text hoặc chờ tối đa `max_wait_ms` kể từ text đầu tiên,
+    chạy 1 lần provider.embed_many() (1 forward pass / 1 remote call) trong executor
+    rồi resolve future của từng caller.
+      • max_queue: số text đang chờ tối đa; vượt quá → EmbeddingQueueFull (cả lô bị từ chối,
+        không text nào vào queue).
+      • embed() (sync, gọi từ threadpool của FastAPI) cũng đi qua batcher bằng
+        run_coroutine_threadsafe khi event loop đang chạy.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, max_batch: int = 32,
+                 max_wait_ms: float = 5.0, max_queue: int = 1024, workers: int = 1):
+        self.provider = provider
+        self.name = provider.name
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"embed-{self.name}")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._workers = workers
+        self.batches = 0
+        self.batched_items = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        await self.provider.aclose()
+
+    def warmup(self):
+        self.provider.warmup()
+
+    def _admit(self, n: int):
+        if self._queue.qsize() + n > self.max_queue:
+            self.rejected += n
+            raise EmbeddingQueueFull(f"embedding queue is full ({self.max_queue})")
+
+    async def aembed(self, text: str) -> list:
+        if not self._tasks:
+            return await asyncio.to_thread(self.provider.embed, text)
+        self._admit(1)
+        fut = self._loop.create_future()
+        self._queue.put_nowait((text, fut))
+        return await fut
+
+    def embed(self, text: str) -> list:
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return self.provider.embed(text)
+        try:
+            if asyncio.get_running_loop() is loop:
+                # Gọi sync ngay trên event loop → chờ future sẽ deadlock, gọi thẳng provider
+                return self.provider.embed(text)
+        except RuntimeError:
+            pass
+        return asyncio.run_coroutine_threadsafe(self.aembed(text), loop).result()
+
+    def embed_many(self, texts: List[str]) -> List[list]:
+        # Giống embed(): từ thread khác thì đi qua queue (chia batch max_batch, chịu max_queue)
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return self.provider.embed_many(texts)
+        try:
+            if asyncio.get_running_loop() is loop:
+                return self.provider.embed_many(texts)
+        except RuntimeError:
+            pass
+        return asyncio.run_coroutine_threadsafe(self.aembed_many(texts), loop).result()
+
+    async def aembed_many(self, texts: List[str]) -> List[list]:
+        if not texts:
+            return []
+        if not self._tasks:
+            return await self._embed_batch(texts)
+        # Mỗi text 1 future trong cùng queue → gộp batch với request khác và chịu giới hạn max_queue
+        self._admit(len(texts))
+        futures = []
+        for text in texts:
+            fut = self._loop.create_future()
+            self._queue.put_nowait((text, fut))
+            futures.append(fut)
+        return list(await asyncio.gather(*futures))
+
+    async def _embed_batch(self, texts: List[str]) -> List[list]:
+        if self.provider.native_async:
+            return await self.provider.aembed_many(texts)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.provider.embed_many, texts)
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Lấy ngay những gì đã có trong queue, chỉ chờ khi queue rỗng
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            batch = [(t, f) for t, f in batch if not f.cancelled()]
+            if not batch:
+                continue
+            texts = [t for t, _ in batch]
+            try:
+                vectors = await self._embed_batch(texts)
+            except Exception as e:
+                print(f"[ERROR] Batch embedding thất bại: {e}")
+                vectors = [[] for _ in texts]
+            self.batches += 1
+            self.batched_items += len(texts)
+            for (_, fut), vec in zip(batch, vectors):
+                if not fut.done():
+                    fut.set_result(vec)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+def make_batcher(provider: EmbeddingProvider) -> AsyncMicroBatcher:
+    """Bọc provider bằng AsyncMicroBatcher theo EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS, EMBED_MAX_QUEUE, EMBED_BATCH_WORKERS."""
+    return AsyncMicroBatcher(
+        provider,
+        max_batch=int(os.getenv("EMBED_MAX_BATCH", "32")),
+        max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")),
+        max_queue=int(os.getenv("EMBED_MAX_QUEUE", "1024")),
+        workers=int(os.getenv("EMBED_BATCH_WORKERS", "1")),
+    )
+
+
+def make_provider(backend: Optional[str] = None) -> EmbeddingProvider:
+    """Tạo provider theo cấu hình môi trường (EMBED_BACKEND, EMBED_URL, EMBED_MODEL, ...)."""
+    backend = (backend or os.getenv("EMBED_BACKEND", "local")).lower()
+    if backend == "remote":
+        return RemoteEmbeddingProvider(
+            os.getenv("EMBED_URL", "https://7378-34-91-110-183.ngrok-free.app"),
+            timeout=float(os.getenv("EMBED_TIMEOUT", "30")),
+            batch_path=os.getenv("EMBED_REMOTE_BATCH_PATH", ""),
+        )
+    if backend == "stub":
+        return StubEmbeddingProvider(int(os.getenv("EMBED_DIM", str(EMBED_DIM))))
+    if backend == "local":
+        return LocalOnnxEmbeddingProvider(
+            model=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            onnx_file=os.getenv("EMBED_ONNX_FILE", "onnx/model_quint8_avx2.onnx"),
+            max_length=int(os.getenv("EMBED_MAX_LENGTH", "256")),
+            num_threads=int(os.getenv("EMBED_THREADS", "0")),
+        )
+    raise ValueError(f"Unknown EMBED_BACKEND={backend!r} (expected local, remote or stub)")
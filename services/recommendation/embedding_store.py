@@ -0,0 +1,201 @@
+# services/recommendation/embedding_store.py
+"""
+Định dạng nhị phân cho catalog embedding (thay cho output_embeddings.json).
+
+Với 1 prefix, ví dụ `embeddings/output_embeddings`, store gồm:
+  • <prefix>.npy          ma trận (N, D) float32 hoặc float16 (np.load mmap_mode="r"),
+                          mặc định mỗi hàng đã chuẩn hóa về unit vector (meta "normalized")
+  • <prefix>.norms.npy    (N,) float32, norm của vector gốc
+  • <prefix>.texts        toàn bộ text (UTF-8) nối liền nhau
+  • <prefix>.offsets.npy  (N+1,) int64, text i = texts[offsets[i]:offsets[i+1]]
+  • <prefix>.meta.json    count, dim, dtype, sha1... (ghi cuối cùng)
+
+Service mở store bằng memmap nên startup gần như tức thì, và nhiều worker uvicorn
+dùng chung 1 bản trong page cache của OS.
+
+CLI chuyển từ JSON cũ:
+    python embedding_store.py convert output_embeddings.json embeddings/output_embeddings [--dtype float16] [--raw]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from topk import normalize_rows
+
+STORE_VERSION = 1
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def store_paths(prefix: str) -> dict:
+    return {
+        "matrix": f"{prefix}.npy",
+        "norms": f"{prefix}.norms.npy",
+        "texts": f"{prefix}.texts",
+        "offsets": f"{prefix}.offsets.npy",
+        "meta": f"{prefix}.meta.json",
+    }
+
+
+def store_exists(prefix: str) -> bool:
+    return os.path.exists(store_paths(prefix)["meta"])
+
+
+class TextTable:
+    """
+    Danh sách text chỉ đọc, decode lười từ file blob + offsets (đều memmap).
+    Hỗ trợ len() và truy cập theo index như 1 list.
+    """
+
+    def __init__(self, texts_path: str, offsets_path: str):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        if os.path.getsize(texts_path) > 0:
+            self._blob = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            self._blob = np.empty((0,), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+
+    def __getitem__(self, i) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def write_store(prefix: str, texts: list, embeds: np.ndarray, norms: np.ndarray = None,
+                dtype: str = "float32", normalized: bool = True, extra_meta: dict = None) -> dict:
+    """
+    Ghi store xuống đĩa. Mỗi file được ghi ra file tạm rồi os.replace(),
+    meta.json ghi cuối cùng → reader (kể cả đang memmap bản cũ) không thấy store dở dang.
+    normalized=True → lưu các hàng đã chia cho norm (norms.npy vẫn là norm gốc).
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"dtype phải là một trong {SUPPORTED_DTYPES}")
+    paths = store_paths(prefix)
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+
+    embeds = np.asarray(embeds, dtype=np.float32)
+    if embeds.ndim != 2 or embeds.shape[0] != len(texts):
+        raise ValueError(f"embeds shape {embeds.shape} không khớp với {len(texts)} texts")
+    if norms is None:
+        norms = np.linalg.norm(embeds, axis=1)
+    if normalized:
+        embeds = normalize_rows(embeds, norms)
+    matrix = embeds.astype(dtype, copy=False)
+
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+
+    sha1 = hashlib.sha1()
+    tmp = {name: f"{path}.tmp" for name, path in paths.items()}
+    # np.save tự thêm ".npy" nếu tên file không kết thúc bằng .npy → ghi qua file object
+    with open(tmp["matrix"], "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix))
+    sha1.update(np.ascontiguousarray(matrix).tobytes())
+    with open(tmp["norms"], "wb") as f:
+        np.save(f, np.asarray(norms, dtype=np.float32))
+    with open(tmp["offsets"], "wb") as f:
+        np.save(f, offsets)
+    with open(tmp["texts"], "wb") as f:
+        for b in encoded:
+            f.write(b)
+            sha1.update(b)
+
+    meta = {
+        "version": STORE_VERSION,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "dtype": dtype,
+        "normalized": bool(normalized),
+        "sha1": sha1.hexdigest(),
+        "created_at": time.time(),
+    }
+    if extra_meta:
+        meta.update(extra_meta)
+    with open(tmp["meta"], "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    for name in ("matrix", "norms", "offsets", "texts", "meta"):
+        os.replace(tmp[name], paths[name])
+    return meta
+
+
+def open_store(prefix: str):
+    """
+    Mở store ở chế độ chỉ đọc.
+    Trả về (texts: TextTable, embeds: np.memmap (N, D), norms: np.memmap (N,), meta: dict)
+    """
+    paths = store_paths(prefix)
+    with open(paths["meta"], "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != STORE_VERSION:
+        raise ValueError(f"Store version {meta.get('version')} không được hỗ trợ")
+
+    embeds = np.load(paths["matrix"], mmap_mode="r")
+    norms = np.load(paths["norms"], mmap_mode="r")
+    texts = TextTable(paths["texts"], paths["offsets"])
+    if embeds.shape != (meta["count"], meta["dim"]) or len(texts) != meta["count"]:
+        raise ValueError(f"Store {prefix} không nhất quán với meta.json")
+    return texts, embeds, norms, meta
+
+
+def convert_json(json_path: str, prefix: str, dtype: str = "float32", apply_blacklist: bool = True,
+                 normalized: bool = True) -> dict:
+    """Chuyển output_embeddings.json → store nhị phân (áp dụng blacklist mặc định như service)."""
+    from catalog import load_embeddings_from_json
+
+    texts, embeds, norms = load_embeddings_from_json(
+        json_path, blacklist=None if apply_blacklist else []
+    )
+    if embeds.size == 0:
+        embeds = np.empty((0, 0), dtype=np.float32)
+    meta = write_store(
+        prefix, texts, embeds, norms, dtype=dtype, normalized=normalized,
+        extra_meta={"source": os.path.basename(json_path), "blacklist_applied": apply_blacklist},
+    )
+    print(f"✅ Wrote {meta['count']} x {meta['dim']} {dtype} embeddings to {prefix}.*")
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embedding store tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="Convert output_embeddings.json to the binary store")
+    conv.add_argument("json_path")
+    conv.add_argument("prefix", help="Output prefix, e.g. embeddings/output_embeddings")
+    conv.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    conv.add_argument("--no-blacklist", action="store_true", help="Keep every text (skip blacklist filter)")
+    conv.add_argument("--raw", action="store_true", help="Store raw vectors instead of unit-normalized rows")
+
+    info = sub.add_parser("info", help="Print store metadata")
+    info.add_argument("prefix")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        convert_json(args.json_path, args.prefix, dtype=args.dtype,
+                     apply_blacklist=not args.no_blacklist, normalized=not args.raw)
+    elif args.command == "info":
+        texts, embeds, _, meta = open_store(args.prefix)
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+        if len(texts):
+            print(f"First text: {texts[0][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# services/recommendation/lexical.py
+"""
+Chỉ mục lexical (FTS5/BM25, SQLite in-memory) trên texts của catalog.
+
+rowid = vị trí hàng trong catalog, nên kết quả dùng chung chỉ số với ma trận embedding
+và trộn được với kết quả vector (xem rrf_fuse). Build cùng lúc với snapshot catalog.
+"""
+
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.fts import fts_query
+
+# Query kiểu mã model: "EM60", "530T", "wpa4220kit" (có chữ số, không khoảng trắng)
+_IDENTIFIER = re.compile(r"^(?=\w*\d)\w[\w.\-]*$", re.UNICODE)
+
+# Hằng số k của reciprocal-rank fusion (Cormack et al. dùng 60)
+RRF_K = 60
+
+
+def looks_like_identifier(query: str) -> bool:
+    tokens = (query or "").split()
+    return bool(tokens) and all(_IDENTIFIER.match(t) for t in tokens)
+
+
+class LexicalIndex:
+    kind = "fts5"
+
+    def __init__(self, texts: Sequence[str]):
+        t0 = time.time()
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._conn.execute("CREATE VIRTUAL TABLE docs USING fts5(text, tokenize='unicode61')")
+        self._conn.executemany("INSERT INTO docs (rowid, text) VALUES (?, ?)",
+                               ((i, t) for i, t in enumerate(texts)))
+        self._conn.commit()
+        # 1 kết nối in-memory dùng chung → tuần tự hoá truy vấn (mỗi truy vấn ~ms)
+        self._lock = threading.Lock()
+        self.size = len(texts)
+        self.build_seconds = time.time() - t0
+
+    def search(self, query: str, k: int, mode: str = "any", prefix: bool = False) -> Tuple[List[int], List[float]]:
+        """(chỉ số hàng, score = -bm25) theo thứ tự liên quan giảm dần."""
+        match = fts_query(query, mode, prefix=prefix)
+        if match is None or k <= 0:
+            return [], []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, bm25(docs) FROM docs WHERE docs MATCH ? ORDER BY bm25(docs) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        return [r[0] for r in rows], [-r[1] for r in rows]
+
+    def info(self) -> dict:
+        return {"kind": self.kind, "size": self.size, "build_seconds": round(self.build_seconds, 3)}
+
+
+def rrf_fuse(rankings: List[List[int]], k: int, rrf_k: int = RRF_K) -> List[int]:
+    """Reciprocal-rank fusion: score(d) = Σ 1 / (rrf_k + rank_i(d)), rank bắt đầu từ 1."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
@@ -0,0 +1,63 @@
+# services/recommendation/product_links.py
+"""
+Liên kết text trong catalog embedding → ASIN, để /recommend và /search trả kèm "asins"
+(client lấy card qua /products/batch mà không phải tự load metadata / danh sách title).
+
+Rec Service không đọc meta_Electronics.csv: sau mỗi lần catalog đổi (checksum khác), text
+được gửi theo lô tới POST /products/resolve của Product Service (chạy nền, không chặn request).
+Trong lúc chưa map xong (hoặc Product Service lỗi) thì asin = None; lần thử lại sau RETRY giây.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from clients import ServiceClient
+
+
+class ProductLinker:
+    def __init__(self, client: ServiceClient, chunk: int = 1000, retry: float = 30.0):
+        self.client = client
+        self.chunk = chunk
+        self.retry = retry
+        self.checksum: Optional[str] = None    # catalog đã map xong
+        self._asins: Dict[str, Optional[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._failed_at: Dict[str, float] = {}
+        self.linked = 0
+
+    def ensure(self, catalog):
+        """Bắt đầu map catalog này trong nền nếu chưa map (gọi trên event loop)."""
+        if catalog.checksum == self.checksum or (self._task is not None and not self._task.done()):
+            return
+        failed_at = self._failed_at.get(catalog.checksum)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry:
+            return
+        self._task = asyncio.create_task(self._link(catalog))
+
+    async def _link(self, catalog):
+        texts = list(dict.fromkeys(catalog.texts))
+        asins: Dict[str, Optional[str]] = {}
+        for i in range(0, len(texts), self.chunk):
+            chunk = texts[i:i + self.chunk]
+            resolved = await self.client.post_json("/products/resolve", {"texts": chunk})
+            if not isinstance(resolved, list) or len(resolved) != len(chunk):
+                self._failed_at = {catalog.checksum: time.monotonic()}
+                print(f"⚠️ Could not link catalog texts to ASINs via {self.client.base_url}")
+                return
+            asins.update(zip(chunk, resolved))
+        # Gán 1 lần → reader không thấy bảng map dở
+        self._asins, self.checksum = asins, catalog.checksum
+        self._failed_at = {}
+        self.linked = sum(1 for a in asins.values() if a)
+        print(f"✅ Linked {self.linked}/{len(texts)} catalog texts to ASINs")
+
+    def lookup(self, catalog, texts: List[str]) -> List[Optional[str]]:
+        self.ensure(catalog)
+        if catalog.checksum != self.checksum:
+            return [None] * len(texts)
+        return [self._asins.get(t) for t in texts]
+
+    def stats(self) -> dict:
+        return {"checksum": self.checksum, "texts": len(self._asins), "linked": self.linked,
+                "running": self._task is not None and not self._task.done()}
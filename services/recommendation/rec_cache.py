@@ -0,0 +1,94 @@
+# services/recommendation/rec_cache.py
+"""
+Cache kết quả /recommend theo (user, history version, tham số search).
+
+User Service tăng `version` của user mỗi khi ghi search/view history, và (tuỳ chọn)
+POST /cache/invalidate sang service này. Kết quả chỉ thay đổi khi history thay đổi,
+nên trong lúc version chưa đổi, top-k được trả thẳng từ RAM.
+
+Hai chế độ (REC_CACHE_MODE):
+  • version : mỗi request hỏi version hiện tại (1 query theo khoá chính ở user-service),
+              trúng cache thì bỏ qua fetch history + embed + quét catalog.
+  • event   : tin vào sự kiện invalidate từ user-service, không gọi mạng khi trúng cache.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class RecommendationCache:
+    def __init__(self, max_users: int = 10000, ttl: float = 0.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        # username → (version, {params_key: (created_at, result)})
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # version mới nhất đã biết (từ sự kiện invalidate)
+        self._known_versions: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def known_version(self, username: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(username)
+            known = self._known_versions.get(username)
+            if entry is None:
+                return known
+            return entry[0] if known is None else max(entry[0], known)
+
+    def get(self, username: str, version: int, params_key: Hashable) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] == version:
+                hit = entry[1].get(params_key)
+                if hit is not None and (self.ttl <= 0 or now - hit[0] <= self.ttl):
+                    self._entries.move_to_end(username)
+                    self.hits += 1
+                    return hit[1]
+            self.misses += 1
+            return None
+
+    def put(self, username: str, version: int, params_key: Hashable, result: Any):
+        with self._lock:
+            known = self._known_versions.get(username)
+            if known is not None and version < known:
+                # Đã có sự kiện cho version mới hơn trong lúc đang tính → bỏ kết quả cũ
+                return
+            entry = self._entries.get(username)
+            if entry is None or entry[0] != version:
+                entry = (version, {})
+                self._entries[username] = entry
+            entry[1][params_key] = (time.time(), result)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                old_user, _ = self._entries.popitem(last=False)
+                self._known_versions.pop(old_user, None)
+
+    def invalidate(self, username: str, version: Optional[int] = None):
+        """Xoá cache của user; nếu biết version mới thì ghi nhớ để chặn kết quả cũ."""
+        with self._lock:
+            self.invalidations += 1
+            entry = self._entries.get(username)
+            if version is None or entry is None or entry[0] < version:
+                self._entries.pop(username, None)
+            if version is not None:
+                self._known_versions[username] = max(version, self._known_versions.get(username, version))
+                # user chỉ nhận sự kiện mà không bao giờ gọi /recommend: giới hạn bộ nhớ
+                while len(self._known_versions) > 2 * self.max_users:
+                    self._known_versions.pop(next(iter(self._known_versions)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._entries),
+                "max_users": self.max_users,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
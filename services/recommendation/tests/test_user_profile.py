@@ -0,0 +1,53 @@
+# services/recommendation/tests/test_user_profile.py
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from user_profile import ProfileEngine
+
+
+def make_engine(fail_texts):
+    calls = []
+
+    async def embed_many(texts):
+        calls.append(list(texts))
+        # Embedder lỗi trả về [] cho từng text (như RemoteEmbeddingProvider / micro-batcher)
+        return [[] if t in fail_texts else [1.0, float(len(t))] for t in texts]
+
+    return ProfileEngine(embed_many, weighting="rank"), calls
+
+
+def test_failed_embed_is_retried_and_does_not_break_profile():
+    fail = {"broken"}
+    engine, calls = make_engine(fail)
+    history = [{"text": "broken", "created_at": "2024-01-01T00:00:01"}]
+
+    assert asyncio.run(engine.profile_vector("u", history, [])) is None
+
+    # Item mới tới sau item lỗi; embedder đã hồi phục
+    fail.clear()
+    history = [{"text": "good", "created_at": "2024-01-01T00:00:02"}] + history
+    vec = asyncio.run(engine.profile_vector("u", history, []))
+
+    assert calls[-1] == ["broken", "good"]   # item lỗi được embed lại
+    # broken (hạng 1, trọng số 8) + good (hạng 0, trọng số 10)
+    expected = 8 * np.array([1.0, 6.0]) + 10 * np.array([1.0, 4.0])
+    assert np.allclose(vec, expected)
+
+
+def test_failed_embed_after_good_one_keeps_partial_profile():
+    engine, calls = make_engine({"broken"})
+    history = [
+        {"text": "broken", "created_at": "2024-01-01T00:00:02"},
+        {"text": "good", "created_at": "2024-01-01T00:00:01"},
+    ]
+    vec = asyncio.run(engine.profile_vector("u", history, []))
+    assert np.allclose(vec, 10 * np.array([1.0, 4.0]))
+
+    # Lần sau chỉ embed lại item lỗi, không lỗi broadcast shape
+    vec = asyncio.run(engine.profile_vector("u", history, []))
+    assert calls[-1] == ["broken"]
+    assert np.allclose(vec, 10 * np.array([1.0, 4.0]))
@@ -0,0 +1,137 @@
+# services/recommendation/topk.py
+"""
+Cosine top-k trên catalog đã chuẩn hóa sẵn (mỗi hàng có ||e_i|| = 1).
+
+Vì hàng đã là unit vector, cosine(e_i, u) = e_i · (u / ||u||), nên mỗi query chỉ cần
+1 phép nhân ma trận-vector (GEMV) + argpartition, không còn phép chia O(N) theo từng query.
+Thứ hạng trùng với công thức cũ dots / (||e_i|| * ||u|| + eps) (chỉ khác ở mức làm tròn float32).
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# Số hàng mỗi block khi catalog lưu float16 (upcast từng block sang float32 rồi GEMV)
+SCORE_BLOCK_ROWS = 65536
+
+
+def normalize_rows(embeds: np.ndarray, norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """Trả về ma trận float32 với mỗi hàng chia cho norm của nó (hàng norm = 0 giữ nguyên 0)."""
+    embeds = np.asarray(embeds, dtype=np.float32)
+    if embeds.size == 0:
+        return embeds
+    if norms is None:
+        norms = np.linalg.norm(embeds, axis=1)
+    norms = np.asarray(norms, dtype=np.float32)
+    safe = np.where(norms > 0, norms, np.float32(1.0))
+    return embeds / safe[:, None]
+
+
+def unit_query(query) -> Optional[np.ndarray]:
+    """Chuẩn hóa query về unit vector float32; trả về None nếu vector rỗng hoặc bằng 0."""
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(q)
+    if q.size == 0 or norm == 0:
+        return None
+    return q / norm
+
+
+def cosine_scores(unit_embeds: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    scores[i] = unit_embeds[i] · q  (shape (N,), float32).
+    float32 → 1 GEMV qua BLAS; float16 → upcast theo block để không tạo bản sao (N, D) float32.
+    """
+    if unit_embeds.dtype == np.float32:
+        return unit_embeds.dot(q)
+    n = unit_embeds.shape[0]
+    scores = np.empty((n,), dtype=np.float32)
+    for start in range(0, n, SCORE_BLOCK_ROWS):
+        block = np.asarray(unit_embeds[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        np.dot(block, q, out=scores[start:start + block.shape[0]])
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Chỉ số của k điểm cao nhất, sắp xếp giảm dần. Điểm bằng nhau giữ thứ tự chỉ số tăng dần,
+    giống np.argsort(-sims, kind="stable") của cách cũ.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty((0,), dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    idx = np.sort(np.argpartition(scores, n - k)[n - k:])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+# Kích thước tile cho batch: bộ nhớ tạm tối đa ≈ QUERY_BLOCK × CATALOG_BLOCK × 4 bytes (32 MB)
+QUERY_BLOCK = 256
+CATALOG_BLOCK = 32768
+
+
+def unit_queries(queries) -> tuple:
+    """
+    Chuẩn hóa Q query (Q, D) về unit vector.
+    Trả về (ma trận float32 (Q, D), mask (Q,) các query hợp lệ — norm > 0).
+    """
+    Q = np.asarray(queries, dtype=np.float32)
+    if Q.ndim == 1:
+        Q = Q.reshape(1, -1)
+    norms = np.linalg.norm(Q, axis=1)
+    valid = norms > 0
+    safe = np.where(valid, norms, np.float32(1.0))
+    return Q / safe[:, None], valid
+
+
+def batch_top_k(unit_queries_: np.ndarray, unit_embeds: np.ndarray, k: int,
+                query_block: int = QUERY_BLOCK, catalog_block: int = CATALOG_BLOCK) -> tuple:
+    """
+    Top-k cho Q query cùng lúc bằng GEMM theo tile.
+      • Chia query thành block `query_block` hàng, catalog thành block `catalog_block` hàng.
+      • Mỗi tile: S = Qb @ Cb.T (GEMM), argpartition theo hàng để lấy k ứng viên,
+        rồi gộp với k ứng viên tốt nhất hiện tại (argpartition trên 2k cột).
+    Trả về (idx (Q, k), scores (Q, k)), mỗi hàng sắp xếp giảm dần.
+    """
+    nq = unit_queries_.shape[0]
+    n = unit_embeds.shape[0]
+    k = max(0, min(k, n))
+    out_idx = np.empty((nq, k), dtype=np.int64)
+    out_scores = np.empty((nq, k), dtype=np.float32)
+    if nq == 0 or k == 0:
+        return out_idx, out_scores
+
+    for qs in range(0, nq, query_block):
+        Qb = np.ascontiguousarray(unit_queries_[qs:qs + query_block], dtype=np.float32)
+        best_scores = best_idx = None
+        for cs in range(0, n, catalog_block):
+            Cb = np.asarray(unit_embeds[cs:cs + catalog_block], dtype=np.float32)
+            S = Qb @ Cb.T                                     # (b, c)
+            c = S.shape[1]
+            kk = min(k, c)
+            part = np.argpartition(S, c - kk, axis=1)[:, c - kk:] if kk < c \
+                else np.broadcast_to(np.arange(c), S.shape)
+            tile_scores = np.take_along_axis(S, part, axis=1)
+            tile_idx = part + cs
+            if best_scores is None:
+                best_scores, best_idx = tile_scores, tile_idx
+                continue
+            merged_scores = np.concatenate([best_scores, tile_scores], axis=1)
+            merged_idx = np.concatenate([best_idx, tile_idx], axis=1)
+            m = merged_scores.shape[1]
+            if m <= k:
+                # k > catalog_block: chưa đủ k ứng viên → giữ cả m cột
+                best_scores, best_idx = merged_scores, merged_idx
+                continue
+            sel = np.argpartition(merged_scores, m - k, axis=1)[:, m - k:]
+            best_scores = np.take_along_axis(merged_scores, sel, axis=1)
+            best_idx = np.take_along_axis(merged_idx, sel, axis=1)
+
+        # Sắp theo chỉ số trước rồi sort ổn định theo điểm → tie giữ thứ tự chỉ số như top_k_indices
+        by_idx = np.argsort(best_idx, axis=1)
+        best_idx = np.take_along_axis(best_idx, by_idx, axis=1)
+        best_scores = np.take_along_axis(best_scores, by_idx, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        out_scores[qs:qs + Qb.shape[0]] = np.take_along_axis(best_scores, order, axis=1)
+        out_idx[qs:qs + Qb.shape[0]] = np.take_along_axis(best_idx, order, axis=1)
+    return out_idx, out_scores
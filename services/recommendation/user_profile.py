@@ -0,0 +1,236 @@
+# services/recommendation/user_profile.py
+"""
+Vector profile của user, cập nhật tăng dần thay vì embed lại cả chuỗi history.
+
+Cách cũ (export_text): lặp text của item thứ r (mới nhất r = 0) max(0, 10 - 2r) lần,
+nối thành 1 chuỗi rồi embed → chi phí tăng theo độ dài history và mỗi item mới
+lại phải embed lại toàn bộ chuỗi.
+
+Cách mới: mỗi item chỉ được embed 1 lần (qua cache embedding), profile là tổng có
+trọng số của các vector item, giữ trong RAM và cập nhật O(D) cho mỗi event mới:
+
+  • rank : trọng số max(0, base - step*r) như export_text (mặc định 10/8/6/4/2).
+           Khi có item mới, mọi item cũ lùi 1 hạng:
+             S' = S - step * W + base * v_new     (W = tổng vector trong cửa sổ)
+  • time : trọng số 2^(-tuổi / half_life) theo created_at.
+             S' = S * 2^(-(t_new - t_last) / half_life) + v_new
+           Hệ số chung theo thời điểm query không đổi hướng vector → cosine không đổi.
+"""
+
+import math
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+
+def parse_created_at(value) -> float:
+    """ISO string (User Service trả về utcnow naive) → epoch giây; thiếu/lỗi → now."""
+    if not value:
+        return time.time()
+    try:
+        dt = datetime.fromisoformat(str(value))
+    except ValueError:
+        return time.time()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class RankDecayAggregate:
+    """S = Σ max(0, base - step*r) · v_r, r = 0 là item mới nhất."""
+
+    def __init__(self, base: float = 10.0, step: float = 2.0):
+        self.base = base
+        self.step = step
+        # Số item còn trọng số > 0 (10/2 → 5 item gần nhất)
+        self.window = max(1, math.ceil(base / step)) if step > 0 else None
+        self.sum: Optional[np.ndarray] = None
+        self.window_sum: Optional[np.ndarray] = None
+        self.items: deque = deque()
+
+    def add(self, vec: np.ndarray, ts: float):
+        if self.sum is None:
+            self.sum = np.zeros_like(vec)
+            self.window_sum = np.zeros_like(vec)
+        self.sum -= self.step * self.window_sum
+        if self.window is not None and len(self.items) == self.window:
+            dropped = self.items.popleft()
+            # Item cuối cửa sổ vừa bị trừ thành (w_last - step) → đưa về đúng 0
+            w_last = self.base - self.step * (self.window - 1)
+            self.sum += (self.step - w_last) * dropped
+            self.window_sum -= dropped
+        self.sum += self.base * vec
+        self.window_sum += vec
+        if self.window is not None:
+            self.items.append(vec)
+
+    def vector(self) -> Optional[np.ndarray]:
+        return self.sum
+
+
+class TimeDecayAggregate:
+    """S = Σ 2^(-(t_last - t_i) / half_life) · v_i, chuẩn hoá theo item mới nhất."""
+
+    def __init__(self, half_life: float = 3 * 24 * 3600.0):
+        self.half_life = half_life
+        self.sum: Optional[np.ndarray] = None
+        self.last_ts: Optional[float] = None
+
+    def _decay(self, dt: float) -> float:
+        return 0.5 ** (dt / self.half_life) if self.half_life > 0 else 1.0
+
+    def add(self, vec: np.ndarray, ts: float):
+        if self.sum is None:
+            self.sum = vec.copy()
+            self.last_ts = ts
+        elif ts >= self.last_ts:
+            self.sum = self.sum * self._decay(ts - self.last_ts) + vec
+            self.last_ts = ts
+        else:
+            # Event đến trễ (created_at cũ hơn) → cộng với trọng số đã decay
+            self.sum += self._decay(self.last_ts - ts) * vec
+
+    def vector(self) -> Optional[np.ndarray]:
+        return self.sum
+
+
+class HistoryStream:
+    """Trạng thái của 1 loại history (search hoặc view) cho 1 user."""
+
+    def __init__(self, make_aggregate: Callable):
+        self.make_aggregate = make_aggregate
+        self.reset()
+
+    def reset(self):
+        self.agg = self.make_aggregate()
+        self.count = 0
+        self.head = None  # (created_at, text) của item mới nhất đã cộng vào
+
+    def pending(self, history: List[dict]) -> Optional[List[dict]]:
+        """
+        history: danh sách từ User Service, mới nhất trước (chỉ `limit` item mới nhất).
+        Trả về các item chưa cộng (cũ → mới), hoặc None nếu item mới nhất đã cộng không còn
+        trong danh sách (bị xoá/sửa, hoặc số item mới vượt cả cửa sổ) → cần build lại từ đầu.
+        """
+        if not self.count:
+            return list(reversed(history))
+        for n_new, item in enumerate(history):
+            if _item_key(item) == self.head:
+                return list(reversed(history[:n_new]))
+        return None
+
+    def apply(self, items: List[dict], vectors: List[Optional[np.ndarray]]):
+        for item, vec in zip(items, vectors):
+            if vec is None and item.get("text"):
+                # Embed lỗi → dừng ở đây, head không vượt qua item này nên lần sau embed lại
+                break
+            if vec is not None:
+                self.agg.add(vec, parse_created_at(item.get("created_at")))
+            self.head = _item_key(item)
+            self.count += 1
+
+
+def _item_key(item: dict) -> tuple:
+    return item.get("created_at"), item.get("text", "")
+
+
+class ProfileEngine:
+    """
+    Giữ HistoryStream cho mỗi user (LRU), embed item mới qua `embed_many` (async,
+    đi qua cache embedding nên 1 text chỉ embed 1 lần) và trả về vector profile.
+    """
+
+    def __init__(self,
+                 embed_many: Callable[[List[str]], Awaitable[list]],
+                 weighting: str = "rank",
+                 rank_base: float = 10.0,
+                 rank_step: float = 2.0,
+                 half_life: float = 3 * 24 * 3600.0,
+                 use_view: bool = False,
+                 item_text: Callable[[str], str] = lambda t: t,
+                 max_users: int = 10000):
+        if weighting == "rank":
+            self.make_aggregate = lambda: RankDecayAggregate(rank_base, rank_step)
+        elif weighting == "time":
+            self.make_aggregate = lambda: TimeDecayAggregate(half_life)
+        else:
+            raise ValueError(f"Unknown profile weighting: {weighting}")
+        self.embed_many = embed_many
+        self.weighting = weighting
+        self.use_view = use_view
+        self.item_text = item_text
+        self.max_users = max_users
+        self._users: "OrderedDict[str, dict]" = OrderedDict()
+        self.items_embedded = 0
+        self.rebuilds = 0
+
+    def _streams(self, username: str) -> dict:
+        streams = self._users.get(username)
+        if streams is None:
+            streams = {
+                "search": HistoryStream(self.make_aggregate),
+                "view": HistoryStream(self.make_aggregate),
+            }
+            self._users[username] = streams
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(username)
+        return streams
+
+    async def profile_vector(self, username: str, search_history: list, view_history: list) -> Optional[np.ndarray]:
+        """Vector profile (chưa chuẩn hoá), None nếu user chưa có history dùng được."""
+        streams = self._streams(username)
+        histories = {"search": search_history or []}
+        if self.use_view:
+            histories["view"] = view_history or []
+
+        todo = []
+        for name, history in histories.items():
+            stream = streams[name]
+            items = stream.pending(history)
+            if items is None:
+                stream.reset()
+                self.rebuilds += 1
+                items = list(reversed(history))
+            todo.append((stream, items, (id(stream.agg), stream.count)))
+
+        # Item text rỗng không có vector (bỏ qua khi cộng, vẫn tính vào count/head);
+        # embed lỗi trả về [] → cũng None, apply() dừng trước item đó
+        texts = [it.get("text", "") for _, items, _ in todo for it in items]
+        to_embed = [i for i, t in enumerate(texts) if t]
+        embedded = await self.embed_many([self.item_text(texts[i]) for i in to_embed]) if to_embed else []
+        self.items_embedded += len(embedded)
+        vectors = [None] * len(texts)
+        for i, v in zip(to_embed, embedded):
+            if v is not None and len(v):
+                vectors[i] = np.asarray(v, dtype=np.float64)
+
+        pos = 0
+        for stream, items, snapshot in todo:
+            chunk = vectors[pos:pos + len(items)]
+            pos += len(items)
+            # Request khác của cùng user đã cộng/build lại trong lúc await → không cộng lặp
+            if (id(stream.agg), stream.count) == snapshot:
+                stream.apply(items, chunk)
+
+        total = None
+        for name in histories:
+            vec = streams[name].agg.vector()
+            if vec is not None:
+                total = vec.copy() if total is None else total + vec
+        if total is None or not np.any(total):
+            return None
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "weighting": self.weighting,
+            "use_view": self.use_view,
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "items_embedded": self.items_embedded,
+            "rebuilds": self.rebuilds,
+        }
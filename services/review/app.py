@@ -1,27 +1,64 @@
-import ujson as json
-from fastapi import FastAPI, HTTPException, Query
-from sqlmodel import SQLModel, Field, create_engine, Session, select
-from typing import Optional, List
+import os
+import sys
+from pathlib import Path
+import sqlite3
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from sqlalchemy import literal, tuple_
+from sqlmodel import Field, SQLModel, Session, select
+from sqlalchemy.exc import OperationalError
+from typing import Dict, List, Literal, Optional
+
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.db import connect, make_engine
+from common.encoding import packed_response
+from common.fts import fts_query
 
 # --- Model ---
-class Review(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    review_id: str = Field(index=True)
-    product_id: str = Field(index=True)
-    reviewer: str
-    rating: float
-    title: str
-    text: str
+from models import Review
+from importer import import_reviews
+from search_index import SEARCH_SQL, ensure_fts
+from product_stats import SELECT_STATS, ensure_stats, fetch_stats, row_to_stats
 
 # --- Database setup ---
 # lưu file reviews.db vào thư mục /app/db (đảm bảo thư mục đã mount)
-DATABASE_URL = "sqlite:///./db/reviews.db"
-engine = create_engine(DATABASE_URL, echo=False)
+DATABASE_PATH = os.getenv("REVIEW_DB_PATH", "db/reviews.db")
+# engine ghi (import) + engine read-only cho endpoint đọc; cả hai có pool, WAL và pragma (common/db.py)
+engine = make_engine(DATABASE_PATH)
 SQLModel.metadata.create_all(engine)
+read_engine = make_engine(DATABASE_PATH, readonly=True)
+REVIEWS_SOURCE = os.getenv("REVIEWS_SOURCE", "reviews.jsonl")
+# Số ASIN tối đa mỗi request POST /reviews/stats
+STATS_BATCH_MAX = int(os.getenv("REVIEW_STATS_BATCH_MAX", "1000"))
+# Số ASIN tối đa mỗi request POST /reviews/batch
+REVIEWS_BATCH_MAX = int(os.getenv("REVIEWS_BATCH_MAX", "200"))
 
 # --- FastAPI app ---
 app = FastAPI(title="Review Service (Electronics 5-core)")
 
+@app.on_event("startup")
+def ensure_search_index():
+    # Chỉ mục FTS5 cho /reviews/search; DB tạo trước khi có FTS thì build 1 lần ở đây
+    conn = connect(DATABASE_PATH)
+    try:
+        if ensure_fts(conn):
+            print("✅ Review full-text index created.")
+    finally:
+        conn.close()
+
+@app.on_event("startup")
+def ensure_product_stats():
+    # Bảng product_stats + trigger (product_stats.py); index mới khai báo trong models.py
+    # không được create_all thêm vào bảng đã có → tạo ở đây
+    for index in Review.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    conn = connect(DATABASE_PATH)
+    try:
+        if ensure_stats(conn):
+            print("✅ Product review stats table created.")
+    finally:
+        conn.close()
+
 @app.on_event("startup")
 def load_reviews():
     # Nếu đã có record thì bỏ qua import
@@ -31,37 +68,168 @@ def load_reviews():
             print("✔️ Reviews already loaded, skipping import.")
             return
 
-    # Import file reviews.jsonl → SQLite
-    count = 0
-    with open("reviews.jsonl", "r", encoding="utf-8") as f, Session(engine) as session:
-        for line in f:
-            obj = json.loads(line)
-            rev = Review(
-                review_id = obj.get("reviewerID", ""),
-                product_id= obj.get("asin", ""),
-                reviewer  = obj.get("reviewerName") or "Anonymous",
-                rating    = float(obj.get("overall", 0.0)),
-                title     = obj.get("summary",""),
-                text      = obj.get("reviewText","")
-            )
-            session.add(rev)
-            count += 1
-            # commit theo batch 10k records để tránh dùng quá nhiều RAM
-            if count % 10000 == 0:
-                session.commit()
-                print(f"  → Imported {count} reviews…")
-        session.commit()
-    print(f"✅ Finished loading {count} reviews into SQLite.")
+    # Import file reviews.jsonl → SQLite (bulk, xem importer.py; có thể chạy offline trước)
+    if not os.path.exists(REVIEWS_SOURCE):
+        print(f"⚠️ {REVIEWS_SOURCE} not found, review table stays empty.")
+        return
+    import_reviews(REVIEWS_SOURCE, DATABASE_PATH)
 
 # --- API endpoint ---
+def _cursor_key(order_by: str):
+    # Khoá sắp xếp của keyset; id (rowid) luôn là khoá phụ để thứ tự là duy nhất
+    return (Review.rating, Review.id) if order_by == "rating" else (Review.id,)
+
+def encode_cursor(review: Review, order_by: str) -> str:
+    return f"{review.rating!r}:{review.id}" if order_by == "rating" else str(review.id)
+
+def decode_cursor(cursor: str, order_by: str) -> tuple:
+    try:
+        if order_by == "rating":
+            rating, id_ = cursor.split(":")
+            return float(rating), int(id_)
+        return (int(cursor),)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor for order_by={order_by}: {cursor!r}")
+
 @app.get("/reviews", response_model=List[Review])
 def get_reviews(
+    response: Response,
     asin: str = Query(..., description="Product ASIN"),
-    limit: int = Query(10, ge=1, le=100)
+    limit: int = Query(10, ge=1, le=100),
+    order_by: Literal["id", "rating"] = Query("id", description="Sắp theo id hoặc rating (cùng rating thì theo id)"),
+    desc: bool = Query(False, description="Sắp giảm dần"),
+    cursor: Optional[str] = Query(None, description="Trang sau: giá trị header X-Next-Cursor của trang trước"),
 ):
-    with Session(engine) as session:
-        stmt = select(Review).where(Review.product_id == asin).limit(limit)
+    """
+    Review của 1 ASIN, phân trang keyset: trang sau gửi lại ?cursor=<X-Next-Cursor>
+    với cùng order_by/desc. Header X-Total-Count = tổng số review của ASIN (từ product_stats).
+    """
+    key = _cursor_key(order_by)
+    stmt = select(Review).where(Review.product_id == asin)
+    if cursor:
+        last = decode_cursor(cursor, order_by)
+        lhs = tuple_(*key) if len(key) > 1 else key[0]
+        rhs = tuple_(*(literal(v) for v in last)) if len(key) > 1 else last[0]
+        stmt = stmt.where(lhs < rhs if desc else lhs > rhs)
+    stmt = stmt.order_by(*(c.desc() if desc else c.asc() for c in key)).limit(limit + 1)
+    with Session(read_engine) as session:
         results = session.exec(stmt).all()
-    if not results:
+        total = session.connection().exec_driver_sql(
+            f"{SELECT_STATS} WHERE product_id = ?", (asin,)
+        ).first()
+    if not results and not cursor:
         raise HTTPException(status_code=404, detail=f"No reviews for ASIN={asin}")
+    if len(results) > limit:
+        results = results[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(results[-1], order_by)
+    response.headers["X-Total-Count"] = str(total[1] if total else 0)
     return results
+
+class ProductStats(SQLModel):
+    asin: str
+    count: int
+    mean_rating: float
+    histogram: Dict[str, int]   # "1".."5" → số review (rating làm tròn)
+
+class StatsBatchRequest(SQLModel):
+    asins: List[str]
+
+@app.get("/reviews/stats", response_model=ProductStats)
+def get_review_stats(asin: str = Query(..., description="Product ASIN")):
+    # Đọc 1 dòng product_stats (duy trì bởi trigger), không quét bảng review
+    with read_engine.connect() as conn:
+        row = conn.exec_driver_sql(f"{SELECT_STATS} WHERE product_id = ?", (asin,)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"No reviews for ASIN={asin}")
+    return row_to_stats(tuple(row))
+
+@app.post("/reviews/stats", response_model=Dict[str, ProductStats])
+def get_review_stats_batch(req: StatsBatchRequest):
+    """
+    Nhận JSON: { "asins": ["B000...", ...] } → { asin: stats }.
+    ASIN không có review thì không có trong kết quả.
+    """
+    if len(req.asins) > STATS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({len(req.asins)} > {STATS_BATCH_MAX})")
+    with read_engine.connect() as conn:
+        return fetch_stats(conn.connection.dbapi_connection, req.asins)
+
+REVIEW_FIELDS = ("id", "review_id", "product_id", "reviewer", "rating", "title", "text")
+
+class ReviewsBatchRequest(SQLModel):
+    asins: List[str]
+    limit: int = Field(3, ge=1, le=100)            # số review tối đa mỗi ASIN
+    order_by: Literal["id", "rating"] = "id"
+    desc: bool = False
+    fields: Optional[List[Literal[REVIEW_FIELDS]]] = None   # None = mọi cột
+    stats: bool = False                            # kèm product_stats của từng ASIN
+
+# Top-N review mỗi ASIN trong 1 truy vấn IN (...) + ROW_NUMBER() theo từng product_id
+BATCH_SQL = """
+SELECT {cols} FROM (
+    SELECT {cols}, ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY {order}) AS rn
+    FROM review WHERE product_id IN ({marks})
+) WHERE rn <= ? ORDER BY product_id, rn
+"""
+
+@app.post("/reviews/batch")
+def get_reviews_batch(req: ReviewsBatchRequest, accept: Optional[str] = Header(None)):
+    """
+    Nhận JSON: { "asins": [...], "limit": 3, "order_by": "rating", "desc": true,
+                 "fields": ["rating", "title"], "stats": true }
+    → { "reviews": { asin: [review, ...] }, "stats": { asin: stats } }  ("stats" chỉ có khi yêu cầu).
+    ASIN không có review thì không có key. Accept: application/msgpack → body MessagePack.
+    """
+    asins = list(dict.fromkeys(req.asins))
+    if len(asins) > REVIEWS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({len(asins)} > {REVIEWS_BATCH_MAX})")
+    fields = list(dict.fromkeys(req.fields)) if req.fields else list(REVIEW_FIELDS)
+    # product_id luôn được đọc để nhóm kết quả, chỉ trả về nếu client chọn
+    cols = list(dict.fromkeys(["product_id", *fields]))
+    direction = "DESC" if req.desc else "ASC"
+    order = f"rating {direction}, id {direction}" if req.order_by == "rating" else f"id {direction}"
+
+    reviews: Dict[str, List[dict]] = {}
+    body: Dict[str, dict] = {"reviews": reviews}
+    if asins:
+        sql = BATCH_SQL.format(cols=", ".join(cols), order=order, marks=", ".join("?" * len(asins)))
+        with read_engine.connect() as conn:
+            raw = conn.connection.dbapi_connection
+            for row in raw.execute(sql, (*asins, req.limit)):
+                rec = dict(zip(cols, row))
+                reviews.setdefault(rec["product_id"], []).append({k: rec[k] for k in fields})
+            if req.stats:
+                body["stats"] = fetch_stats(raw, asins)
+    elif req.stats:
+        body["stats"] = {}
+    return packed_response(body, accept)
+
+class ReviewHit(SQLModel):
+    id: int
+    review_id: str
+    product_id: str
+    reviewer: str
+    rating: float
+    title: str
+    text: str
+    score: float      # -bm25, càng lớn càng liên quan
+    snippet: str
+
+@app.get("/reviews/search", response_model=List[ReviewHit])
+def search_reviews(
+    q: str = Query(..., min_length=1, description="Từ khoá (tìm trong title + text của review)"),
+    asin: Optional[str] = Query(None, description="Chỉ tìm trong review của ASIN này"),
+    limit: int = Query(10, ge=1, le=100),
+    mode: Literal["all", "any"] = Query("all", description="all = mọi từ, any = bất kỳ từ nào"),
+):
+    match = fts_query(q, mode)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Query has no searchable terms")
+    extra = "AND r.product_id = ?" if asin else ""
+    params = (match, asin, limit) if asin else (match, limit)
+    try:
+        with read_engine.connect() as conn:
+            rows = conn.exec_driver_sql(SEARCH_SQL.format(extra=extra), params).mappings().all()
+    except (OperationalError, sqlite3.OperationalError) as e:
+        raise HTTPException(status_code=400, detail=f"Search error: {e}")
+    return [ReviewHit(**{k: v for k, v in r.items() if k != "bm25"}, score=-r["bm25"]) for r in rows]
@@ -0,0 +1,162 @@
+# services/review/importer.py
+"""
+Import bulk Electronics 5-core (JSONL) → bảng review.
+
+Thay cho cách cũ (1 object ORM mỗi dòng, commit mỗi 10k):
+  • Parse bằng orjson theo từng đoạn byte của file (căn theo dòng); --workers > 1 thì
+    các đoạn được parse song song trên nhiều process, thứ tự insert vẫn giữ như file.
+  • Insert bằng sqlite3 executemany, index + trigger FTS của bảng được DROP trước khi nạp
+    và tạo lại 1 lần ở cuối (nhanh hơn nhiều so với cập nhật index từng dòng);
+    chỉ mục FTS5 (search_index.py) được 'rebuild' 1 lượt sau đó, bảng product_stats
+    (product_stats.py) được tính lại bằng 1 câu GROUP BY.
+  • In tiến độ + rows/s.
+
+Chạy offline để tạo sẵn file DB (service khởi động thấy bảng đã có dữ liệu thì bỏ qua import):
+    python importer.py ../../data/Electronics-5core.json ../../data/sqlite/reviews.db --workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # orjson là tuỳ chọn, ujson có sẵn trong requirements
+    import ujson
+
+    _loads = ujson.loads
+
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.chunks import line_ranges, read_lines
+from common.db import connect, make_engine
+
+from models import Review
+from product_stats import ensure_stats, rebuild_stats
+from search_index import ensure_fts, rebuild_fts
+
+CHUNK_BYTES = 16 * 1024 * 1024
+INSERT_SQL = "INSERT INTO review (review_id, product_id, reviewer, rating, title, text) VALUES (?, ?, ?, ?, ?, ?)"
+
+Row = Tuple[str, str, str, float, str, str]
+
+
+def parse_review(obj: dict) -> Row:
+    # Giữ đúng mapping field như bản import cũ
+    return (
+        obj.get("reviewerID", ""),
+        obj.get("asin", ""),
+        obj.get("reviewerName") or "Anonymous",
+        float(obj.get("overall", 0.0)),
+        obj.get("summary", ""),
+        obj.get("reviewText", ""),
+    )
+
+
+def _parse_range(args: Tuple[str, int, int]) -> List[Row]:
+    path, start, end = args
+    rows = []
+    for line in read_lines(path, start, end):
+        if line.strip():
+            rows.append(parse_review(_loads(line)))
+    return rows
+
+
+def iter_chunks(path: str, workers: int = 1, chunk_bytes: int = CHUNK_BYTES) -> Iterator[List[Row]]:
+    """Các lô row theo thứ tự file; workers > 1 → parse song song bằng process pool."""
+    ranges = [(path, start, end) for start, end in line_ranges(path, chunk_bytes)]
+    if workers <= 1:
+        for r in ranges:
+            yield _parse_range(r)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_parse_range, ranges)
+
+
+def import_reviews(source: str, db_path: str, workers: Optional[int] = None,
+                   chunk_bytes: int = CHUNK_BYTES) -> int:
+    """Nạp `source` vào bảng review của `db_path` (tạo schema nếu chưa có). Trả về số dòng."""
+    workers = workers or int(os.getenv("REVIEW_IMPORT_WORKERS", "0")) or os.cpu_count() or 1
+    engine = make_engine(db_path)
+    Review.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = connect(db_path)
+    # Lúc nạp bulk: không fsync từng commit, cache lớn
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    ensure_fts(conn)
+    ensure_stats(conn)
+    deferred = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger') AND tbl_name = 'review' AND sql IS NOT NULL"
+    ).fetchall()
+    for kind, name, _ in deferred:
+        conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+    conn.commit()
+
+    size = os.path.getsize(source)
+    t0 = time.time()
+    count = 0
+    try:
+        for rows in iter_chunks(source, workers, chunk_bytes):
+            conn.executemany(INSERT_SQL, rows)
+            conn.commit()
+            count += len(rows)
+            elapsed = time.time() - t0
+            print(f"  → Imported {count} reviews ({count / max(elapsed, 1e-9):,.0f} rows/s)")
+    finally:
+        # Tạo lại index/trigger + chỉ mục FTS + product_stats 1 lần (kể cả khi import lỗi giữa chừng)
+        t_idx = time.time()
+        for _, _, sql in deferred:
+            conn.execute(sql)
+        rebuild_fts(conn)
+        rebuild_stats(conn)
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.close()
+    elapsed = time.time() - t0
+    print(f"✅ Finished loading {count} reviews into SQLite in {elapsed:.1f}s "
+          f"({count / max(elapsed, 1e-9):,.0f} rows/s, {size / 1e6 / max(elapsed, 1e-9):.1f} MB/s, "
+          f"index + FTS + stats build {time.time() - t_idx:.1f}s, {workers} workers)")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import Electronics 5-core reviews (JSONL) into SQLite")
+    parser.add_argument("source", help="reviews JSONL file")
+    parser.add_argument("db", help="target SQLite file (e.g. data/sqlite/reviews.db)")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024))
+    parser.add_argument("--replace", action="store_true", help="build into a temp file and replace db")
+    args = parser.parse_args()
+
+    target = Path(args.db)
+    if not args.replace and target.exists():
+        conn = connect(target)
+        try:
+            has_rows = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'review'"
+            ).fetchone() and conn.execute("SELECT 1 FROM review LIMIT 1").fetchone()
+        finally:
+            conn.close()
+        if has_rows:
+            sys.exit(f"{target} already has reviews; use --replace to rebuild it")
+
+    build_path = target.with_name(f"{target.name}.tmp-{os.getpid()}") if args.replace else target
+    import_reviews(args.source, str(build_path), args.workers, args.chunk_mb * 1024 * 1024)
+    if args.replace:
+        for suffix in ("-wal", "-shm"):
+            Path(f"{target}{suffix}").unlink(missing_ok=True)
+        os.replace(build_path, target)
+        print(f"✅ Replaced {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# services/review/models.py
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class Review(SQLModel, table=True):
+    # Phân trang keyset theo rating trong 1 sản phẩm: (product_id, rating, id) — id là rowid
+    __table_args__ = (Index("ix_review_product_rating", "product_id", "rating"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    review_id: str = Field(index=True)
+    product_id: str = Field(index=True)
+    reviewer: str
+    rating: float
+    title: str
+    text: str
@@ -0,0 +1,111 @@
+# services/review/product_stats.py
+"""
+Bảng tổng hợp review theo sản phẩm: số review, tổng rating, histogram 1..5 sao.
+
+  • product_stats được giữ đồng bộ bằng trigger AFTER INSERT/UPDATE/DELETE trên review
+    (giống review_fts trong search_index.py) → /reviews/stats không phải quét bảng review.
+  • Import bulk (importer.py) tạm bỏ trigger rồi tính lại cả bảng 1 lần bằng GROUP BY.
+  • rating được làm tròn và kẹp vào 1..5 để chọn cột histogram.
+"""
+
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+STATS_TABLE = "product_stats"
+STARS = (1, 2, 3, 4, 5)
+
+CREATE_STATS = f"""
+CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+    product_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    rating_sum REAL NOT NULL,
+    {", ".join(f"r{s} INTEGER NOT NULL" for s in STARS)}
+) WITHOUT ROWID
+"""
+
+
+def _bucket(rating: str) -> str:
+    return f"MIN(MAX(CAST(ROUND({rating}) AS INTEGER), 1), 5)"
+
+
+def _add(row: str) -> str:
+    # UPSERT cộng 1 review vào dòng của sản phẩm
+    cols = ", ".join(f"r{s}" for s in STARS)
+    vals = ", ".join(f"{_bucket(f'{row}.rating')} = {s}" for s in STARS)
+    sets = ", ".join(f"r{s} = r{s} + excluded.r{s}" for s in STARS)
+    return (
+        f"INSERT INTO {STATS_TABLE} (product_id, count, rating_sum, {cols}) "
+        f"VALUES ({row}.product_id, 1, {row}.rating, {vals}) "
+        f"ON CONFLICT(product_id) DO UPDATE SET count = count + 1, "
+        f"rating_sum = rating_sum + excluded.rating_sum, {sets};"
+    )
+
+
+def _remove(row: str) -> str:
+    sets = ", ".join(f"r{s} = r{s} - ({_bucket(f'{row}.rating')} = {s})" for s in STARS)
+    return (
+        f"UPDATE {STATS_TABLE} SET count = count - 1, rating_sum = rating_sum - {row}.rating, {sets} "
+        f"WHERE product_id = {row}.product_id;\n"
+        f"        DELETE FROM {STATS_TABLE} WHERE product_id = {row}.product_id AND count <= 0;"
+    )
+
+
+CREATE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS review_stats_ai AFTER INSERT ON review BEGIN
+        {_add("new")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS review_stats_ad AFTER DELETE ON review BEGIN
+        {_remove("old")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS review_stats_au AFTER UPDATE OF product_id, rating ON review BEGIN
+        {_remove("old")}
+        {_add("new")}
+    END""",
+]
+
+SELECT_STATS = f"SELECT product_id, count, rating_sum, {', '.join(f'r{s}' for s in STARS)} FROM {STATS_TABLE}"
+
+
+def ensure_stats(conn: sqlite3.Connection) -> bool:
+    """Tạo bảng + trigger nếu chưa có; DB cũ đã có review thì tính lại 1 lần. True nếu vừa tạo."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATS_TABLE,)
+    ).fetchone()
+    conn.execute(CREATE_STATS)
+    for sql in CREATE_TRIGGERS:
+        conn.execute(sql)
+    if not exists:
+        rebuild_stats(conn)
+    conn.commit()
+    return not exists
+
+
+def rebuild_stats(conn: sqlite3.Connection):
+    conn.execute(f"DELETE FROM {STATS_TABLE}")
+    hist = ", ".join(f"SUM({_bucket('rating')} = {s})" for s in STARS)
+    conn.execute(
+        f"INSERT INTO {STATS_TABLE} "
+        f"SELECT product_id, COUNT(*), SUM(rating), {hist} FROM review GROUP BY product_id"
+    )
+
+
+def row_to_stats(row: Tuple) -> dict:
+    product_id, count, rating_sum, *hist = row
+    return {
+        "asin": product_id,
+        "count": count,
+        "mean_rating": rating_sum / count if count else 0.0,
+        "histogram": {str(s): n for s, n in zip(STARS, hist)},
+    }
+
+
+def fetch_stats(conn, asins: Iterable[str], chunk: int = 500) -> Dict[str, dict]:
+    """Stats của nhiều ASIN (chia lô để không vượt giới hạn số tham số của SQLite)."""
+    asins: List[str] = list(dict.fromkeys(asins))
+    found: Dict[str, dict] = {}
+    for i in range(0, len(asins), chunk):
+        part = asins[i:i + chunk]
+        sql = f"{SELECT_STATS} WHERE product_id IN ({', '.join('?' * len(part))})"
+        for row in conn.execute(sql, tuple(part)).fetchall():
+            found[row[0]] = row_to_stats(row)
+    return found
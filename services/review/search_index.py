@@ -0,0 +1,63 @@
+# services/review/search_index.py
+"""
+Chỉ mục FTS5 cho review (title + text), dạng external content trỏ vào bảng review.
+
+  • review_fts chỉ lưu chỉ mục, nội dung đọc từ bảng review (không nhân đôi dữ liệu).
+  • Trigger AFTER INSERT/UPDATE/DELETE giữ chỉ mục đồng bộ với mọi ghi về sau.
+  • Import bulk (importer.py) tạm bỏ trigger rồi 'rebuild' 1 lần ở cuối.
+"""
+
+import sqlite3
+
+FTS_TABLE = "review_fts"
+
+CREATE_FTS = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    title, text,
+    content='review', content_rowid='id',
+    tokenize='porter unicode61'
+)
+"""
+
+CREATE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS review_fts_ai AFTER INSERT ON review BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS review_fts_ad AFTER DELETE ON review BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS review_fts_au AFTER UPDATE ON review BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END""",
+]
+
+# bm25: trọng số title (summary) cao hơn text; giá trị càng âm càng liên quan
+SEARCH_SQL = f"""
+SELECT r.id, r.review_id, r.product_id, r.reviewer, r.rating, r.title, r.text,
+       bm25({FTS_TABLE}, 2.0, 1.0) AS bm25,
+       snippet({FTS_TABLE}, -1, '[', ']', '…', 16) AS snippet
+FROM {FTS_TABLE}
+JOIN review r ON r.id = {FTS_TABLE}.rowid
+WHERE {FTS_TABLE} MATCH ? {{extra}}
+ORDER BY bm25
+LIMIT ?
+"""
+
+
+def ensure_fts(conn: sqlite3.Connection) -> bool:
+    """Tạo bảng FTS + trigger nếu chưa có; DB cũ đã có review thì build chỉ mục 1 lần. True nếu vừa tạo."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).fetchone()
+    conn.execute(CREATE_FTS)
+    for sql in CREATE_TRIGGERS:
+        conn.execute(sql)
+    if not exists:
+        rebuild_fts(conn)
+    conn.commit()
+    return not exists
+
+
+def rebuild_fts(conn: sqlite3.Connection):
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
@@ -0,0 +1,62 @@
+# services/ui/backend.py
+"""
+Phía backend của demo Gradio: gọi các service qua client async dùng chung.
+
+  • 1 httpx.AsyncClient cho mỗi service (pool keep-alive), các lời gọi độc lập chạy song song.
+  • ProductListCache: danh sách /products (chỉ asin,title) giữ trong RAM, mỗi lần bấm chỉ
+    revalidate bằng If-None-Match → 304 thì không tải lại.
+UI không đọc meta_Electronics.csv: metadata lấy từ /products/batch, text recommend → ASIN
+do Rec Service trả kèm ("asins") hoặc POST /products/resolve của Product Service.
+"""
+
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+import httpx
+
+TIMEOUT = float(os.getenv("UI_HTTP_TIMEOUT", "10"))
+LIMITS = httpx.Limits(max_connections=int(os.getenv("UI_HTTP_MAX_CONNECTIONS", "50")),
+                      max_keepalive_connections=20)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def client(base_url: str) -> httpx.AsyncClient:
+    """Client dùng chung theo base URL (tạo lười trên event loop của Gradio)."""
+    c = _clients.get(base_url)
+    if c is None or c.is_closed:
+        c = _clients[base_url] = httpx.AsyncClient(base_url=base_url, timeout=TIMEOUT, limits=LIMITS)
+    return c
+
+
+async def gather_results(*coros) -> list:
+    """Chạy song song; lời gọi lỗi trả về Exception ở vị trí tương ứng thay vì làm hỏng cả trang."""
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+
+class ProductListCache:
+    def __init__(self, base_url: str, fields: str = "asin,title"):
+        self.base_url = base_url
+        self.fields = fields
+        self.etag: Optional[str] = None
+        self.products: List[dict] = []
+        self._lock = asyncio.Lock()
+        self.revalidated = 0
+        self.downloaded = 0
+
+    async def get(self, headers: Optional[dict] = None) -> List[dict]:
+        async with self._lock:
+            req_headers = dict(headers or {})
+            if self.etag:
+                req_headers["If-None-Match"] = self.etag
+            resp = await client(self.base_url).get("/products", params={"fields": self.fields},
+                                                   headers=req_headers)
+            if resp.status_code == 304 and self.etag is not None:
+                self.revalidated += 1
+            else:
+                resp.raise_for_status()
+                self.products = resp.json()
+                self.etag = resp.headers.get("ETag")
+                self.downloaded += 1
+            return self.products
@@ -1,8 +1,7 @@
 import gradio as gr
-import requests
-import ujson as json
-from pathlib import Path
-import ast
+import html
+
+from backend import ProductListCache, client, gather_results
 
 # --- Service Endpoints ---
 USER_SVC = "http://user-service:8003"
@@ -10,32 +9,15 @@ PROD_SVC = "http://product-service:8001"
 REC_SVC = "http://rec-service:8002"
 REV_SVC = "http://review-service:8004"
 
-# --- Load Local Metadata ---
-# File is named meta_Electronics.csv but contains JSON-like lines
-meta_path = Path("meta_Electronics.csv")
-product_meta = {}
-if meta_path.exists():
-    with meta_path.open("r", encoding="utf-8") as mf:
-        for line in mf:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except Exception:
-                try:
-                    obj = ast.literal_eval(line)
-                except Exception:
-                    continue
-            asin = obj.get("asin")
-            if asin:
-                product_meta[asin] = obj
+# Metadata không load local: Product Service giữ bản gọn duy nhất, UI lấy qua /products/batch
+# Danh sách sản phẩm cache trong RAM, revalidate bằng ETag (backend.py)
+product_list = ProductListCache(PROD_SVC)
 
 # --- Auth Function ---
-def login(username, password):
+async def login(username, password):
     try:
-        resp = requests.post(
-            f"{USER_SVC}/login", data={"username": username, "password": password}
+        resp = await client(USER_SVC).post(
+            "/login", data={"username": username, "password": password}
         )
         resp.raise_for_status()
         token = resp.json().get("access_token")
@@ -44,20 +26,43 @@ def login(username, password):
         return None, f"Đăng nhập thất bại: {e}"
 
 # --- Fetch List of Products ---
-def fetch_products(token):
+async def fetch_products(token):
     headers = {"Authorization": f"Bearer {token}"} if token else {}
-    resp = requests.get(f"{PROD_SVC}/products", headers=headers)
-    resp.raise_for_status()
-    prods = resp.json()
-    choices = []
-    for p in prods:
-        pid = p['id']
-        title = p['name'] or pid
-        choices.append(f"{pid}:{title}")
+    # Lần đầu tải asin,title; các lần sau chỉ revalidate (304 nếu danh sách không đổi)
+    prods = await product_list.get(headers)
+    choices = [f"{p['asin']}:{p.get('title') or p['asin']}" for p in prods]
     return gr.update(choices=choices, value=choices[0] if choices else None)
 
+# --- Helpers: gọi service, trả về JSON ---
+async def _post_json(base_url, path, body, headers):
+    resp = await client(base_url).post(path, json=body, headers=headers)
+    resp.raise_for_status()
+    return resp.json()
+
+def _stars(stats):
+    if not stats:
+        return "chưa có review"
+    return f"★ {stats['mean_rating']:.1f} ({stats['count']} reviews)"
+
+def render_cards(recs, asins, cards, stats):
+    """HTML card cho từng recommendation; text không map được ASIN thì hiện nguyên text."""
+    items = []
+    for text, asin in zip(recs, asins):
+        card = cards.get(asin) if asin else None
+        if card is None:
+            items.append(f"<div style='margin:4px 0'>{html.escape(text)}</div>")
+            continue
+        title = html.escape(card.get("title") or asin)
+        img = card.get("imUrl")
+        img_html = f"<img src='{html.escape(img)}' width='80'/> " if img else ""
+        items.append(
+            f"<div style='display:flex;gap:8px;align-items:center;margin:4px 0'>{img_html}"
+            f"<div><b>{title}</b><br/><small>{asin} · {_stars(stats.get(asin))}</small></div></div>"
+        )
+    return "".join(items)
+
 # --- Load Details: HTML Image, Info, Reviews, Recommendations ---
-def load_details(token, selection):
+async def load_details(token, selection):
     if not token:
         return "", "", [["Vui lòng đăng nhập", "", "", ""]], ""
     if not selection:
@@ -65,8 +70,16 @@ def load_details(token, selection):
     asin, _ = selection.split(":", 1)
     headers = {"Authorization": f"Bearer {token}"}
 
-    # Product metadata
-    meta = product_meta.get(asin, {})
+    # 1) Metadata, reviews (+ stats) và recommendations gọi song song
+    meta_res, rev_res, rec_res = await gather_results(
+        _post_json(PROD_SVC, "/products/batch",
+                   {"asins": [asin], "fields": ["asin", "title", "imUrl", "description"]}, headers),
+        _post_json(REV_SVC, "/reviews/batch", {"asins": [asin], "limit": 10, "stats": True}, headers),
+        _post_json(REC_SVC, "/recommend", {"user_profile": asin}, headers),
+    )
+
+    # Product metadata (product service lỗi → chỉ hiện ASIN)
+    meta = (meta_res.get(asin) if isinstance(meta_res, dict) else None) or {}
     image_url = meta.get("imUrl", "")
     title = meta.get("title", asin)
     desc = meta.get("description", "")
@@ -78,28 +91,39 @@ def load_details(token, selection):
     info_md = desc
 
     # Reviews
-    try:
-        rev_resp = requests.get(
-            f"{REV_SVC}/reviews?asin={asin}&limit=10", headers=headers
-        )
-        rev_resp.raise_for_status()
-        reviews = rev_resp.json()
+    if isinstance(rev_res, Exception):
+        review_rows = [[f"Error fetching reviews: {rev_res}", "", "", ""]]
+    else:
+        reviews = rev_res["reviews"].get(asin, [])
         review_rows = [[r.get("reviewer"), r.get("rating"), r.get("title"), r.get("text")] for r in reviews]
-    except Exception as e:
-        review_rows = [[f"Error fetching reviews: {e}", "", "", ""]]
-
-    # Recommendations
-    try:
-        rec_resp = requests.post(
-            f"{REC_SVC}/recommend", json={"user_profile": asin}, headers=headers
+        info_md = f"**{_stars(rev_res.get('stats', {}).get(asin))}**\n\n{desc}"
+
+    # 2) Recommendations → card: map text → ASIN, rồi lấy metadata + rating của cả danh sách 1 lượt
+    if isinstance(rec_res, Exception):
+        return image_html, info_md, review_rows, html.escape(f"Error fetching recommendations: {rec_res}")
+    recs = rec_res.get("recommendations", [])
+    # Rec Service trả kèm ASIN; text chưa map được (catalog vừa reload) thì nhờ Product Service map
+    rec_asins = list(rec_res.get("asins") or [None] * len(recs))
+    unresolved = [i for i, a in enumerate(rec_asins) if a is None]
+    if unresolved:
+        try:
+            resolved = await _post_json(PROD_SVC, "/products/resolve",
+                                        {"texts": [recs[i] for i in unresolved]}, headers)
+            for i, a in zip(unresolved, resolved):
+                rec_asins[i] = a
+        except Exception:
+            pass
+    wanted = list(dict.fromkeys(a for a in rec_asins if a))
+    cards, stats = {}, {}
+    if wanted:
+        cards_res, stats_res = await gather_results(
+            _post_json(PROD_SVC, "/products/batch", {"asins": wanted, "fields": ["title", "imUrl"]}, headers),
+            _post_json(REV_SVC, "/reviews/stats", {"asins": wanted}, headers),
         )
-        rec_resp.raise_for_status()
-        recs = rec_resp.json().get("recommendations", [])
-        rec_text = "\n".join(recs)
-    except Exception as e:
-        rec_text = f"Error fetching recommendations: {e}"
+        cards = cards_res if isinstance(cards_res, dict) else {}
+        stats = stats_res if isinstance(stats_res, dict) else {}
 
-    return image_html, info_md, review_rows, rec_text
+    return image_html, info_md, review_rows, render_cards(recs, rec_asins, cards, stats)
 
 # --- Build Gradio UI ---
 with gr.Blocks() as demo:
@@ -129,7 +153,7 @@ with gr.Blocks() as demo:
             datatype=["str", "number", "str", "str"],
             label="Reviews"
         )
-        rec_output = gr.Textbox(label="Recommendations")
+        rec_output = gr.HTML(label="Recommendations")
         load_details_btn = gr.Button("Load Details")
         load_details_btn.click(
             fn=load_details,
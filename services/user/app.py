@@ -1,22 +1,46 @@
 # services/user/app.py
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from sqlmodel import SQLModel, Field, create_engine, Session, select
-from passlib.context import CryptContext
+from sqlalchemy import Index, literal, literal_column, union_all
+from sqlmodel import SQLModel, Field, Session, select
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
-from typing import List
+import json
+import sys
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional
+
+# services/common: trong image được COPY vào /app/common, chạy local thì nằm ở services/
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.db import make_engine
+
+from history_writer import HistoryWriter
+from security import HasherBusy, PasswordHasher, TokenCache, hash_password
 
 # --- Configuration ---
 SECRET_KEY = os.getenv("JWT_SECRET", "change-this-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Rec Service nhận sự kiện "history đổi" để xoá cache (vd http://rec-service:8002/cache/invalidate)
+REC_INVALIDATE_URL = os.getenv("REC_INVALIDATE_URL", "")
+# Số item history mặc định mỗi loại: /users/{username}/history* (Rec Service đọc) mặc định đúng
+# số item profile dùng (trọng số 10/8/6/4/2 → 5 item mới nhất), /me/history* (trang history của UI)
+HISTORY_DEFAULT_LIMIT = int(os.getenv("HISTORY_DEFAULT_LIMIT", "5"))
+HISTORY_ME_LIMIT = int(os.getenv("HISTORY_ME_LIMIT", "100"))
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "1000"))
+# Số event tối đa mỗi request POST /me/history/batch
+HISTORY_BATCH_MAX = int(os.getenv("HISTORY_BATCH_MAX", "500"))
 
-pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+# bcrypt chạy trên pool riêng có giới hạn, token → user cache ngắn hạn (security.py)
+hasher = PasswordHasher()
+token_cache = TokenCache()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 # --- Models ---
@@ -41,18 +65,38 @@ class HistoryItem(BaseModel):
     text: str
     created_at: str = None
 
+class HistoryEventIn(BaseModel):
+    kind: Literal["search", "view"]
+    text: str
+
+class HistoryBatch(BaseModel):
+    events: List[HistoryEventIn]
+
+class UserHistory(BaseModel):
+    username: str
+    search_history: List[HistoryItem]
+    view_history: List[HistoryItem]
+
+# Index (user_id, created_at): lọc theo user + ORDER BY created_at DESC LIMIT n đọc thẳng từ index
 class SearchHistory(SQLModel, table=True):
+    __table_args__ = (Index("ix_searchhistory_user_created", "user_id", "created_at"),)
     id: int = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id", index=True)
+    user_id: int = Field(foreign_key="user.id")
     text: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ViewHistory(SQLModel, table=True):
+    __table_args__ = (Index("ix_viewhistory_user_created", "user_id", "created_at"),)
     id: int = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id", index=True)
+    user_id: int = Field(foreign_key="user.id")
     text: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class HistoryVersion(SQLModel, table=True):
+    # Tăng mỗi lần ghi search/view history; Rec Service dùng làm khoá cache
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    version: int = 0
+
 # --- FastAPI app instance ---
 app = FastAPI(title="User Service")
 
@@ -66,29 +110,56 @@ app.add_middleware(
 )
 
 # --- Database setup ---
-engine = create_engine("sqlite:///./users.db", echo=False)
+# engine ghi + engine read-only cho đường đọc (login, history); pool + WAL + pragma (common/db.py)
+DATABASE_PATH = os.getenv("USER_DB_PATH", "users.db")
+engine = make_engine(DATABASE_PATH)
 SQLModel.metadata.create_all(engine)
+read_engine = make_engine(DATABASE_PATH, readonly=True)
+
+def migrate_history_indexes():
+    # DB cũ: create_all không thêm index cho bảng đã có; index đơn user_id thừa (nằm trong index ghép)
+    with engine.begin() as conn:
+        for model in (SearchHistory, ViewHistory):
+            for index in model.__table__.indexes:
+                index.create(conn, checkfirst=True)
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{model.__tablename__}_user_id")
+
+migrate_history_indexes()
+
+# Write-behind: POST history chỉ ghi log + queue, flusher ghi DB theo lô (history_writer.py).
+# Log bị khoá độc quyền: chỉ 1 process được dùng 1 HISTORY_LOG_PATH (không chạy --workers > 1 chung log)
+HISTORY_LOG_PATH = os.getenv("HISTORY_LOG_PATH", f"{DATABASE_PATH}.history.log")
+# Gọi Rec Service ngoài thread flusher (urlopen có thể chờ tới timeout)
+notify_pool = ThreadPoolExecutor(max_workers=int(os.getenv("REC_NOTIFY_WORKERS", "4")))
+
+def notify_flushed(versions: Dict[str, int]):
+    for username, version in versions.items():
+        notify_pool.submit(notify_history_changed, username, version)
+
+history_writer = HistoryWriter(DATABASE_PATH, HISTORY_LOG_PATH, on_flushed=notify_flushed)
 
 # --- Utility functions ---
 def get_user(username: str) -> User | None:
-    with Session(engine) as session:
+    with Session(read_engine) as session:
         return session.exec(select(User).where(User.username == username)).first()
 
-def create_user(username: str, password: str) -> User:
-    hashed = pwd_context.hash(password)
-    user = User(username=username, hashed_password=hashed)
+def create_user(username: str, hashed_password: str) -> User:
+    user = User(username=username, hashed_password=hashed_password)
     with Session(engine) as session:
         session.add(user)
         session.commit()
         session.refresh(user)
     return user
 
-def authenticate_user(username: str, password: str) -> User | None:
-    user = get_user(username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+async def authenticate_user(username: str, password: str) -> User | None:
+    user = await run_in_threadpool(get_user, username)
+    if not user or not await hasher.verify(password, user.hashed_password):
         return None
     return user
 
+def hasher_busy(e: HasherBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -96,6 +167,10 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    # Token đã gặp (chưa hết TTL / exp) → không decode JWT, không SELECT user
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -111,26 +186,59 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     user = get_user(username)
     if user is None:
         raise credentials_exception
+    token_cache.put(token, user, expires_at=payload.get("exp"))
     return user
 
+def notify_history_changed(username: str, version: int):
+    # Fire-and-forget: lỗi mạng chỉ log, cache bên Rec Service vẫn tự đúng nhờ version
+    if not REC_INVALIDATE_URL:
+        return
+    body = json.dumps({"username": username, "version": version}).encode()
+    req = urllib.request.Request(
+        REC_INVALIDATE_URL, data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        urllib.request.urlopen(req, timeout=2).close()
+    except Exception as e:
+        print(f"⚠️ Invalidate rec cache failed for {username}: {e}")
+
 # --- Startup event: ensure default “user”/“user” exists ---
 @app.on_event("startup")
 def create_default_user():
     if not get_user("user"):
-        create_user("user", "user")
+        create_user("user", hash_password("user"))
         print("⚡️ Default user/user account created")
 
+@app.on_event("startup")
+def start_history_writer():
+    # Ghi lại event còn trong log nếu lần trước process chết trước khi flush
+    history_writer.start()
+
+@app.on_event("shutdown")
+def stop_history_writer():
+    history_writer.close()
+    notify_pool.shutdown(wait=False)
+    hasher.shutdown()
+
 # --- Auth and user routes ---
+# Handler async: hash/verify bcrypt chạy trên pool của hasher, truy vấn DB trên threadpool
 @app.post("/register", response_model=UserRead)
-def register(data: UserCreate):
-    if get_user(data.username):
+async def register(data: UserCreate):
+    if await run_in_threadpool(get_user, data.username):
         raise HTTPException(status_code=400, detail="Username already registered")
-    user = create_user(data.username, data.password)
+    try:
+        hashed = await hasher.hash(data.password)
+    except HasherBusy as e:
+        raise hasher_busy(e)
+    user = await run_in_threadpool(create_user, data.username, hashed)
     return UserRead(id=user.id, username=user.username)
 
 @app.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    try:
+        user = await authenticate_user(form_data.username, form_data.password)
+    except HasherBusy as e:
+        raise hasher_busy(e)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     token = create_access_token({"sub": user.username})
@@ -141,79 +249,124 @@ def read_current_user(current_user: User = Depends(get_current_user)):
     return UserRead(id=current_user.id, username=current_user.username)
 
 # --- History recording endpoints ---
+# Trả về khi event đã vào log bền vững; DB + version (và cache Rec Service) cập nhật ở lần flush kế tiếp
 @app.post("/me/history/search")
 def record_search(item: HistoryItem, current_user: User = Depends(get_current_user)):
-    with Session(engine) as session:
-        record = SearchHistory(user_id=current_user.id, text=item.text)
-        session.add(record)
-        session.commit()
+    history_writer.append(current_user.id, current_user.username, [("search", item.text)])
     return {"ok": True}
 
 @app.post("/me/history/view")
 def record_view(item: HistoryItem, current_user: User = Depends(get_current_user)):
-    with Session(engine) as session:
-        record = ViewHistory(user_id=current_user.id, text=item.text)
-        session.add(record)
-        session.commit()
+    history_writer.append(current_user.id, current_user.username, [("view", item.text)])
     return {"ok": True}
 
+@app.post("/me/history/batch")
+def record_batch(batch: HistoryBatch, current_user: User = Depends(get_current_user)):
+    """
+    Nhận JSON: { "events": [ {"kind": "search" | "view", "text": "..."}, ... ] } (cũ → mới).
+    Ghi nhiều event trong 1 request, giữ nguyên thứ tự.
+    """
+    if len(batch.events) > HISTORY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({len(batch.events)} > {HISTORY_BATCH_MAX})")
+    accepted = history_writer.append(
+        current_user.id, current_user.username, [(e.kind, e.text) for e in batch.events]
+    )
+    return {"ok": True, "accepted": accepted}
+
+@app.get("/auth/stats")
+def auth_stats():
+    # Pool bcrypt (đang chờ / từ chối) + hit rate của cache token → user
+    return {"hasher": hasher.stats(), "token_cache": token_cache.stats()}
+
+@app.get("/history/writer/stats")
+def history_writer_stats():
+    # Độ sâu queue, số lần flush / số dòng đã ghi, số event ghi lại từ log lúc start
+    return history_writer.stats()
+
 # --- History retrieval endpoints ---
+def _since_utc(since: Optional[datetime]) -> Optional[datetime]:
+    # created_at lưu dạng UTC naive (datetime.utcnow)
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+def _history_select(model, limit: int, since: Optional[datetime], user_id: int = None, username: str = None):
+    """Top `limit` item mới nhất (created_at > since), lọc theo user_id hoặc JOIN theo username."""
+    stmt = select(model.text, model.created_at)
+    if username is not None:
+        stmt = stmt.join(User, User.id == model.user_id).where(User.username == username)
+    else:
+        stmt = stmt.where(model.user_id == user_id)
+    since = _since_utc(since)
+    if since is not None:
+        stmt = stmt.where(model.created_at > since)
+    return stmt.order_by(model.created_at.desc()).limit(limit)
+
+def _to_items(rows) -> List[HistoryItem]:
+    return [HistoryItem(text=text, created_at=created_at.isoformat()) for text, created_at in rows]
+
+def read_history(model, limit: int, since: Optional[datetime], user_id: int = None,
+                 username: str = None) -> List[HistoryItem]:
+    with Session(read_engine) as session:
+        rows = session.exec(_history_select(model, limit, since, user_id=user_id, username=username)).all()
+    # JOIN theo username không phân biệt "user không tồn tại" với "chưa có history"
+    if not rows and username is not None and not get_user(username):
+        raise HTTPException(status_code=404, detail="User not found")
+    return _to_items(rows)
+
+def limit_query(default: int):
+    return Query(default, ge=1, le=HISTORY_MAX_LIMIT, description="Số item mới nhất tối đa")
+
+SINCE_QUERY = Query(None, description="Chỉ lấy item có created_at sau thời điểm này (ISO 8601)")
+
 @app.get("/me/history/search", response_model=List[HistoryItem])
-def get_search_history(current_user: User = Depends(get_current_user)):
-    with Session(engine) as session:
-        rows = session.exec(
-            select(SearchHistory)
-            .where(SearchHistory.user_id == current_user.id)
-            .order_by(SearchHistory.created_at.desc())
-        ).all()
-    return [
-        HistoryItem(text=r.text, created_at=r.created_at.isoformat())
-        for r in rows
-    ]
+def get_search_history(limit: int = limit_query(HISTORY_ME_LIMIT), since: Optional[datetime] = SINCE_QUERY,
+                       current_user: User = Depends(get_current_user)):
+    return read_history(SearchHistory, limit, since, user_id=current_user.id)
 
 @app.get("/me/history/view", response_model=List[HistoryItem])
-def get_view_history(current_user: User = Depends(get_current_user)):
-    with Session(engine) as session:
-        rows = session.exec(
-            select(ViewHistory)
-            .where(ViewHistory.user_id == current_user.id)
-            .order_by(ViewHistory.created_at.desc())
-        ).all()
-    return [
-        HistoryItem(text=r.text, created_at=r.created_at.isoformat())
-        for r in rows
-    ]
-
-# … import sẵn HistoryItem, get_user, Session, select, SearchHistory, ViewHistory …
+def get_view_history(limit: int = limit_query(HISTORY_ME_LIMIT), since: Optional[datetime] = SINCE_QUERY,
+                     current_user: User = Depends(get_current_user)):
+    return read_history(ViewHistory, limit, since, user_id=current_user.id)
 
-@app.get("/users/{username}/history/search", response_model=List[HistoryItem])
-def get_search_history_by_username(username: str):
-    user = get_user(username)
-    if not user:
+@app.get("/users/{username}/history", response_model=UserHistory)
+def get_history_by_username(username: str, limit: int = limit_query(HISTORY_DEFAULT_LIMIT),
+                            since: Optional[datetime] = SINCE_QUERY):
+    """
+    Search + view history của user trong 1 request (Rec Service gọi cho mỗi /recommend):
+    1 câu UNION ALL, mỗi nhánh JOIN user theo username và LIMIT riêng.
+    """
+    search = _history_select(SearchHistory, limit, since, username=username).subquery()
+    view = _history_select(ViewHistory, limit, since, username=username).subquery()
+    stmt = union_all(
+        select(literal("search").label("kind"), search.c.text, search.c.created_at),
+        select(literal("view").label("kind"), view.c.text, view.c.created_at),
+    ).order_by(literal_column("kind"), literal_column("created_at").desc())
+    with Session(read_engine) as session:
+        rows = session.execute(stmt).all()
+    if not rows and not get_user(username):
         raise HTTPException(status_code=404, detail="User not found")
-    with Session(engine) as session:
-        rows = session.exec(
-            select(SearchHistory)
-            .where(SearchHistory.user_id == user.id)
-            .order_by(SearchHistory.created_at.desc())
-        ).all()
-    return [
-        HistoryItem(text=r.text, created_at=r.created_at.isoformat())
-        for r in rows
-    ]
+    return UserHistory(
+        username=username,
+        search_history=_to_items((t, c) for kind, t, c in rows if kind == "search"),
+        view_history=_to_items((t, c) for kind, t, c in rows if kind == "view"),
+    )
+
+@app.get("/users/{username}/history/search", response_model=List[HistoryItem])
+def get_search_history_by_username(username: str, limit: int = limit_query(HISTORY_DEFAULT_LIMIT),
+                                   since: Optional[datetime] = SINCE_QUERY):
+    return read_history(SearchHistory, limit, since, username=username)
 
 @app.get("/users/{username}/history/view", response_model=List[HistoryItem])
-def get_view_history_by_username(username: str):
+def get_view_history_by_username(username: str, limit: int = limit_query(HISTORY_DEFAULT_LIMIT),
+                                 since: Optional[datetime] = SINCE_QUERY):
+    return read_history(ViewHistory, limit, since, username=username)
+
+@app.get("/users/{username}/history/version")
+def get_history_version_by_username(username: str):
     user = get_user(username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    with Session(engine) as session:
-        rows = session.exec(
-            select(ViewHistory)
-            .where(ViewHistory.user_id == user.id)
-            .order_by(ViewHistory.created_at.desc())
-        ).all()
-    return [
-        HistoryItem(text=r.text, created_at=r.created_at.isoformat())
-        for r in rows
-    ]
+    with Session(read_engine) as session:
+        row = session.get(HistoryVersion, user.id)
+    return {"username": username, "version": row.version if row else 0}
@@ -0,0 +1,122 @@
+# services/user/bench_auth.py
+"""
+Benchmark tải cho User Service đang chạy: /login và /me/history/*.
+
+  login          POST /login (form user/password) → bcrypt verify mỗi lần
+  history-read   GET  /me/history/search?limit=20 với 1 token → get_current_user + SELECT
+  history-write  POST /me/history/view              với 1 token → get_current_user + ghi history
+
+Mỗi kịch bản chạy --duration giây với --concurrency thread, mỗi thread giữ 1 kết nối
+keep-alive (http.client, không cần thư viện ngoài). In req/s, p50/p99 và số lỗi (status != 200).
+
+    python bench_auth.py --url http://localhost:8003 --concurrency 32 --duration 10
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+SCENARIOS = ("login", "history-read", "history-write")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _login(conn, username, password) -> str:
+    body = urlencode({"username": username, "password": password})
+    conn.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    resp = conn.getresponse()
+    data = resp.read()
+    if resp.status != 200:
+        raise SystemExit(f"login failed: {resp.status} {data[:200]!r}")
+    return json.loads(data)["access_token"]
+
+
+def _run(url: str, scenario: str, concurrency: int, duration: float, username: str, password: str) -> dict:
+    parts = urlsplit(url)
+    setup = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    token = _login(setup, username, password)
+    setup.close()
+    auth = {"Authorization": f"Bearer {token}"}
+    form = urlencode({"username": username, "password": password})
+
+    latencies, lock = [], threading.Lock()
+    counts = {"ok": 0, "errors": 0}
+    stop = time.time() + duration
+
+    def worker(wid):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        mine, ok, errors, i = [], 0, 0, 0
+        while time.time() < stop:
+            if scenario == "login":
+                args = ("POST", "/login", form, {"Content-Type": "application/x-www-form-urlencoded"})
+            elif scenario == "history-read":
+                args = ("GET", "/me/history/search?limit=20", None, auth)
+            else:
+                body = json.dumps({"text": f"bench {wid}-{i}"})
+                args = ("POST", "/me/history/view", body, {**auth, "Content-Type": "application/json"})
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                conn.request(*args)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                status = 0
+            mine.append(time.perf_counter() - t0)
+            if status == 200:
+                ok += 1
+            else:
+                errors += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            counts["ok"] += ok
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    return {
+        "scenario": scenario,
+        "rps": counts["ok"] / elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for /login and /me/history/* of the user service")
+    parser.add_argument("--url", default="http://localhost:8003")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--username", default="user")
+    parser.add_argument("--password", default="user")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="chạy riêng kịch bản này (lặp lại được); mặc định chạy cả 3")
+    args = parser.parse_args()
+
+    results = [_run(args.url, s, args.concurrency, args.duration, args.username, args.password)
+               for s in (args.scenario or SCENARIOS)]
+    print(f"{'scenario':<15}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['scenario']:<15}{r['rps']:>10.0f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# services/user/history_writer.py
+"""
+Write-behind cho search/view history.
+
+Trước: mỗi POST /me/history/* mở 1 session, INSERT 1 dòng và commit (1 transaction / event).
+Giờ:
+  • append(): ghi event vào log append-only (1 dòng JSON, có seq tăng dần) rồi đưa vào queue
+    trong RAM; fsync log theo kiểu group commit (nhiều request đồng thời chung 1 fsync).
+    Request trả về ngay khi event đã nằm trong log.
+  • Thread flusher: cứ HISTORY_FLUSH_MS ms hoặc khi queue đủ HISTORY_FLUSH_ROWS event thì
+    INSERT cả lô + tăng HistoryVersion trong 1 transaction, kèm checkpoint = seq cuối đã ghi.
+  • Crash: lúc start, event trong log có seq > checkpoint được ghi lại vào SQLite (không nhân đôi).
+    Log được cắt về rỗng mỗi khi queue đã flush hết.
+
+Hệ quả: history/version đọc từ DB trễ tối đa ~HISTORY_FLUSH_MS so với lúc ghi.
+
+Chỉ hỗ trợ 1 writer cho mỗi log: start() giữ flock độc quyền trên file log suốt vòng đời,
+process thứ 2 dùng cùng HISTORY_LOG_PATH (vd uvicorn --workers > 1) sẽ lỗi ngay lúc startup
+thay vì cắt mất log của process kia. Chạy nhiều worker thì mỗi worker cần HISTORY_LOG_PATH riêng.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from common.db import connect
+
+FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "200"))
+FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "500"))
+# always: fsync log trước khi trả lời (không mất event kể cả mất điện)
+# off   : chỉ flush xuống OS (không mất event khi process chết, có thể mất khi máy sập)
+LOG_FSYNC = os.getenv("HISTORY_LOG_FSYNC", "always")
+
+TABLES = {"search": "searchhistory", "view": "viewhistory"}
+
+CREATE_CHECKPOINT = """
+CREATE TABLE IF NOT EXISTS history_log_checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL
+)
+"""
+
+
+@dataclass
+class HistoryEvent:
+    seq: int
+    kind: str           # "search" | "view"
+    user_id: int
+    username: str
+    text: str
+    created_at: datetime
+
+    def to_line(self) -> str:
+        return json.dumps({
+            "seq": self.seq, "kind": self.kind, "user_id": self.user_id, "username": self.username,
+            "text": self.text, "created_at": self.created_at.isoformat(),
+        }, ensure_ascii=False) + "\n"
+
+    @classmethod
+    def from_line(cls, line: str) -> "HistoryEvent":
+        d = json.loads(line)
+        return cls(d["seq"], d["kind"], d["user_id"], d["username"], d["text"],
+                   datetime.fromisoformat(d["created_at"]))
+
+
+class HistoryWriter:
+    def __init__(self, db_path: str, log_path: str,
+                 flush_ms: int = FLUSH_MS,
+                 flush_rows: int = FLUSH_ROWS,
+                 fsync: bool = LOG_FSYNC != "off",
+                 on_flushed: Optional[Callable[[Dict[str, int]], None]] = None):
+        self.db_path = db_path
+        self._conn = None   # kết nối ghi riêng của writer (chỉ flusher / start / close dùng)
+        self.log_path = log_path
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        # username → version mới sau mỗi lần flush (để báo Rec Service xoá cache)
+        self.on_flushed = on_flushed
+        self._lock = threading.Lock()          # queue + log + seq
+        self._sync_lock = threading.Lock()     # group commit fsync
+        self._flush_lock = threading.Lock()    # 1 flush tại 1 thời điểm
+        self._wake = threading.Event()
+        self._stop = False
+        self._queue: List[HistoryEvent] = []
+        self._log = None
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+        self._written = 0   # seq cuối đã ghi vào log (chưa chắc fsync)
+        self._synced = 0    # seq cuối đã fsync
+        self._last_created: Optional[datetime] = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.replayed = 0
+
+    # ---------- vòng đời ----------
+    def start(self):
+        """Khoá log, tạo bảng checkpoint, ghi lại event còn trong log (sau crash) rồi chạy flusher."""
+        # "a+": không cắt file trước khi có khoá (process khác có thể đang giữ log này)
+        log = open(self.log_path, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.close()
+            raise RuntimeError(
+                f"History log {self.log_path} is locked by another process; "
+                "only one history writer per log is supported (set a separate HISTORY_LOG_PATH per worker)"
+            )
+        self._log = log
+        self._conn = connect(self.db_path)
+        if self.fsync:
+            # Log bị cắt sau mỗi lô → commit của lô phải bền cả khi mất điện (WAL + NORMAL thì không)
+            self._conn.execute("PRAGMA synchronous=FULL")
+        with self._conn:
+            self._conn.execute(CREATE_CHECKPOINT)
+            row = self._conn.execute("SELECT seq FROM history_log_checkpoint WHERE id = 1").fetchone()
+        checkpoint = row[0] if row else 0
+        self._seq = checkpoint
+
+        pending = []
+        self._log.seek(0)
+        for line in self._log:
+            try:
+                event = HistoryEvent.from_line(line)
+            except (ValueError, KeyError):
+                continue  # dòng cuối ghi dở lúc crash
+            self._seq = max(self._seq, event.seq)
+            if event.seq > checkpoint:
+                pending.append(event)
+        if pending:
+            self._write(pending)
+            self.replayed = len(pending)
+            print(f"✅ Replayed {len(pending)} history events from {self.log_path}")
+
+        # Mọi event trong log đã nằm trong DB → bắt đầu log mới
+        self._log.seek(0)
+        self._log.truncate()
+        self._written = self._synced = self._seq
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Dừng flusher, ghi nốt queue vào DB."""
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        if self._log is not None:
+            self._log.close()   # nhả flock
+            self._log = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---------- ghi ----------
+    def _next_created_at(self) -> datetime:
+        # Tăng ngặt → thứ tự ORDER BY created_at khớp thứ tự ghi, kể cả nhiều event cùng lúc
+        now = datetime.utcnow()
+        if self._last_created is not None and now <= self._last_created:
+            now = self._last_created + timedelta(microseconds=1)
+        self._last_created = now
+        return now
+
+    def append(self, user_id: int, username: str, items: List[tuple]) -> int:
+        """items: [(kind, text), ...]. Trả về khi các event đã nằm trong log (bền vững)."""
+        with self._lock:
+            events = []
+            for kind, text in items:
+                if kind not in TABLES:
+                    raise ValueError(f"Unknown history kind: {kind}")
+                self._seq += 1
+                events.append(HistoryEvent(self._seq, kind, user_id, username, text, self._next_created_at()))
+            self._log.write("".join(e.to_line() for e in events))
+            self._log.flush()
+            self._written = self._seq
+            self._queue.extend(events)
+            target, queued = self._written, len(self._queue)
+        if self.fsync:
+            self._sync_log(target)
+        if queued >= self.flush_rows:
+            self._wake.set()
+        return len(events)
+
+    def _sync_log(self, target: int):
+        # Group commit: request tới sau khi 1 fsync đang chạy thì chờ, thường đã được fsync đó phủ
+        with self._sync_lock:
+            if self._synced >= target:
+                return
+            with self._lock:
+                upto = self._written
+                fd = self._log.fileno()
+            os.fsync(fd)
+            self._synced = max(self._synced, upto)
+
+    # ---------- flush ----------
+    def _run(self):
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # event vẫn còn trong queue + log, lần sau thử lại
+                print(f"[ERROR] History flush failed: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch = self._queue[:]
+            if not batch:
+                return 0
+            versions = self._write(batch)
+            with self._lock:
+                del self._queue[:len(batch)]
+                if not self._queue:
+                    # Đã ghi hết vào DB → cắt log (seq vẫn tăng tiếp, checkpoint đã lưu trong DB)
+                    self._log.seek(0)
+                    self._log.truncate()
+            self.flushes += 1
+            self.rows_flushed += len(batch)
+        if self.on_flushed and versions:
+            self.on_flushed(versions)
+        return len(batch)
+
+    def _write(self, batch: List[HistoryEvent]) -> Dict[str, int]:
+        """INSERT cả lô + tăng HistoryVersion + checkpoint trong 1 transaction; trả về username → version."""
+        rows = defaultdict(list)
+        counts: Dict[int, int] = defaultdict(int)
+        usernames: Dict[int, str] = {}
+        for e in batch:
+            # cùng định dạng DateTime mà SQLAlchemy ghi cho SQLite
+            rows[e.kind].append((e.user_id, e.text, e.created_at.strftime("%Y-%m-%d %H:%M:%S.%f")))
+            counts[e.user_id] += 1
+            usernames[e.user_id] = e.username
+        conn = self._conn
+        with conn:
+            for kind, values in rows.items():
+                conn.executemany(
+                    f"INSERT INTO {TABLES[kind]} (user_id, text, created_at) VALUES (?, ?, ?)", values
+                )
+            conn.executemany(
+                "INSERT INTO historyversion (user_id, version) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET version = version + excluded.version",
+                list(counts.items()),
+            )
+            conn.execute(
+                "INSERT INTO history_log_checkpoint (id, seq) VALUES (1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                (batch[-1].seq,),
+            )
+            versions = []
+            user_ids = list(counts)
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                versions += conn.execute(
+                    f"SELECT user_id, version FROM historyversion WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        return {usernames[uid]: version for uid, version in versions}
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "flush_ms": int(self.flush_interval * 1000),
+            "flush_rows": self.flush_rows,
+            "fsync": self.fsync,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "replayed": self.replayed,
+            "last_seq": self._written,
+        }
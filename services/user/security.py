@@ -0,0 +1,126 @@
+# services/user/security.py
+"""
+Phần tốn kém lặp lại của auth trong User Service.
+
+  • PasswordHasher: bcrypt_sha256 (hàng trăm ms mỗi lần) chạy trên pool riêng có giới hạn;
+    handler async chỉ await nên threadpool của FastAPI không bị chiếm. Quá HASH_MAX_PENDING
+    lượt đang chạy/chờ → HasherBusy (503) thay vì xếp hàng vô hạn.
+    bcrypt nhả GIL khi hash nên pool thread là đủ; HASH_POOL=process để dùng process riêng.
+  • TokenCache: token → User trong tối đa TOKEN_CACHE_TTL giây và không quá exp của JWT,
+    request mang token đã gặp không phải decode JWT + SELECT user mỗi lần.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Optional, Tuple
+
+from passlib.context import CryptContext
+
+HASH_POOL = os.getenv("HASH_POOL", "thread")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "64"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+
+
+# Hàm cấp module để chạy được cả trên ProcessPoolExecutor (pickle theo tên)
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING, kind: str = HASH_POOL):
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        # Chỉ đổi trên event loop → không cần lock
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy(f"Password hasher busy ({self._pending} pending)")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self._pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"pool": self.kind, "workers": self.workers, "max_pending": self.max_pending,
+                "pending": self._pending, "completed": self.completed, "rejected": self.rejected}
+
+
+class TokenCache:
+    """LRU token → user, mỗi mục hết hạn ở min(lúc put + ttl, exp của token)."""
+
+    def __init__(self, ttl: float = TOKEN_CACHE_TTL, max_size: int = TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Any]:
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(token)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._items[token]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user: Any, expires_at: Optional[float] = None):
+        if self.ttl <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._items[token] = (deadline, user)
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"ttl": self.ttl, "size": len(self._items), "max_size": self.max_size,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,97 @@
+# services/user/tests/test_history_writer.py
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from history_writer import HistoryWriter
+
+SCHEMA = """
+CREATE TABLE searchhistory (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT, created_at DATETIME);
+CREATE TABLE viewhistory (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT, created_at DATETIME);
+CREATE TABLE historyversion (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL);
+"""
+
+
+@pytest.fixture
+def paths(tmp_path):
+    db_path = tmp_path / "users.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(SCHEMA)
+    return str(db_path), str(tmp_path / "history.log")
+
+
+def query(db_path, sql):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def crash(writer: HistoryWriter):
+    """Dừng flusher mà không ghi queue vào DB (giống process bị kill)."""
+    writer.flush = lambda: 0
+    writer._stop = True
+    writer._wake.set()
+    writer._thread.join()
+    writer._log.close()
+    writer._conn.close()
+
+
+def test_flush_writes_rows_and_bumps_version(paths):
+    db_path, log_path = paths
+    notified = []
+    writer = HistoryWriter(db_path, log_path, flush_ms=60000, on_flushed=notified.append)
+    writer.start()
+    writer.append(1, "alice", [("search", "usb cable"), ("view", "B001"), ("search", "mouse")])
+    assert query(db_path, "SELECT COUNT(*) FROM searchhistory") == [(0,)]
+
+    assert writer.flush() == 3
+    assert query(db_path, "SELECT text FROM searchhistory ORDER BY created_at") == [("usb cable",), ("mouse",)]
+    assert query(db_path, "SELECT text FROM viewhistory") == [("B001",)]
+    assert query(db_path, "SELECT user_id, version FROM historyversion") == [(1, 3)]
+    assert notified == [{"alice": 3}]
+    assert Path(log_path).read_text() == ""   # queue rỗng → log bị cắt
+    writer.close()
+
+
+def test_replay_after_unclean_shutdown(paths):
+    db_path, log_path = paths
+    writer = HistoryWriter(db_path, log_path, flush_ms=60000)
+    writer.start()
+    writer.append(1, "alice", [("search", "flushed")])
+    writer.flush()
+    writer.append(1, "alice", [("search", "lost 1"), ("view", "lost 2")])
+    crash(writer)
+    assert query(db_path, "SELECT COUNT(*) FROM viewhistory") == [(0,)]
+
+    writer = HistoryWriter(db_path, log_path, flush_ms=60000)
+    writer.start()
+    assert writer.replayed == 2
+    assert query(db_path, "SELECT text FROM searchhistory ORDER BY created_at") == [("flushed",), ("lost 1",)]
+    assert query(db_path, "SELECT text FROM viewhistory") == [("lost 2",)]
+    assert query(db_path, "SELECT version FROM historyversion WHERE user_id = 1") == [(3,)]
+    writer.close()
+
+    # Khởi động lại lần nữa không ghi lặp
+    writer = HistoryWriter(db_path, log_path, flush_ms=60000)
+    writer.start()
+    assert writer.replayed == 0
+    assert query(db_path, "SELECT COUNT(*) FROM searchhistory") == [(2,)]
+    writer.close()
+
+
+def test_second_writer_on_same_log_is_rejected(paths):
+    db_path, log_path = paths
+    writer = HistoryWriter(db_path, log_path, flush_ms=60000)
+    writer.start()
+    writer.append(1, "alice", [("search", "pending")])
+
+    other = HistoryWriter(db_path, log_path, flush_ms=60000)
+    with pytest.raises(RuntimeError):
+        other.start()
+    # Log của writer đầu không bị cắt
+    assert "pending" in Path(log_path).read_text()
+    writer.close()
+    assert query(db_path, "SELECT text FROM searchhistory") == [("pending",)]